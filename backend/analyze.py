@@ -1,11 +1,14 @@
 import argparse
-from openai import OpenAI
 import os
 import json
 import subprocess
 import re
 from tools.generate_doc_tree import *
 from tools.video_transformer import *
+from tools.audio_segments import *
+from tools.vad import *
+from tools.retry import run_requeueable
+from tools.subtitles import SubtitleTrack
 from tools.generate_video_tree import *
 from tools.generate_report import *
 from tools.new_outline import *
@@ -40,6 +43,61 @@ CUSTOM_STEP_NAMES = {
     7: "处理完成"
 }
 
+def load_checkpoint(output_dir):
+    """读取上次运行保存的已完成步骤结果"""
+    path = os.path.join(output_dir, 'checkpoint.json')
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+def resume_stage(checkpoint, output_dir, name, func, *args, dump=None, load=None):
+    """
+    执行步骤前先查找已保存的结果，完成后保存到 checkpoint.json，任务在批次结果返回或服务恢复后
+    重新运行时不必重复字幕转录等已完成的步骤。checkpoint 为 None 时直接执行。
+    dump/load: 结果与 json 之间的转换
+    """
+    if checkpoint is None:
+        return func(*args)
+    if name in checkpoint:
+        print(f'使用已保存的结果: {name}')
+        return load(checkpoint[name]) if load else checkpoint[name]
+    value = func(*args)
+    checkpoint[name] = dump(value) if dump else value
+    with open(os.path.join(output_dir, 'checkpoint.json'), 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+    return value
+
+def transcribe_video(video_path, progress_monitor):
+    """视频转音频并转录字幕，返回字幕轨"""
+    # 1. 视频转音频
+    progress_monitor.update_step(1, "视频转音频")
+    # 长视频在静音处切分，各段并行编码并作为独立订单并发转录
+    segmented = use_segmented_asr(progress_monitor.audio_duration)
+    time_map = None
+    if segmented:
+        audio_segments = generate_audio_segments(video_path)
+    else:
+        audio_path = generate_audio(video_path)
+    # 上传前去除静音，字幕时间通过 time_map 映射回原视频时间
+    if vad_enabled():
+        if segmented:
+            audio_segments = trim_segments_silence(audio_segments)
+        else:
+            audio_path, time_map = trim_silence(audio_path)
+    print('视频转音频成功')
+
+    # 2. 转录字幕（转录服务由配置 asr_backend 选择）
+    progress_monitor.update_step(2, "字幕转录")
+    asr_backend = get_asr_backend()
+    if segmented:
+        subtitles = generate_subtitles_segmented(audio_segments, backend=asr_backend)
+    else:
+        duration = time_map.trimmed_duration / 1000 if time_map else progress_monitor.audio_duration
+        subtitles = generate_subtitles(audio_path, time_map=time_map, duration=duration, backend=asr_backend)
+    print('字幕转录成功...')
+    return subtitles
+
 @custom_dynamic_progress_monitor(
     time_ratios=CUSTOM_TIME_RATIOS,
     step_names=CUSTOM_STEP_NAMES
@@ -52,29 +110,26 @@ def analyze_content(video_path, outline_path, progress_monitor=None, output_dir=
         # output_dir = os.path.dirname(video_path)
         output_dir = video_path
 
+    # 各步骤的结果保存在 checkpoint.json 中，等待批次结果或服务恢复后重新运行时从未完成的步骤继续
+    checkpoint = load_checkpoint(output_dir)
+
     try:
         print(f'------{video_path}')
-        # 1. 视频转音频
-        progress_monitor.update_step(1, "视频转音频")
-        generate_audio(video_path)
-        print('视频转音频成功')
-
-        # 2. 转录字幕
-        progress_monitor.update_step(2, "字幕转录")
-        audio_path = os.path.join(video_path, 'audio.mp3')
-        subtitles = generate_subtitles(audio_path)
-
-        print('字幕转录成功...')
+        # 1~2. 视频转音频、转录字幕
+        subtitles = resume_stage(checkpoint, output_dir, 'subtitles', transcribe_video, video_path, progress_monitor,
+                                 dump=lambda track: track.to_dicts(), load=SubtitleTrack.from_dicts)
 
         # 3. 生成视频图谱
         progress_monitor.update_step(3, "生成视频知识图谱")
-        video_tree = generate_video_tree(subtitles)
+        # 模型服务全部熔断时整个步骤交还调度，服务恢复后任务从这里重新运行，而不是在各次调用中反复重试
+        video_tree = resume_stage(checkpoint, output_dir, 'video_tree', run_requeueable, generate_video_tree, subtitles)
         print('视频图谱生成成功...')
 
         # 4. 生成教案图谱（动态步骤）
         if outline_path is not None:
             progress_monitor.update_step(4, "生成教案知识图谱")
-            outline_tree = generate_document_tree(outline_path)
+            outline_tree = resume_stage(checkpoint, output_dir, 'outline_tree', run_requeueable,
+                                        generate_document_tree, outline_path)
             print('教案图谱生成成功...')
         else:
             # 跳过教案图谱生成
@@ -84,12 +139,13 @@ def analyze_content(video_path, outline_path, progress_monitor=None, output_dir=
 
         # 5. 生成新教案
         progress_monitor.update_step(5, "生成新教案")
-        new_outline = generate_outline(subtitles, video_tree)
+        new_outline = resume_stage(checkpoint, output_dir, 'new_outline', run_requeueable,
+                                   generate_outline, subtitles, video_tree)
         print('新教案生成成功...')
 
         # 6. 生成报告
         progress_monitor.update_step(6, "生成教学内容分析报告")
-        report = generate_report(subtitles, video_tree, outline_tree)
+        report = run_requeueable(generate_report, subtitles, video_tree, outline_tree)
         print('教学内容分析报告生成成功...')
 
         # 7. 完成
@@ -97,7 +153,7 @@ def analyze_content(video_path, outline_path, progress_monitor=None, output_dir=
 
         print(f"视频处理完成")
         result = {
-            'subtitles': subtitles,
+            'subtitles': subtitles.to_dicts(),
             'video_tree': video_tree,
             'outline_tree': outline_tree,
             'analysis': report,
@@ -110,12 +166,15 @@ def analyze_content(video_path, outline_path, progress_monitor=None, output_dir=
             json.dump(result, f, ensure_ascii=False, indent=2)
         
         print(f"结果已保存至: {result_file}")
+        if os.path.exists(os.path.join(output_dir, 'checkpoint.json')):
+            os.remove(os.path.join(output_dir, 'checkpoint.json'))
         print(f"进度日志已保存至: {progress_monitor.log_file_path}")
 
         return result
     
     except Exception as e:
-        progress_monitor.update_step(0, f"处理失败: {str(e)}")
+        if not (getattr(e, 'batch_pending', False) or getattr(e, 'task_requeued', False)):
+            progress_monitor.update_step(0, f"处理失败: {str(e)}")
         raise e
 
 # # 测试用
@@ -2,15 +2,21 @@ import logging
 from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
 import os
+import time
 import threading
 from datetime import datetime
 from werkzeug.utils import secure_filename
 
 # 导入分析函数和工具函数
 from analyze import analyze_content
+from tools.asr_poller import notify_asr_order
+from tools.background_loop import call_later
+from tools.llm_gateway import get_llm_gateway
+from tools.llm_router import get_llm_router
+from tools.llm_usage import merge_usage
 from utils import (
     allowed_file, generate_task_id, create_task_folder, save_basic_info, 
-    read_basic_info, get_task_status, get_task_progress, scan_existing_tasks,
+    read_basic_info, get_task_status, get_task_progress, get_task_usage, scan_existing_tasks,
     get_all_tasks_from_fs, ALLOWED_VIDEO_EXTENSIONS, ALLOWED_OUTLINE_EXTENSIONS
 )
 
@@ -47,6 +53,15 @@ os.makedirs(FRONTEND_DIR, exist_ok=True)
 active_tasks = {}
 task_lock = threading.Lock()
 
+def start_analysis(task_id, folder_path, outline_path):
+    """在新线程中启动分析任务"""
+    analysis_thread = threading.Thread(
+        target=run_analysis,
+        args=(task_id, folder_path, outline_path),
+        daemon=True
+    )
+    analysis_thread.start()
+
 def run_analysis(task_id, folder_path, outline_path):
     """运行分析任务的线程函数"""
     try:
@@ -66,6 +81,14 @@ def run_analysis(task_id, folder_path, outline_path):
         print(f"✅ 分析任务完成 {task_id}")
         
     except Exception as e:
+        if getattr(e, 'task_requeued', False):
+            # 模型服务暂时全部不可用：本次运行结束并释放线程，到预计恢复的时间再从中断的步骤重新运行
+            print(f"⏸ 分析任务等待服务恢复 {task_id}: {e}")
+            call_later(max(0.0, e.retry_at - time.time()), start_analysis, task_id, folder_path, outline_path)
+            with task_lock:
+                if task_id in active_tasks:
+                    active_tasks[task_id]['status'] = "等待服务恢复"
+            return
         print(f"❌ 分析任务失败 {task_id}: {e}")
         with task_lock:
             if task_id in active_tasks:
@@ -206,12 +229,7 @@ def upload_video():
             }
         
         # 启动分析任务
-        analysis_thread = threading.Thread(
-            target=run_analysis,
-            args=(task_id, folder_path, outline_save_path),
-            daemon=True
-        )
-        analysis_thread.start()
+        start_analysis(task_id, folder_path, outline_save_path)
         
         return jsonify({
             "success": True,
@@ -285,7 +303,8 @@ def get_task(task_id):
                     "upload_time": task_data['upload_time'],
                     "status": task_data['status'],
                     "progress": task_data['progress'],
-                    "folder_path": folder_path
+                    "folder_path": folder_path,
+                    "llm_usage": get_task_usage(folder_path) if folder_path else None
                 }
             })
         
@@ -328,6 +347,47 @@ def get_task_progress_api(task_id):
             "message": f"获取任务进度失败: {str(e)}"
         }), 500
 
+@app.route('/api/usage/summary', methods=['GET'])
+def get_usage_summary():
+    """所有任务的模型用量汇总：按步骤合计、总计、平均每个任务的用量，以及费用最高的任务"""
+    try:
+        usages = {}
+        for folder_name in os.listdir(DATA_DIR):
+            folder_path = os.path.join(DATA_DIR, folder_name)
+            task_id = folder_name.split('_')[0]
+            if os.path.isdir(folder_path) and '_' in folder_name and task_id.isdigit():
+                usages[task_id] = get_task_usage(folder_path)
+
+        summary = merge_usage(usages.values())
+        limit = request.args.get('top', 10, type=int)
+        summary['top_tasks'] = [
+            {"task_id": task_id, **usage['total']}
+            for task_id, usage in sorted(usages.items(), key=lambda item: item[1]['total']['cost'], reverse=True)[:limit]
+            if usage['stages']
+        ]
+        return jsonify({
+            "success": True,
+            "data": summary
+        })
+
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"获取用量汇总失败: {str(e)}"
+        }), 500
+
+# 讯飞转录完成回调
+@app.route('/api/asr/callback', methods=['GET', 'POST'])
+def asr_callback():
+    """转录订单完成或失败时由讯飞调用，唤醒轮询器立即获取结果"""
+    order_id = request.args.get('orderId', '')
+    status = request.args.get('status', '')
+    if not order_id:
+        return jsonify({"success": False, "message": "缺少orderId"}), 400
+    known = notify_asr_order(order_id)
+    log_important(f"收到转录回调: {order_id} 状态 {status}{'' if known else '（未知订单）'}")
+    return jsonify({"success": True})
+
 # 健康检查
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -336,7 +396,9 @@ def health_check():
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
         "total_tasks": len(all_tasks),
-        "active_tasks": len(active_tasks)
+        "active_tasks": len(active_tasks),
+        "llm_endpoints": get_llm_gateway().stats(),
+        "llm_routes": get_llm_router().stats.stats()
     })
 
 if __name__ == '__main__':
@@ -0,0 +1,102 @@
+import os
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from analyze import analyze_content
+from tools.llm_batch import get_batch_collector, BatchRunner
+from tools.llm_cache import cache_enabled
+from tools.task_context import PRIORITY_BULK
+from utils import read_basic_info, read_progress_log, get_task_status
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # 项目根目录
+DATA_DIR = os.path.join(BASE_DIR, 'data')
+
+
+def find_tasks(data_dir, task_ids=None, include_done=False):
+    """
+    返回需要补跑的任务 [(task_id, 文件夹, 教案路径)]。网页服务正在处理（进度日志中还没有完成条目）
+    或等待服务恢复后自动重新运行的任务不补跑，除非通过 task_ids 指定（如网页服务已在处理中途退出）。
+    """
+    tasks = []
+    for folder_name in sorted(os.listdir(data_dir)):
+        folder_path = os.path.join(data_dir, folder_name)
+        task_id = folder_name.split('_')[0]
+        if not (os.path.isdir(folder_path) and '_' in folder_name and task_id.isdigit()):
+            continue
+        if task_ids and task_id not in task_ids:
+            continue
+        basic_info = read_basic_info(folder_path)
+        if not basic_info:
+            continue
+        if not include_done and get_task_status(folder_path) == "分析完成":
+            continue
+        progress = read_progress_log(folder_path)
+        completion = progress.get('completion') if progress else None
+        if not task_ids and progress and (completion is None or completion.get('status') == 'requeued'):
+            continue
+        outline_file = basic_info.get('outline_file')
+        tasks.append((task_id, folder_path, os.path.join(folder_path, outline_file) if outline_file else None))
+    return tasks
+
+
+def run_task(task):
+    """以批量模式运行一个任务，返回 done / pending / failed"""
+    task_id, folder_path, outline_path = task
+    try:
+        analyze_content(video_path=folder_path, outline_path=outline_path, output_dir=folder_path,
+                        priority=PRIORITY_BULK, batch=True)
+        return 'done'
+    except Exception as e:
+        if getattr(e, 'batch_pending', False):
+            return 'pending'
+        print(f"任务 {task_id} 失败: {e}")
+        return 'failed'
+
+
+def backfill(tasks, concurrency=4, max_rounds=20, poll_interval=None):
+    """
+    批量补跑：每一轮以批量模式运行所有未完成的任务，各任务未命中缓存的模型请求汇总成批次文件提交，
+    等批次全部结束、结果导入缓存后进入下一轮，任务从上次中断的步骤继续，直到没有等待批次结果的任务。
+    字幕转录等非模型步骤仍直接执行；实时上传的任务不受影响。
+    """
+    runner = BatchRunner()
+    # 上次补跑中断时已提交的批次先等待完成
+    runner.wait(poll_interval)
+    summary = {}
+    for round_index in range(1, max_rounds + 1):
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            outcomes = list(executor.map(run_task, tasks))
+        summary = {outcome: outcomes.count(outcome) for outcome in set(outcomes)}
+        print(f"第 {round_index} 轮：{summary}")
+        tasks = [task for task, outcome in zip(tasks, outcomes) if outcome == 'pending']
+        files = get_batch_collector().flush()
+        if not tasks or not files:
+            break
+        for path, model, requests in files:
+            runner.submit(path, model, requests)
+        runner.wait(poll_interval)
+    if tasks:
+        print(f"仍有 {len(tasks)} 个任务等待批次结果，可再次运行补跑继续")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="通过模型服务的批量接口补跑历史任务")
+    parser.add_argument('--data-dir', default=DATA_DIR, help="任务数据目录")
+    parser.add_argument('--tasks', nargs='*', help="只补跑指定的任务 id")
+    parser.add_argument('--all', action='store_true', help="包括已完成的任务")
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('backfill_concurrency', '4')),
+                        help="同时运行的任务数（字幕转录等步骤）")
+    parser.add_argument('--max-rounds', type=int, default=20, help="最多提交的批次轮数")
+    parser.add_argument('--poll-interval', type=float, default=None, help="查询批次状态的间隔（秒）")
+    args = parser.parse_args()
+
+    if not cache_enabled():
+        parser.error("批量模式需要开启模型响应缓存（llm_cache）")
+    tasks = find_tasks(args.data_dir, args.tasks, args.all)
+    print(f"待补跑任务: {len(tasks)} 个")
+    if tasks:
+        backfill(tasks, args.concurrency, args.max_rounds, args.poll_interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,390 @@
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import resource
+import contextlib
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 对比结果时检查的指标：(路径, 数值变大是否更好)
+COMPARED_METRICS = [
+    (('throughput_tasks_per_hour',), True),
+    (('task_seconds', 'p50'), False),
+    (('task_seconds', 'p95'), False),
+    (('peak_rss_mb',), False),
+    (('threads', 'peak'), False),
+]
+
+
+def percentiles(values):
+    """返回 count、mean、p50/p95/p99（最近秩法），没有数据时各项为 None"""
+    values = sorted(values)
+    if not values:
+        return {'count': 0, 'mean': None, 'p50': None, 'p95': None, 'p99': None}
+    pick = lambda q: round(values[min(len(values) - 1, max(0, int(round(q * len(values))) - 1))], 3)
+    return {'count': len(values), 'mean': round(sum(values) / len(values), 3),
+            'p50': pick(0.5), 'p95': pick(0.95), 'p99': pick(0.99)}
+
+
+# ----------------------------- 合成输入 -----------------------------
+
+def make_video(path, duration):
+    """用 ffmpeg 生成指定时长的测试视频（黑屏 + 正弦音）"""
+    subprocess.run([
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'color=c=black:s=320x240:r=10:d={duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=16000:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac', '-shortest', path,
+    ], check=True)
+
+
+OUTLINE_LINES = ["第一章 课程导入", "1.1 基本概念", "1.2 核心定义", "第二章 典型模型", "2.1 算法步骤", "2.2 例题讲解"]
+
+
+def make_outline(path, kind):
+    """生成 docx / pptx / pdf 格式的测试教案，使用与教案解析相同的库"""
+    if kind == 'docx':
+        from docx import Document
+        document = Document()
+        for line in OUTLINE_LINES:
+            document.add_paragraph(line)
+        document.save(path)
+    elif kind == 'pptx':
+        from pptx import Presentation
+        presentation = Presentation()
+        for line in OUTLINE_LINES:
+            slide = presentation.slides.add_slide(presentation.slide_layouts[1])
+            slide.shapes.title.text = line
+            slide.placeholders[1].text = f"{line}的主要内容"
+        presentation.save(path)
+    elif kind == 'pdf':
+        import fitz
+        document = fitz.open()
+        page = document.new_page()
+        page.insert_text((72, 72), "\n".join(OUTLINE_LINES), fontname='china-s', fontsize=12)
+        document.save(path)
+    else:
+        raise ValueError(f"不支持的教案格式：{kind}")
+
+
+def prepare_tasks(work_dir, count, duration, outline_kinds):
+    """
+    在 work_dir 下按上传接口的目录结构创建 count 个任务，共用一个合成视频。
+    教案格式按 outline_kinds 轮流使用，为空时不带教案。返回 [(文件夹, 教案路径)]
+    """
+    from utils import create_task_folder, save_basic_info
+    source = os.path.join(work_dir, 'source.mp4')
+    make_video(source, duration)
+    outlines = {}
+    for kind in outline_kinds:
+        outlines[kind] = os.path.join(work_dir, f'outline.{kind}')
+        make_outline(outlines[kind], kind)
+
+    tasks = []
+    for index in range(count):
+        task_id = f"9{index:05d}"
+        folder_path, folder_name = create_task_folder(work_dir, task_id, f"benchmark_{index}")
+        shutil.copy(source, os.path.join(folder_path, 'video.mp4'))
+        outline_path = None
+        if outline_kinds:
+            kind = outline_kinds[index % len(outline_kinds)]
+            outline_path = os.path.join(folder_path, f'outline.{kind}')
+            shutil.copy(outlines[kind], outline_path)
+        save_basic_info(folder_path, {
+            "task_id": task_id, "course_name": f"benchmark_{index}", "teacher": "benchmark",
+            "student_type": "benchmark", "folder_name": folder_name,
+            "upload_time": datetime.now().isoformat(),
+            "upload_time_readable": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "video_file": "video.mp4",
+            "outline_file": os.path.basename(outline_path) if outline_path else None,
+        })
+        tasks.append((folder_path, outline_path))
+    return tasks
+
+
+# ----------------------------- 替身服务 -----------------------------
+
+def start_standin(port, extra_args):
+    """启动本地替身服务并等待端口可用，同时把后端的服务地址指向它"""
+    process = subprocess.Popen([sys.executable, os.path.join(BACKEND_DIR, 'standin_server.py'),
+                                '--port', str(port)] + extra_args, cwd=BACKEND_DIR, stdout=sys.stderr)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            break
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError("替身服务启动失败")
+            time.sleep(0.2)
+    else:
+        process.terminate()
+        raise RuntimeError("替身服务启动超时")
+    os.environ.update({
+        'base_url': f'http://127.0.0.1:{port}/v1',
+        'llm_endpoints': '[]',
+        'api_key': 'standin',
+        'asr_backend': 'xfyun',
+        'asr_xfyun_host': f'http://127.0.0.1:{port}/v2/api',
+        'asr_callback_url': '',
+        'appid': 'standin',
+        'secret_key': 'standin',
+    })
+    return process
+
+
+# ----------------------------- 运行与统计 -----------------------------
+
+class ResourceSampler:
+    """定期采样进程的线程数（Python 线程和操作系统线程）"""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def os_threads():
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('Threads:'):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.samples.append((threading.active_count(), self.os_threads()))
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        python_threads = [sample[0] for sample in self.samples]
+        os_threads = [sample[1] for sample in self.samples if sample[1] is not None]
+        return {
+            'peak': max(python_threads, default=threading.active_count()),
+            'mean': round(sum(python_threads) / len(python_threads), 1) if python_threads else None,
+            'os_peak': max(os_threads, default=None),
+        }
+
+
+REPORT_SECTIONS = ('response0', 'response1', 'response2', 'response3')
+
+
+def stage_failures(folder_path, outline_path):
+    """
+    检查任务 result.json 中各步骤的输出，返回缺失的项。部分步骤失败时返回 None 而不抛出异常
+    （retry(default=None)），只看任务是否抛出异常会把这些任务算作成功。
+    """
+    path = os.path.join(folder_path, 'result.json')
+    if not os.path.exists(path):
+        return ['result']
+    with open(path, 'r', encoding='utf-8') as f:
+        result = json.load(f)
+    failures = []
+    if not result.get('video_tree'):
+        failures.append('video_tree')
+    if outline_path and not result.get('outline_tree'):
+        failures.append('outline_tree')
+    if not result.get('new_outline'):
+        failures.append('new_outline')
+    analysis = result.get('analysis') or {}
+    for key in REPORT_SECTIONS + (('response5',) if outline_path else ()):
+        if analysis.get(key) is None:
+            failures.append(f'analysis.{key}')
+    return failures
+
+
+def run_task(task):
+    """运行一个任务，返回 (是否成功, 耗时, 缺失输出的步骤)；所有步骤都有输出才算成功"""
+    from analyze import analyze_content
+    folder_path, outline_path = task
+    start_time = time.time()
+    while True:
+        try:
+            analyze_content(video_path=folder_path, outline_path=outline_path, output_dir=folder_path)
+        except Exception as e:
+            if getattr(e, 'task_requeued', False):
+                # 与网页服务一样到预计恢复的时间后重新运行，等待时间计入任务耗时
+                time.sleep(max(0.0, e.retry_at - time.time()))
+                continue
+            print(f"任务 {os.path.basename(folder_path)} 失败: {e}")
+            return False, time.time() - start_time, []
+        failures = stage_failures(folder_path, outline_path)
+        if failures:
+            print(f"任务 {os.path.basename(folder_path)} 缺少输出: {', '.join(failures)}")
+        return not failures, time.time() - start_time, failures
+
+
+def collect_results(tasks, outcomes, wall_seconds):
+    """从各任务的 progress.json 汇总每个步骤的耗时分布和模型用量，stage_failures 为各项输出缺失的任务数"""
+    from utils import read_progress_log, get_task_usage
+    from tools.llm_usage import merge_usage
+    stage_seconds = {}
+    for folder_path, _ in tasks:
+        progress = read_progress_log(folder_path) or {}
+        for stage, metrics in (progress.get('stage_metrics') or {}).items():
+            if 'wall_seconds' in metrics:
+                stage_seconds.setdefault(stage, []).append(metrics['wall_seconds'])
+    succeeded = [seconds for ok, seconds, _ in outcomes if ok]
+    failures = {}
+    for _, _, missing in outcomes:
+        for name in missing:
+            failures[name] = failures.get(name, 0) + 1
+    return {
+        'tasks': len(tasks),
+        'succeeded': len(succeeded),
+        'failed': len(outcomes) - len(succeeded),
+        'stage_failures': failures,
+        'wall_seconds': round(wall_seconds, 3),
+        'throughput_tasks_per_hour': round(len(succeeded) * 3600 / wall_seconds, 2) if wall_seconds > 0 else None,
+        'task_seconds': percentiles(succeeded),
+        'stages': {stage: percentiles(values) for stage, values in stage_seconds.items()},
+        'llm_usage': merge_usage(get_task_usage(folder_path) for folder_path, _ in tasks),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args):
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='benchmark_')
+    os.makedirs(work_dir, exist_ok=True)
+    standin = None
+    if not args.no_standin:
+        extra = []
+        for flag in ('llm_latency', 'llm_error_rate', 'llm_rpm', 'asr_latency_ratio', 'asr_fail_rate', 'seed'):
+            value = getattr(args, flag)
+            if value is not None:
+                extra += [f"--{flag.replace('_', '-')}", str(value)]
+        standin = start_standin(args.port, extra)
+    if not args.cache:
+        # 合成任务的输入相同，开启缓存时除第一个任务外都会命中，测不出真实负载
+        os.environ['llm_cache'] = 'off'
+
+    try:
+        # 服务地址等配置要在导入分析模块之前设置好
+        import analyze  # noqa: F401
+        tasks = prepare_tasks(work_dir, args.tasks, args.duration, args.outlines)
+        print(f"开始压测：{args.tasks} 个任务，并发 {args.concurrency}，视频时长 {args.duration} 秒，目录 {work_dir}")
+        sampler = ResourceSampler()
+        sampler.start()
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            outcomes = list(executor.map(run_task, tasks))
+        wall_seconds = time.time() - start_time
+        threads = sampler.stop()
+
+        result = {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(),
+            'config': {'tasks': args.tasks, 'concurrency': args.concurrency, 'duration': args.duration,
+                       'outlines': args.outlines, 'standin': not args.no_standin, 'cache': args.cache},
+            **collect_results(tasks, outcomes, wall_seconds),
+            # ru_maxrss 在 Linux 上以 KB 为单位；子进程包括 ffmpeg 和替身服务
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'threads': threads,
+        }
+    finally:
+        if standin is not None:
+            standin.terminate()
+            standin.wait()
+        if not args.keep and not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    result['children_peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+    return result
+
+
+def compare(result, baseline, tolerance):
+    """
+    与基线结果对比总体指标和各步骤的 p95 耗时，打印变化比例。
+    返回超出 tolerance（相对变化）的退化项列表。
+    """
+    checks = list(COMPARED_METRICS)
+    checks += [(('stages', stage, 'p95'), False) for stage in result.get('stages', {})]
+    regressions = []
+    print(f"对比基线 {baseline.get('commit')} -> {result.get('commit')}")
+    for path, higher_is_better in checks:
+        old, new = baseline, result
+        for key in path:
+            old = old.get(key) if isinstance(old, dict) else None
+            new = new.get(key) if isinstance(new, dict) else None
+        if not isinstance(old, (int, float)) or not isinstance(new, (int, float)) or old == 0:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = "  退化" if worse > tolerance else ""
+        print(f"  {'.'.join(path)}: {old} -> {new} ({change:+.1%}){flag}")
+        if worse > tolerance:
+            regressions.append('.'.join(path))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分析流程端到端压测：吞吐量、各步骤耗时分位数、内存和线程数")
+    parser.add_argument('--tasks', type=int, default=8, help="任务数")
+    parser.add_argument('--concurrency', type=int, default=4, help="同时运行的任务数")
+    parser.add_argument('--duration', type=int, default=120, help="合成视频时长（秒）")
+    parser.add_argument('--outlines', nargs='*', default=['docx', 'pptx', 'pdf'],
+                        help="轮流使用的教案格式（docx / pptx / pdf），不填表示不带教案")
+    parser.add_argument('--work-dir', help="任务数据目录，默认使用临时目录并在结束后删除")
+    parser.add_argument('--keep', action='store_true', help="保留临时目录")
+    parser.add_argument('--cache', action='store_true', help="开启模型响应缓存")
+    parser.add_argument('--no-standin', action='store_true', help="不启动替身服务，使用当前配置的服务地址")
+    parser.add_argument('--port', type=int, default=8100, help="替身服务端口")
+    parser.add_argument('--llm-latency', type=float, help="替身服务的模型首字延迟中位数（秒）")
+    parser.add_argument('--llm-error-rate', type=float, help="替身服务的模型接口错误率")
+    parser.add_argument('--llm-rpm', type=float, help="替身服务的模型接口每分钟请求数上限")
+    parser.add_argument('--asr-latency-ratio', type=float, help="替身服务的转录处理时间与音频时长之比")
+    parser.add_argument('--asr-fail-rate', type=float, help="替身服务的转录订单失败率")
+    parser.add_argument('--seed', help="替身服务的随机种子")
+    parser.add_argument('--output', help="结果 json 的保存路径，默认输出到标准输出（此时运行日志输出到标准错误）")
+    parser.add_argument('--compare', help="基线结果 json，对比并打印变化")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="对比时允许的相对退化比例，超出时退出码为 1")
+    args = parser.parse_args()
+
+    # 结果输出到标准输出时，分析流程和对比的日志改为输出到标准错误，使标准输出只有结果 json
+    logs = lambda: contextlib.redirect_stdout(sys.stderr) if not args.output else contextlib.nullcontext()
+    with logs():
+        result = run_benchmark(args)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f"压测结果已保存至: {args.output}")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        with logs():
+            regressions = compare(result, baseline, args.tolerance)
+            if regressions:
+                print(f"超出允许范围的退化: {', '.join(regressions)}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
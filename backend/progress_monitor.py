@@ -4,9 +4,14 @@ import threading
 import functools
 import subprocess
 import json
-import ffmpeg
+from tools.media_info import find_source_video, probe_media
+from tools.task_context import TaskContext, bind_context, unbind_context
+from tools.llm_usage import usage_from_metrics
 from datetime import datetime, timedelta
 
+# 这些状态的任务会重新运行并从中断的步骤继续，重新运行时接着上次的进度日志记录
+RESUMABLE_STATUSES = ('requeued', 'batch_pending')
+
 class JSONProgressMonitor:
     """进度监控器，进度以json格式日志进行保存"""
 
@@ -23,6 +28,7 @@ class JSONProgressMonitor:
         self.is_running = False  # 分析函数运行状态
         self.monitor_thread = None
         self.completed_steps_time = 0  # ？
+        self.context = TaskContext(task_id=os.path.basename(os.path.dirname(log_file_path)).split('_')[0])  # 按步骤汇总各工具函数记录的指标
         
         # 日志数据结构
         self.log_data = {
@@ -36,9 +42,27 @@ class JSONProgressMonitor:
             },
             "progress_entries": []  # 用来记录日志
         }
+        self._resume_log()
 
         self._init_log_file()
 
+    def _resume_log(self):
+        """任务重新运行时保留上次运行的进度条目和步骤指标，耗时、重试次数和模型用量在各次运行之间累计"""
+        if not os.path.exists(self.log_file_path):
+            return
+        try:
+            with open(self.log_file_path, 'r', encoding='utf-8') as f:
+                previous = json.load(f)
+        except (OSError, ValueError):
+            return
+        if (previous.get("completion") or {}).get("status") not in RESUMABLE_STATUSES:
+            return
+        metadata = previous.get("metadata") or {}
+        self.log_data["metadata"]["created_time"] = metadata.get("created_time", self.log_data["metadata"]["created_time"])
+        self.log_data["metadata"]["runs"] = metadata.get("runs", 1) + 1
+        self.log_data["progress_entries"] = previous.get("progress_entries") or []
+        self.context.restore(previous.get("stage_metrics"))
+
     def _init_log_file(self):
         """初始化json日志文件"""
 
@@ -52,6 +76,11 @@ class JSONProgressMonitor:
 
     def _write_log_file(self):
         """将日志数据写入文件"""
+        self.log_data["stage_metrics"] = self.context.snapshot()
+        # 按步骤和整个任务汇总的模型 token 用量和费用
+        self.log_data["llm_usage"] = usage_from_metrics(self.log_data["stage_metrics"])
+        # 流式生成中已完成的部分结果，前端可在步骤完成前展示
+        self.log_data["partial_results"] = self.context.partial_snapshot()
         with open(self.log_file_path, 'w', encoding='utf-8') as f:
             json.dump(self.log_data, f, ensure_ascii=False, indent = 2)
 
@@ -139,6 +168,8 @@ class JSONProgressMonitor:
         self.step_start_time = self.start_time
         self.is_running = True
         self.current_step = 0
+        self.context.set_stage(self.step_names.get(0, "开始处理"))
+        bind_context(self.context)
 
         # 记录开始条目
         self._add_progress_entry(entry_type="start")
@@ -153,6 +184,8 @@ class JSONProgressMonitor:
         self.current_step = step_number
         if step_name and step_number in self.step_names:
             self.step_names[step_number] = step_name
+        self.context.set_stage(step_name or self.step_names.get(step_number, f"步骤{step_number}"))
+        self.context.progress = step_number / self.total_steps if self.total_steps else 0.0
 
     def skip_step(self, step_number, reason="跳过步骤"):
         """跳过指定步骤（适用于教案分析时未上传教案的情况）"""
@@ -179,35 +212,47 @@ class JSONProgressMonitor:
         
         print(f"步骤 {step_number} 已跳过: {reason}")
 
-    def stop(self, success=True, error_message=None):
-        """停止监控"""
+    def stop(self, success=True, error_message=None, status=None, retry_at=None):
+        """
+        停止监控；status 默认按 success 取 success / error，批量模式等待批次结果时为 batch_pending，
+        步骤交还调度、等待服务恢复后重新运行时为 requeued，retry_at 为预计重新运行的时间戳
+        """
         self.is_running = False
         self.current_step = self.total_steps if success else 0
+        self.context.finish()
+        unbind_context()
         
         # 添加完成条目
         completion_entry = {
             "timestamp": datetime.now().isoformat(),
             "timestamp_readable": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
             "type": "completion",
-            "status": "success" if success else "error",
+            "status": status or ("success" if success else "error"),
             "error_message": error_message,
             "total_elapsed_seconds": round(time.time() - self.start_time, 2),
             "total_elapsed_formatted": str(timedelta(seconds=int(time.time() - self.start_time)))
         }
         
+        if retry_at is not None:
+            completion_entry["retry_at"] = datetime.fromtimestamp(retry_at).isoformat()
+        
         self.log_data["completion"] = completion_entry
         self._write_log_file()
         
-        status_msg = "成功" if success else f"失败: {error_message}"
+        if success:
+            status_msg = "成功"
+        elif status == "batch_pending":
+            status_msg = "等待批次结果"
+        elif status == "requeued":
+            status_msg = f"等待服务恢复: {error_message}"
+        else:
+            status_msg = f"失败: {error_message}"
         print(f"处理完成! 状态: {status_msg}, 总用时: {completion_entry['total_elapsed_formatted']}")
 
 def get_audio_duration(video_path):
-    """获取视频文件时长（秒）"""
+    """获取视频文件时长（秒），探测结果缓存在任务文件夹中供后续预处理复用"""
     try:
-        probe = ffmpeg.probe(video_path)
-        stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
-        duration = float(stream['duration'])
-        return duration
+        return probe_media(video_path)['duration']
     except Exception as e:
         print(f"无法获取视频时长，使用默认比例: {e}")
         return 0
@@ -304,7 +349,8 @@ def create_dynamic_progress_monitor_decorator(log_file_path=None, step_time_rati
                 outline_path = kwargs['outline_path']
             
             # 计算音频时长
-            audio_duration = get_audio_duration(os.path.join(video_path, 'video.mp4')) if video_path else 0
+            source_video = find_source_video(video_path) if video_path and os.path.isdir(video_path) else None
+            audio_duration = get_audio_duration(source_video) if source_video else 0
             
             # 动态计算步骤时间
             total_steps, step_time_estimates, step_names, dynamic_steps = calculate_dynamic_step_times(
@@ -326,6 +372,11 @@ def create_dynamic_progress_monitor_decorator(log_file_path=None, step_time_rati
                 audio_duration=audio_duration,
                 dynamic_steps=dynamic_steps
             )
+            # priority: 任务优先级（tools.task_context 中的 PRIORITY_*），默认按交互式任务处理
+            if 'priority' in kwargs:
+                monitor.context.priority = kwargs.pop('priority')
+            # batch: 批量模式，模型调用通过批量接口执行（见 tools.llm_batch），用于补跑历史任务
+            monitor.context.batch = kwargs.pop('batch', False)
             monitor.start()
             
             kwargs['progress_monitor'] = monitor
@@ -335,7 +386,12 @@ def create_dynamic_progress_monitor_decorator(log_file_path=None, step_time_rati
                 monitor.stop(success=True)
                 return result
             except Exception as e:
-                monitor.stop(success=False, error_message=str(e))
+                if getattr(e, 'batch_pending', False):
+                    monitor.stop(success=False, error_message=str(e), status="batch_pending")
+                elif getattr(e, 'task_requeued', False):
+                    monitor.stop(success=False, error_message=str(e), status="requeued", retry_at=e.retry_at)
+                else:
+                    monitor.stop(success=False, error_message=str(e))
                 raise e
         return wrapper
     return decorator
@@ -0,0 +1,480 @@
+# 本地替身服务，用于在没有 DashScope / 讯飞服务的环境中压测整个分析流程：
+# - /v1：OpenAI 兼容接口，/chat/completions（含流式输出）按提示词类型返回符合各步骤结构的固定结果，
+#   以及批量补跑使用的 /files、/batches；
+# - /v2/api：讯飞录音文件转写接口，/upload 接收音频并创建订单，/getResult 在模拟的处理时间后返回字幕。
+# 两类接口的延迟分布、错误率和频率限制都可以配置（standin_* 配置项或命令行参数）。
+# 使用时将后端配置 base_url=http://127.0.0.1:8100/v1、asr_xfyun_host=http://127.0.0.1:8100/v2/api。
+import os
+import re
+import json
+import math
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+from flask import Flask, Response, request, jsonify
+from tools.transcript import estimate_tokens
+
+load_dotenv()  # 加载.env文件，standin_* 配置项与后端写在同一处
+app = Flask(__name__)
+
+
+class Settings:
+    """替身服务的配置，默认读取 standin_* 配置项"""
+
+    def __init__(self):
+        env = os.getenv
+        # 模型接口：首字延迟为对数正态分布（中位数 llm_latency 秒，离散度 llm_latency_sigma），
+        # 之后按 llm_tokens_per_second 的速度输出
+        self.llm_latency = float(env('standin_llm_latency', '1.0'))
+        self.llm_latency_sigma = float(env('standin_llm_latency_sigma', '0.5'))
+        self.llm_tokens_per_second = float(env('standin_llm_tokens_per_second', '200'))
+        self.llm_error_rate = float(env('standin_llm_error_rate', '0'))
+        self.llm_rpm = float(env('standin_llm_rpm', '0'))  # 0 表示不限
+        self.batch_latency = float(env('standin_batch_latency', '5'))
+        # 转录接口：订单处理时间 = asr_latency + asr_latency_ratio × 音频时长，再乘以对数正态扰动
+        self.asr_latency = float(env('standin_asr_latency', '2'))
+        self.asr_latency_ratio = float(env('standin_asr_latency_ratio', '0.05'))
+        self.asr_latency_sigma = float(env('standin_asr_latency_sigma', '0.3'))
+        self.asr_upload_error_rate = float(env('standin_asr_upload_error_rate', '0'))
+        self.asr_fail_rate = float(env('standin_asr_fail_rate', '0'))
+        self.asr_upload_rpm = float(env('standin_asr_upload_rpm', '0'))
+        self.asr_query_qps = float(env('standin_asr_query_qps', '0'))
+        self.seed = env('standin_seed')
+
+
+settings = Settings()
+_random = random.Random()
+_random_lock = threading.Lock()
+
+
+def lognormal(median, sigma):
+    with _random_lock:
+        return median * math.exp(sigma * _random.gauss(0, 1)) if median > 0 else 0.0
+
+
+def chance(rate):
+    with _random_lock:
+        return rate > 0 and _random.random() < rate
+
+
+def pick(options):
+    with _random_lock:
+        return _random.choice(options)
+
+
+class RateLimit:
+    """令牌桶：每分钟 per_minute 个请求，超出时返回需要等待的秒数"""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """取到令牌时返回 0，否则返回建议的等待秒数"""
+        if self.capacity <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 60)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) * 60 / self.capacity
+
+
+limits = {}
+
+
+def init_limits():
+    limits['llm'] = RateLimit(settings.llm_rpm)
+    limits['asr_upload'] = RateLimit(settings.asr_upload_rpm)
+    limits['asr_query'] = RateLimit(settings.asr_query_qps * 60)
+
+
+stats = {'llm_requests': 0, 'llm_errors': 0, 'llm_rate_limited': 0,
+         'asr_uploads': 0, 'asr_upload_errors': 0, 'asr_queries': 0, 'asr_rate_limited': 0}
+_stats_lock = threading.Lock()
+
+
+def count(key):
+    with _stats_lock:
+        stats[key] += 1
+
+
+# ----------------------------- 固定结果 -----------------------------
+
+TOPICS = ["课程导入", "基本概念", "核心定义", "典型模型", "算法步骤", "例题讲解", "拓展应用", "课堂小结"]
+
+
+def clock(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{(seconds % 3600) // 60:02d}:{seconds % 60:02d}"
+
+
+def canned_tree(start=0, end=2700, root_type="知识模块", children=6):
+    """时间范围均分给各子节点的图谱，每个子节点带两个子知识点"""
+    step = max(1, (end - start) // children)
+    nodes = []
+    for i in range(children):
+        begin = start + i * step
+        name = TOPICS[i % len(TOPICS)]
+        nodes.append({
+            "id": f"{i + 2}", "name": f"{name}{i + 1}", "type": "知识点", "level": str(2 + i % 7),
+            "time": f"{clock(begin)} --> {clock(begin + step)}", "content": f"讲解{name}的主要内容。",
+            "child": [{"id": f"{i + 2}.{j + 1}", "name": f"{name}{i + 1}-{j + 1}", "type": "子知识点",
+                       "level": str(2 + (i + j) % 7),
+                       "time": f"{clock(begin + j * step // 2)} --> {clock(begin + (j + 1) * step // 2)}",
+                       "content": f"{name}的细节{j + 1}。", "child": []} for j in range(2)],
+        })
+    return {"id": "1", "name": "示例课程", "type": root_type, "level": "5",
+            "time": f"{clock(start)} --> {clock(end)}", "content": "示例课程的整体概括。", "child": nodes}
+
+
+def parse_clock(text):
+    parts = [int(part) for part in text.split(':')]
+    while len(parts) < 3:
+        parts.insert(0, 0)
+    return parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+
+def video_tree_reply(prompt):
+    chunk = re.search(r"整节课程中 ([\d:]+) 到 ([\d:]+) 的一部分", prompt)
+    if chunk:
+        return canned_tree(parse_clock(chunk.group(1)), parse_clock(chunk.group(2)), "知识单元", children=3)
+    return canned_tree()
+
+
+def outline_reply(prompt):
+    return {"课程名称": "示例课程", "章节": [
+        {"章节名": f"第{i + 1}章 {TOPICS[i]}",
+         "知识点": [{"名称": f"{TOPICS[i]}{j + 1}", "内容": f"{TOPICS[i]}的书面化讲解内容。" * 3} for j in range(3)]}
+        for i in range(4)]}
+
+
+# (标记文字, 生成结果的函数)：按用户消息中出现的标记判断提示词类型，靠前的优先
+PROMPT_TYPES = [
+    ("知识点关系列表附在本段说明之后", lambda prompt: {"评价": "知识点之间的讲解顺序总体合理。", "建议": ["可以增加前后知识点的衔接。"]}),
+    ("分析其中知识点的逻辑关系", lambda prompt: {
+        "node": [{"id": str(i + 2), "name": f"{TOPICS[i]}{i + 1}", "type": "knowledge", "level": "3"} for i in range(6)],
+        "example": [{"id": "e1", "name": "例题", "type": "example"}],
+        "edge": [{"from": str(i + 2), "to": str(i + 3), "relation": "序列关系"} for i in range(5)]}),
+    ("分析知识点教学时长分布的合理性", lambda prompt: {
+        "评价": "知识点的分布总体上由浅入深。", "建议": "可以适当增加例题讲解的时间。",
+        "知识点": [{"name": f"{TOPICS[i]}{i + 1}", "评价": "讲解时长适中。", "建议": "保持。"} for i in range(6)]}),
+    ("结构化知识信息如下", lambda prompt: {
+        "覆盖情况总结": "大部分知识点已覆盖。",
+        "分析": [{"name": f"{TOPICS[i]}{i + 1}", "覆盖情况": ["覆盖", "部分覆盖", "未覆盖"][i % 3], "解释": "示例说明。"}
+                 for i in range(6)],
+        "覆盖评分": "80", "改进建议": "补充未覆盖的知识点。"}),
+    ("各段主题如下", lambda prompt: {"name": "示例课程", "content": "示例课程的整体概括。"}),
+    ("树状知识图谱", video_tree_reply),
+    ("返回一个json格式的课程总结", outline_reply),
+    ("重新返回一个json格式的分析结果", outline_reply),
+    ("构造一个网状的知识图谱", lambda prompt: {
+        "nodes": [{"id": str(i + 1), "name": f"{TOPICS[i]}"} for i in range(6)],
+        "relations": [{"起始节点ID": str(i + 1), "关系类型": "包含", "结束节点ID": str(i + 2)} for i in range(5)]}),
+]
+
+
+def canned_reply(messages):
+    """按提示词类型返回固定结果；格式错误后的重新生成按原始提示词的类型处理"""
+    user_messages = [str(message.get('content', '')) for message in messages if message.get('role') == 'user']
+    for prompt in reversed(user_messages):
+        for marker, build in PROMPT_TYPES:
+            if marker in prompt:
+                return "```json\n" + json.dumps(build(prompt), ensure_ascii=False, indent=2) + "\n```"
+    return "好的。"
+
+
+# ----------------------------- 模型接口 -----------------------------
+
+class PrefixCache:
+    """模拟服务端前缀缓存：提示词按 1024 字符分块，开头连续命中的块计为缓存命中"""
+
+    def __init__(self, block=1024, capacity=100000):
+        self.block = block
+        self.capacity = capacity
+        self.seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cached_chars(self, text):
+        digest = hashlib.sha256()
+        hashes = []
+        for start in range(0, len(text) - self.block + 1, self.block):
+            digest.update(text[start:start + self.block].encode('utf-8'))
+            hashes.append(digest.hexdigest())
+        hit = 0
+        with self._lock:
+            for value in hashes:
+                if value not in self.seen:
+                    break
+                hit += 1
+            for value in hashes:
+                self.seen[value] = True
+                self.seen.move_to_end(value)
+            while len(self.seen) > self.capacity:
+                self.seen.popitem(last=False)
+        return hit * self.block
+
+
+prefix_cache = PrefixCache()
+
+
+def usage_for(messages, reply):
+    prompt_text = "".join(str(message.get('content', '')) for message in messages)
+    prompt_tokens = estimate_tokens(prompt_text)
+    cached_chars = prefix_cache.cached_chars(prompt_text)
+    cached_tokens = int(prompt_tokens * cached_chars / len(prompt_text)) if prompt_text else 0
+    completion_tokens = estimate_tokens(reply)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+
+
+def error_response(status, message, retry_after=None):
+    response = jsonify({"error": {"message": message, "type": "standin_error", "code": status}})
+    response.status_code = status
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+@app.route('/v1/chat/completions', methods=['POST'])
+def chat_completions():
+    count('llm_requests')
+    wait = limits['llm'].take()
+    if wait:
+        count('llm_rate_limited')
+        return error_response(429, "standin rate limit exceeded", wait)
+    if chance(settings.llm_error_rate):
+        count('llm_errors')
+        time.sleep(lognormal(settings.llm_latency, settings.llm_latency_sigma) / 2)
+        return error_response(pick([500, 502, 503]), "standin injected error")
+
+    body = request.get_json(force=True)
+    messages = body.get('messages', [])
+    model = body.get('model', 'qwen-plus')
+    reply = canned_reply(messages)
+    usage = usage_for(messages, reply)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    created = int(time.time())
+    time.sleep(lognormal(settings.llm_latency, settings.llm_latency_sigma))
+
+    if not body.get('stream'):
+        if settings.llm_tokens_per_second > 0:
+            time.sleep(usage['completion_tokens'] / settings.llm_tokens_per_second)
+        return jsonify({
+            "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+    include_usage = (body.get('stream_options') or {}).get('include_usage')
+
+    def chunk(delta=None, finish_reason=None, usage=None):
+        data = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [] if delta is None and finish_reason is None else
+                [{"index": 0, "delta": delta or {}, "finish_reason": finish_reason}]}
+        if usage is not None:
+            data["usage"] = usage
+        return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    def generate():
+        piece = 16  # 每块字符数
+        delay = estimate_tokens(reply[:piece]) / settings.llm_tokens_per_second if settings.llm_tokens_per_second > 0 else 0
+        yield chunk({"role": "assistant", "content": ""})
+        for start in range(0, len(reply), piece):
+            if delay:
+                time.sleep(delay)
+            yield chunk({"content": reply[start:start + piece]})
+        yield chunk(finish_reason="stop")
+        if include_usage:
+            yield chunk(usage=usage)
+        yield "data: [DONE]\n\n"
+
+    return Response(generate(), mimetype='text/event-stream')
+
+
+# 批量接口：上传的文件和批次保存在内存中，批次在 batch_latency 秒后完成
+files = {}
+batches = {}
+
+
+def file_object(file_id):
+    info = files[file_id]
+    return {"id": file_id, "object": "file", "bytes": len(info['content']), "created_at": info['created'],
+            "filename": info['filename'], "purpose": info['purpose'], "status": "processed"}
+
+
+@app.route('/v1/files', methods=['POST'])
+def upload_file():
+    uploaded = request.files['file']
+    file_id = f"file-{uuid.uuid4().hex[:12]}"
+    files[file_id] = {'content': uploaded.read(), 'filename': uploaded.filename or file_id,
+                      'purpose': request.form.get('purpose', 'batch'), 'created': int(time.time())}
+    return jsonify(file_object(file_id))
+
+
+@app.route('/v1/files/<file_id>/content', methods=['GET'])
+def file_content(file_id):
+    if file_id not in files:
+        return error_response(404, "file not found")
+    return Response(files[file_id]['content'], mimetype='application/jsonl')
+
+
+def run_batch(batch_id):
+    batch = batches[batch_id]
+    time.sleep(lognormal(settings.batch_latency, settings.llm_latency_sigma))
+    output, errors = [], []
+    for line in files[batch['input_file_id']]['content'].decode('utf-8').splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        if chance(settings.llm_error_rate):
+            errors.append({"custom_id": item['custom_id'], "error": {"code": "server_error", "message": "standin injected error"}})
+            continue
+        messages = item['body'].get('messages', [])
+        reply = canned_reply(messages)
+        output.append({"custom_id": item['custom_id'], "response": {"status_code": 200, "body": {
+            "object": "chat.completion", "model": item['body'].get('model'),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            "usage": usage_for(messages, reply)}}})
+    for key, lines in (('output_file_id', output), ('error_file_id', errors)):
+        if lines:
+            file_id = f"file-{uuid.uuid4().hex[:12]}"
+            files[file_id] = {'content': "\n".join(json.dumps(line, ensure_ascii=False) for line in lines).encode('utf-8'),
+                              'filename': f"{batch_id}_{key}.jsonl", 'purpose': 'batch_output', 'created': int(time.time())}
+            batch[key] = file_id
+    batch['request_counts'] = {"total": len(output) + len(errors), "completed": len(output), "failed": len(errors)}
+    batch['status'] = 'completed'
+    batch['completed_at'] = int(time.time())
+
+
+@app.route('/v1/batches', methods=['POST'])
+def create_batch():
+    body = request.get_json(force=True)
+    if body.get('input_file_id') not in files:
+        return error_response(400, "input file not found")
+    batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+    batches[batch_id] = {"id": batch_id, "object": "batch", "endpoint": body.get('endpoint'),
+                         "input_file_id": body['input_file_id'], "completion_window": body.get('completion_window'),
+                         "status": "in_progress", "created_at": int(time.time()), "output_file_id": None,
+                         "error_file_id": None, "request_counts": {"total": 0, "completed": 0, "failed": 0}}
+    threading.Thread(target=run_batch, args=(batch_id,), daemon=True).start()
+    return jsonify(batches[batch_id])
+
+
+@app.route('/v1/batches/<batch_id>', methods=['GET'])
+def retrieve_batch(batch_id):
+    if batch_id not in batches:
+        return error_response(404, "batch not found")
+    return jsonify(batches[batch_id])
+
+
+# ----------------------------- 转录接口 -----------------------------
+
+SENTENCES = ["同学们好，今天我们来学习新的内容。", "首先回顾一下上节课讲到的基本概念。", "这个定义需要大家重点理解。",
+             "我们来看一个具体的例子。", "根据刚才的推导可以得到这个结论。", "这里有一个常见的误区需要注意。",
+             "下面我们把这个方法推广到一般情况。", "请大家思考一下这个问题。"]
+
+orders = {}
+_orders_lock = threading.Lock()
+
+
+def order_result(duration):
+    """按音频时长每 5 秒生成一句字幕，格式与讯飞 orderResult 一致"""
+    lattice = []
+    for i, begin in enumerate(range(0, max(1, int(duration)) * 1000, 5000)):
+        text = SENTENCES[i % len(SENTENCES)]
+        lattice.append({"begin": str(begin), "end": str(begin + 4800),
+                        "json_1best": {"st": {"rl": "0", "rt": [{"ws": [{"cw": [{"w": text}]}]}]}}})
+    return {"lattice2": lattice}
+
+
+def xfyun_response(code="000000", desc="success", content=None):
+    return jsonify({"code": code, "descInfo": desc, "content": content})
+
+
+@app.route('/v2/api/upload', methods=['POST'])
+def asr_upload():
+    count('asr_uploads')
+    # 读取并丢弃音频内容，模拟上传耗时
+    while request.stream.read(1024 * 1024):
+        pass
+    if limits['asr_upload'].take():
+        count('asr_rate_limited')
+        return xfyun_response("26625", "上传频率超限")
+    if chance(settings.asr_upload_error_rate):
+        count('asr_upload_errors')
+        return xfyun_response("26601", "standin injected error")
+    duration = float(request.args.get('duration') or 200)
+    order_id = f"DKHJQ{uuid.uuid4().hex[:16]}"
+    seconds = lognormal(settings.asr_latency + settings.asr_latency_ratio * duration, settings.asr_latency_sigma)
+    with _orders_lock:
+        orders[order_id] = {'ready_at': time.time() + seconds, 'duration': duration,
+                            'failed': chance(settings.asr_fail_rate)}
+    return xfyun_response(content={"orderId": order_id, "taskEstimateTime": int(seconds * 1000)})
+
+
+@app.route('/v2/api/getResult', methods=['GET', 'POST'])
+def asr_get_result():
+    count('asr_queries')
+    if limits['asr_query'].take():
+        count('asr_rate_limited')
+        return xfyun_response("26625", "查询频率超限")
+    order_id = request.args.get('orderId', '')
+    with _orders_lock:
+        order = orders.get(order_id)
+    if order is None:
+        return xfyun_response("26603", "订单不存在")
+    info = {"orderId": order_id, "status": 3, "failType": 0}
+    if time.time() < order['ready_at']:
+        return xfyun_response(content={"orderInfo": info, "orderResult": ""})
+    if order['failed']:
+        info.update(status=-1, failType=1)
+        return xfyun_response(content={"orderInfo": info, "orderResult": ""})
+    info['status'] = 4
+    return xfyun_response(content={"orderInfo": info,
+                                   "orderResult": json.dumps(order_result(order['duration']), ensure_ascii=False)})
+
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    with _stats_lock:
+        return jsonify(dict(stats))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容 / 讯飞转写替身服务")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=int(os.getenv('standin_port', '8100')))
+    parser.add_argument('--llm-latency', type=float, help="模型首字延迟中位数（秒）")
+    parser.add_argument('--llm-error-rate', type=float, help="模型接口错误率")
+    parser.add_argument('--llm-rpm', type=float, help="模型接口每分钟请求数上限，0 表示不限")
+    parser.add_argument('--asr-latency-ratio', type=float, help="转录处理时间与音频时长之比")
+    parser.add_argument('--asr-fail-rate', type=float, help="转录订单失败率")
+    parser.add_argument('--seed', help="随机种子")
+    args = parser.parse_args()
+
+    for name in ('llm_latency', 'llm_error_rate', 'llm_rpm', 'asr_latency_ratio', 'asr_fail_rate', 'seed'):
+        if getattr(args, name) is not None:
+            setattr(settings, name, getattr(args, name))
+    if settings.seed is not None:
+        _random.seed(settings.seed)
+    init_limits()
+    print(f"替身服务已启动: http://{args.host}:{args.port}（模型接口 /v1，转录接口 /v2/api）")
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+init_limits()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 测试从 backend 目录导入 tools 等模块，与运行 app.py 时一致
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
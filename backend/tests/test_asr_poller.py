@@ -0,0 +1,115 @@
+import asyncio
+import json
+import types
+import pytest
+
+httpx = pytest.importorskip('httpx')
+from tools import asr_poller
+from tools.asr_poller import AsrOrder, AsrPoller, STATUS_DONE, STATUS_FAILED
+
+
+def reply(status=None, code='000000'):
+    content = {'orderInfo': {'status': status, 'failType': 11}} if status is not None else {}
+    return json.dumps({'code': code, 'descInfo': '说明', 'content': content})
+
+
+class FakeClient:
+    """按顺序给出查询结果：字符串为响应正文，异常实例则抛出"""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.posts = 0
+
+    async def post(self, url, params=None, headers=None):
+        self.posts += 1
+        result = self.replies.pop(0)
+        if isinstance(result, BaseException):
+            raise result
+        return types.SimpleNamespace(text=result)
+
+
+@pytest.fixture(autouse=True)
+def fast_intervals(monkeypatch):
+    monkeypatch.setattr(asr_poller, 'MIN_POLL_INTERVAL', 0.01)
+    monkeypatch.setattr(asr_poller, 'MAX_POLL_INTERVAL', 0.05)
+
+
+def track(poller, *replies, timeout=60):
+    poller._client = FakeClient(*replies)
+
+    async def run():
+        order = AsrOrder('o1', lambda: {}, 0, timeout)
+        await poller._track(order)
+        return order
+    order = asyncio.run(run())
+    return order, poller._client
+
+
+def test_order_completes_after_processing():
+    poller = AsrPoller('https://asr', max_qps=1000)
+    order, client = track(poller, reply(3), reply(3), reply(STATUS_DONE))
+    assert order.future.result()['content']['orderInfo']['status'] == STATUS_DONE
+    assert order.polls == client.posts == 3
+
+
+def test_transient_errors_are_retried():
+    poller = AsrPoller('https://asr', max_qps=1000)
+    order, _ = track(poller, httpx.HTTPError('断开'), '不是 json', reply(code='26605'), reply(STATUS_DONE))
+    assert order.future.result()['content']['orderInfo']['status'] == STATUS_DONE
+
+
+def test_too_many_query_errors_fail_order():
+    poller = AsrPoller('https://asr', max_qps=1000)
+    order, _ = track(poller, *[httpx.HTTPError('断开')] * (asr_poller.MAX_QUERY_ERRORS + 1))
+    with pytest.raises(RuntimeError, match='查询失败'):
+        order.future.result()
+
+
+def test_failed_order():
+    poller = AsrPoller('https://asr', max_qps=1000)
+    order, _ = track(poller, reply(STATUS_FAILED))
+    with pytest.raises(RuntimeError, match='订单失败'):
+        order.future.result()
+
+
+def test_order_timeout():
+    poller = AsrPoller('https://asr', max_qps=1000)
+    order, _ = track(poller, *[reply(3)] * 100, timeout=0.05)
+    with pytest.raises(TimeoutError):
+        order.future.result()
+    assert 'o1' not in poller._orders
+
+
+def test_callback_wakes_order_early(monkeypatch):
+    monkeypatch.setattr(asr_poller, 'CALLBACK_FALLBACK_INTERVAL', 60)
+    poller = AsrPoller('https://asr', max_qps=1000, use_callback=True)
+    poller._client = FakeClient(reply(STATUS_DONE))
+
+    async def run():
+        # 预计 600 秒后才完成，没有回调时第一次查询要等很久
+        order = AsrOrder('o1', lambda: {}, 3000, 3600)
+        task = asyncio.ensure_future(poller._track(order))
+        await asyncio.sleep(0.01)
+        order.event.set()
+        await asyncio.wait_for(task, 1)
+        return order
+
+    assert asyncio.run(run()).future.done()
+
+
+def test_intervals_follow_expected_duration():
+    poller = AsrPoller('https://asr', max_qps=1000)
+    poller.speed_ratio = 0.2
+    order = AsrOrder('o1', lambda: {}, 100, 600)
+    assert poller.expected_seconds(100) == 20
+    assert poller._first_wait(order) == pytest.approx(asr_poller.MAX_POLL_INTERVAL)
+    assert AsrPoller.order_timeout(3600) == 3600 * asr_poller.ORDER_TIMEOUT_RATIO
+
+
+def test_learns_processing_speed():
+    poller = AsrPoller('https://asr', max_qps=1000)
+    poller.speed_ratio = 0.2
+    order = AsrOrder('o1', lambda: {}, 100, 600)
+    order.submitted -= 50
+    poller._learn(order)
+    assert poller.speed_ratio == pytest.approx(0.8 * 0.2 + 0.2 * 0.5, rel=0.01)
@@ -0,0 +1,83 @@
+import json
+import pytest
+from tools.json_repair import (JsonFormatError, compile_schema, extract_json, is_valid_json_output,
+                               parse_json_output, repair_json)
+
+TREE = compile_schema({
+    "type": "object",
+    "required": ["id", "name", "child"],
+    "properties": {
+        "id": {"type": "string"},
+        "name": {"type": "string"},
+        "child": {"type": "array", "items": {"$ref": "#"}},
+    },
+})
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('{"a": 1,}', {'a': 1}),
+    ("{'a': 'b'}", {'a': 'b'}),
+    ('{"a": True, "b": None}', {'a': True, 'b': None}),
+    ('{"a": 1 "b": 2}', {'a': 1, 'b': 2}),
+    ('[{"a": 1} {"a": 2}]', [{'a': 1}, {'a': 2}]),
+    ('{a: 1, b: 文本}', {'a': 1, 'b': '文本'}),
+    ('{"a": "第一行\n第二行"}', {'a': '第一行\n第二行'}),
+    ('{"a": 1, // 注释\n "b": 2}', {'a': 1, 'b': 2}),
+    ('{"a": [1, 2', {'a': [1, 2]}),
+    ('{"a": "截断', {'a': '截断'}),
+    ('{"a": 1, "b":', {'a': 1, 'b': None}),
+    ('{"a": 1} 以上是结果', {'a': 1}),
+    (r'''{'a': 'it\'s'}''', {'a': "it's"}),
+    (r'{"a": "公式 $\alpha$ 与 \\beta"}', {'a': '公式 $\\alpha$ 与 \\beta'}),
+    (r'{"a": "C:\data\new", "b": "\u4e2d \user"}', {'a': 'C:\\data\new', 'b': '中 \\user'}),
+])
+def test_repair_json(text, expected):
+    assert json.loads(repair_json(text)) == expected
+
+
+def test_extract_json_prefers_fenced_block():
+    text = '说明 {不是这个}\n```json\n{"a": 1}\n```\n'
+    assert extract_json(text) == ({'a': 1}, False)
+
+
+def test_extract_json_reports_repair():
+    assert extract_json('结果如下：{"a": 1,}') == ({'a': 1}, True)
+
+
+def test_extract_json_keeps_invalid_escapes_literal():
+    assert extract_json('{"a": "公式 $\\alpha$"}') == ({'a': '公式 $\\alpha$'}, True)
+    assert extract_json('{"path": "C:\\data"}') == ({'path': 'C:\\data'}, True)
+
+
+@pytest.mark.parametrize('text', [None, '', '没有 json'])
+def test_extract_json_without_json(text):
+    with pytest.raises(JsonFormatError):
+        extract_json(text)
+
+
+def test_schema_accepts_valid_tree():
+    tree = {'id': '1', 'name': '根', 'child': [{'id': '2', 'name': '叶', 'child': []}]}
+    assert TREE(tree) == []
+
+
+def test_schema_reports_nested_errors_with_paths():
+    tree = {'id': 1, 'name': '根', 'child': [{'id': '2', 'child': 'x'}]}
+    assert TREE(tree) == ['$.id: 应为 string', '$.child[0]: 缺少属性 name', '$.child[0].child: 应为 array']
+
+
+def test_schema_enum_min_items_and_bool_is_not_number():
+    validate = compile_schema({"type": "object", "properties": {
+        "level": {"enum": ["高", "低"]},
+        "scores": {"type": "array", "minItems": 1, "items": {"type": "number"}},
+    }})
+    assert validate({'level': '中', 'scores': []}) == ["$.level: 取值应为 ['高', '低'] 之一", '$.scores: 至少应有 1 项']
+    assert validate({'scores': [True]}) == ['$.scores[0]: 应为 number']
+    assert validate({'scores': [1, 2.5]}) == []
+
+
+def test_parse_json_output_raises_with_errors():
+    with pytest.raises(JsonFormatError) as info:
+        parse_json_output('{"id": "1"}', TREE)
+    assert '$: 缺少属性 name' in info.value.errors
+    assert not is_valid_json_output('{"id": "1"}', TREE)
+    assert is_valid_json_output('```\n{"id": "1", "name": "n", "child": [],}\n```', TREE)
@@ -0,0 +1,69 @@
+import pytest
+from tools.json_repair import JsonFormatError
+from tools.json_stream import JsonStreamParser
+
+OUTPUT = '好的，结果如下：\n```json\n{"课程名称": "线性代数", "章节": [{"章节名": "矩阵", "知识点": [{"名称": "秩"}]}, ' \
+         '{"章节名": "行列式 {含括号}", "知识点": []}]}\n```'
+
+
+def collect(text, chunk_size, **kwargs):
+    elements = []
+    parser = JsonStreamParser(lambda path, value: elements.append((path, value)), **kwargs)
+    for i in range(0, len(text), chunk_size):
+        parser.feed(text[i:i + chunk_size])
+    return parser, elements
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 17, 1000])
+def test_elements_are_emitted_in_closing_order_regardless_of_chunking(chunk_size):
+    parser, elements = collect(OUTPUT, chunk_size)
+    assert [path for path, _ in elements] == [('章节', 0), ('章节', 1), ('章节',), ()]
+    assert elements[1][1]['章节名'] == '行列式 {含括号}'
+    assert parser.done
+
+
+def test_max_depth_limits_emitted_paths():
+    _, elements = collect(OUTPUT, 5, max_depth=3)
+    assert ('章节', 0, '知识点', 0) not in [path for path, _ in elements]
+    assert ('章节', 0, '知识点') in [path for path, _ in elements]
+
+
+def test_escaped_quotes_and_single_quotes_inside_strings():
+    _, elements = collect('[{"a": "他说\\"}]\\""}, {\'b\': \'x]\'}]', 2)
+    assert elements[0] == ((0,), {'a': '他说"}]"'})
+    assert elements[1] == ((1,), {'b': 'x]'})
+
+
+def test_text_after_root_is_ignored():
+    parser, elements = collect('{"a": 1} 以上是 {结果}', 4)
+    assert elements == [((), {'a': 1})]
+    assert parser.done
+
+
+def test_missing_json_prefix_aborts_early():
+    parser = JsonStreamParser(prefix_limit=10)
+    with pytest.raises(JsonFormatError) as info:
+        parser.feed('这是一段很长的说明文字，没有任何结构化内容')
+    assert info.value.partial.startswith('这是')
+
+
+def test_mismatched_bracket_aborts():
+    parser = JsonStreamParser()
+    with pytest.raises(JsonFormatError):
+        parser.feed('{"a": [1, 2}')
+
+
+def test_on_element_can_reject_a_fragment():
+    def reject(path, value):
+        if path == (1,):
+            raise JsonFormatError('第2项结构不符合要求')
+
+    parser = JsonStreamParser(reject)
+    with pytest.raises(JsonFormatError) as info:
+        parser.feed('[{"a": 1}, {"b": 2}, {"c": 3}]')
+    assert info.value.partial == '[{"a": 1}, {"b": 2}, {"c": 3}]'
+
+
+def test_fragment_with_repairable_errors_is_still_emitted():
+    _, elements = collect('[{"a": 1,}]', 3)
+    assert elements[0] == ((0,), {'a': 1})
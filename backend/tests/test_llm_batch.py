@@ -0,0 +1,124 @@
+import json
+import types
+import pytest
+from tools import llm_cache
+from tools.llm_batch import BatchCollector, BatchPendingError, BatchRunner, DeferredBatch, batch_usage
+from tools.llm_cache import LLMCache, cache_key
+
+MESSAGES = [{'role': 'user', 'content': '生成知识图谱'}]
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = LLMCache(path=str(tmp_path / 'cache.sqlite3'))
+    monkeypatch.setattr(llm_cache, '_cache', store)
+    monkeypatch.setenv('llm_cache', 'on')
+    return store
+
+
+def test_defer_registers_each_request_once(store, tmp_path):
+    collector = BatchCollector(str(tmp_path / 'batches'))
+    error = collector.defer('qwen-plus', MESSAGES)
+    assert isinstance(error, BatchPendingError) and error.requeue_stage
+    collector.defer('qwen-plus', MESSAGES)
+    collector.defer('qwen-plus', MESSAGES, temperature=0.5)
+    collector.defer('qwen-max', MESSAGES)
+    assert len(collector.pending) == 3
+
+
+def test_defer_requires_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('llm_cache', 'off')
+    with pytest.raises(RuntimeError):
+        BatchCollector(str(tmp_path)).defer('qwen-plus', MESSAGES)
+
+
+def test_flush_splits_by_model_and_size(store, tmp_path):
+    collector = BatchCollector(str(tmp_path / 'batches'))
+    for i in range(3):
+        collector.defer('qwen-plus', [{'role': 'user', 'content': f'问题{i}'}])
+    collector.defer('qwen-max', MESSAGES)
+    files = collector.flush(max_requests=2)
+    assert sorted((model, count) for _, model, count in files) == [('qwen-max', 1), ('qwen-plus', 1), ('qwen-plus', 2)]
+    assert collector.pending == {}
+    path = next(path for path, model, _ in files if model == 'qwen-max')
+    with open(path, encoding='utf-8') as f:
+        [line] = [json.loads(line) for line in f]
+    assert line['custom_id'] == cache_key('qwen-max', MESSAGES)
+    assert line['body'] == {'model': 'qwen-max', 'messages': MESSAGES}
+
+
+class FakeBatchClient:
+    """模拟批量接口：retrieve 返回预设的批次，files.content 返回预设的文件内容"""
+
+    def __init__(self, batch, contents):
+        self.batch = batch
+        self.contents = contents
+        self.batches = self
+        self.files = self
+
+    def retrieve(self, batch_id):
+        return self.batch
+
+    def content(self, file_id):
+        return types.SimpleNamespace(text=self.contents[file_id])
+
+
+def result_line(custom_id, text, status=200):
+    body = {'choices': [{'message': {'content': text}}],
+            'usage': {'prompt_tokens': 100, 'completion_tokens': 20, 'prompt_tokens_details': {'cached_tokens': 10}}}
+    return json.dumps({'custom_id': custom_id, 'response': {'status_code': status, 'body': body}})
+
+
+def test_poll_imports_finished_batch_into_cache(store, tmp_path):
+    ok = cache_key('qwen-plus', MESSAGES)
+    other = cache_key('qwen-plus', [{'role': 'user', 'content': '另一个'}])
+    batch = types.SimpleNamespace(status='completed', output_file_id='out', error_file_id='err')
+    client = FakeBatchClient(batch, {
+        'out': '\n'.join([result_line(ok, '{"a": 1}'), result_line(other, '', status=500), '']),
+        'err': '{"custom_id": "x"}\n',
+    })
+    runner = BatchRunner(str(tmp_path / 'batches'), client=client)
+    runner.batches = {'b1': {'file': 'f.jsonl', 'model': 'qwen-plus', 'requests': 3, 'status': 'in_progress'}}
+
+    assert runner.poll() == 0
+    info = runner.batches['b1']
+    assert (info['status'], info['imported'], info['failed']) == ('completed', 1, 2)
+    assert store.get(ok)[0] == '{"a": 1}'
+    assert store.take_usage(ok) == {'prompt_tokens': 100, 'completion_tokens': 20, 'cached_tokens': 10}
+    assert store.get(other) is None
+    # 状态已保存，补跑中断后重新创建时仍能看到该批次
+    assert BatchRunner(str(tmp_path / 'batches'), client=client).batches['b1']['status'] == 'completed'
+
+
+def test_poll_keeps_waiting_for_unfinished_batch(store, tmp_path):
+    client = FakeBatchClient(types.SimpleNamespace(status='in_progress'), {})
+    runner = BatchRunner(str(tmp_path / 'batches'), client=client)
+    runner.batches = {'b1': {'file': 'f.jsonl', 'model': 'qwen-plus', 'requests': 1, 'status': 'validating'}}
+    assert runner.poll() == 1
+    assert runner.unfinished() == ['b1']
+
+
+def test_batch_usage():
+    assert batch_usage(None) is None
+    assert batch_usage({'prompt_tokens': 5}) == {'prompt_tokens': 5, 'completion_tokens': 0, 'cached_tokens': 0}
+
+
+def test_deferred_batch_runs_remaining_calls_then_raises():
+    calls = []
+
+    def call(i):
+        calls.append(i)
+        if i % 2:
+            raise BatchPendingError(f"等待批次 {i}")
+        return i
+
+    with pytest.raises(BatchPendingError, match='等待批次 1'):
+        with DeferredBatch() as deferred:
+            results = [deferred.run(call, i) for i in range(4)]
+    assert calls == [0, 1, 2, 3]
+    assert results == [0, None, 2, None]
+
+
+def test_deferred_batch_without_pending_calls():
+    with DeferredBatch() as deferred:
+        assert deferred.run(lambda: 'ok') == 'ok'
@@ -0,0 +1,74 @@
+import sqlite3
+import pytest
+from tools import llm_cache
+from tools.llm_cache import LLMCache, cache_key, cached_completion, discard_completion
+from tools.task_context import TaskContext, bind_context, unbind_context
+
+MESSAGES = [{'role': 'user', 'content': '生成知识图谱'}]
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = LLMCache(path=str(tmp_path / 'cache.sqlite3'))
+    monkeypatch.setattr(llm_cache, '_cache', store)
+    monkeypatch.setenv('llm_cache', 'on')
+    return store
+
+
+@pytest.fixture
+def context():
+    context = TaskContext()
+    context.set_stage('报告')
+    bind_context(context)
+    yield context
+    unbind_context()
+
+
+def test_miss_then_hit(store, context):
+    calls = []
+    call = lambda: calls.append(1) or '{"a": 1}'
+    assert cached_completion('qwen-plus', MESSAGES, call) == '{"a": 1}'
+    assert cached_completion('qwen-plus', MESSAGES, call) == '{"a": 1}'
+    assert len(calls) == 1
+    assert (context.get('llm_cache_misses'), context.get('llm_cache_hits')) == (1, 1)
+
+
+def test_discard_forces_new_request(store, context):
+    cached_completion('qwen-plus', MESSAGES, lambda: '坏的输出')
+    discard_completion('qwen-plus', MESSAGES)
+    assert cached_completion('qwen-plus', MESSAGES, lambda: '{"a": 1}') == '{"a": 1}'
+
+
+def test_batch_usage_is_recorded_once(store, context):
+    usage = {'prompt_tokens': 1000, 'completion_tokens': 200, 'cached_tokens': 0}
+    store.put(cache_key('qwen-plus', MESSAGES), 'qwen-plus', '{"a": 1}', usage=usage)
+    for _ in range(2):
+        cached_completion('qwen-plus', MESSAGES, lambda: pytest.fail('不应请求模型'))
+    assert context.get('llm_requests') == 1
+    assert context.get('llm_prompt_tokens') == 1000
+    assert context.get('llm_completion_tokens') == 200
+
+
+def test_old_cache_file_gains_usage_column(tmp_path):
+    path = str(tmp_path / 'old.sqlite3')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE responses (key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, "
+                 "latency REAL, created REAL, accessed REAL)")
+    conn.execute("INSERT INTO responses VALUES ('k', 'm', 'x', 1, 0.5, 0, 0)")
+    conn.commit()
+    conn.close()
+    store = LLMCache(path=path)
+    assert store.get('k') == ('x', 0.5)
+    assert store.take_usage('k') is None
+    store.put('k2', 'm', 'y', usage={'prompt_tokens': 1})
+    assert store.take_usage('k2') == {'prompt_tokens': 1}
+    assert store.take_usage('k2') is None
+
+
+def test_eviction_keeps_recent_entries(tmp_path):
+    store = LLMCache(path=str(tmp_path / 'small.sqlite3'), max_bytes=100)
+    for i in range(10):
+        store.put(f'k{i}', 'm', 'x' * 30)
+    assert store.stats()['bytes'] <= 100
+    assert store.get('k9') is not None
+    assert store.get('k0') is None
@@ -0,0 +1,181 @@
+import asyncio
+import pytest
+from tools import llm_endpoints
+from tools.llm_endpoints import CLOSED, HALF_OPEN, OPEN, Endpoint, EndpointPool, LLMUnavailableError
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class FakeStream:
+    """依次返回 chunks，遇到异常实例时抛出"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            if isinstance(chunk, BaseException):
+                raise chunk
+            yield chunk
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    """按顺序给出结果：异常实例则抛出，'hang' 表示一直等待，其余原样返回"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.chat = self
+        self.completions = self
+
+    async def create(self, **kwargs):
+        result = self.results.pop(0)
+        if result == 'hang':
+            await asyncio.sleep(3600)
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+
+def endpoint(name, *results, **breaker):
+    return Endpoint(name, f"https://{name}", None, None, client=FakeClient(*results), **breaker)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_endpoints.time, 'time', lambda: now[0])
+    return now
+
+
+def create(pool, **kwargs):
+    return asyncio.run(pool.create(model='m', messages=[], **kwargs))
+
+
+def test_fails_over_to_next_endpoint(clock):
+    a = endpoint('a', StatusError(503))
+    b = endpoint('b', 'ok', 'ok')
+    pool = EndpointPool(None, endpoints=[a, b])
+    assert create(pool) == ('ok', 'b')
+    assert a.failures == 1 and a.state == CLOSED
+    # 最近失败过的地址排在后面
+    assert pool.candidates() == [b, a]
+
+
+def test_trips_after_consecutive_failures(clock):
+    a = endpoint('a', *[StatusError(503)] * 3, failure_threshold=3, cooldown=30)
+    pool = EndpointPool(None, endpoints=[a])
+    for _ in range(3):
+        with pytest.raises(StatusError):
+            create(pool)
+    assert a.state == OPEN
+    with pytest.raises(LLMUnavailableError) as info:
+        create(pool)
+    assert info.value.retry_at == clock[0] + 30
+
+
+def test_rate_limit_does_not_trip_breaker(clock):
+    a = endpoint('a', *[StatusError(429)] * 5, failure_threshold=1)
+    b = endpoint('b', *['ok'] * 5)
+    pool = EndpointPool(None, endpoints=[a, b])
+    for _ in range(5):
+        assert create(pool) == ('ok', 'b')
+    assert a.state == CLOSED and a.failures == 0 and a.requests == 0
+
+
+def test_bad_request_is_raised_without_failover(clock):
+    a = endpoint('a', StatusError(400))
+    b = endpoint('b', 'ok')
+    pool = EndpointPool(None, endpoints=[a, b])
+    with pytest.raises(StatusError):
+        create(pool)
+    assert a.failures == 0 and b.client.results == ['ok']
+
+
+def test_half_open_allows_single_probe_and_recovers(clock):
+    a = endpoint('a', 'ok', cooldown=30)
+    a.state, a.opened_at = OPEN, clock[0]
+    clock[0] += 31
+    assert a.available(clock[0]) and a.state == HALF_OPEN
+    a.probing = True
+    assert not a.available(clock[0])
+    a.probing = False
+    assert create(EndpointPool(None, endpoints=[a])) == ('ok', 'a')
+    assert a.state == CLOSED and not a.probing
+
+
+def test_probe_released_on_cancel(clock):
+    a = endpoint('a', 'hang', cooldown=30)
+    a.state, a.opened_at = OPEN, clock[0] - 31
+    pool = EndpointPool(None, endpoints=[a])
+
+    async def cancel_probe():
+        task = asyncio.ensure_future(pool.create(model='m', messages=[]))
+        await asyncio.sleep(0.01)
+        assert a.probing
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_probe())
+    assert a.state == HALF_OPEN and not a.probing and a.failures == 0
+    assert pool.candidates() == [a]
+
+
+def test_stream_success_recorded_after_whole_stream(clock):
+    stream = FakeStream(['a', 'b'])
+    a = endpoint('a', stream)
+    pool = EndpointPool(None, endpoints=[a])
+
+    async def read():
+        response, _ = await pool.create(model='m', messages=[], stream=True)
+        # 收到响应头时还不记录结果
+        assert a.requests == 0
+        chunks = []
+        async for chunk in response:
+            clock[0] += 1
+            chunks.append(chunk)
+        return chunks
+
+    assert asyncio.run(read()) == ['a', 'b']
+    assert a.requests == 1 and a.failures == 0
+    assert a.latency == pytest.approx(2.0)
+
+
+def test_stream_failing_partway_counts_as_endpoint_failure(clock):
+    a = endpoint('a', FakeStream(['a', ConnectionError('断开')]), failure_threshold=1)
+    pool = EndpointPool(None, endpoints=[a])
+
+    async def read():
+        response, _ = await pool.create(model='m', messages=[], stream=True)
+        async for _ in response:
+            pass
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(read())
+    assert a.failures == 1 and a.latency is None and a.state == OPEN
+
+
+def test_stream_closed_by_caller_records_nothing(clock):
+    stream = FakeStream(['a', 'b'])
+    a = endpoint('a', stream)
+    a.state, a.opened_at = HALF_OPEN, 0.0
+    pool = EndpointPool(None, endpoints=[a])
+
+    async def abort():
+        response, _ = await pool.create(model='m', messages=[], stream=True)
+        assert a.probing
+        async for _ in response:
+            break
+        await response.close()
+
+    asyncio.run(abort())
+    assert stream.closed and not a.probing
+    assert a.requests == 0 and a.state == HALF_OPEN
@@ -0,0 +1,110 @@
+import asyncio
+import types
+import pytest
+from tools.llm_endpoints import Endpoint, EndpointPool
+from tools.llm_gateway import LLMGateway, estimate_request_tokens
+from tools.llm_hedging import HedgeBudget, LatencyTracker, size_bucket
+from tools.task_context import TaskContext
+
+MODEL = 'hedge-test-model'
+MESSAGES = [{'role': 'user', 'content': '生成知识图谱'}]
+
+
+def test_size_bucket_groups_similar_prompts():
+    assert size_bucket(0) == size_bucket(1) == 0
+    assert size_bucket(1000) == size_bucket(1023) != size_bucket(1024)
+
+
+def test_latency_quantile_needs_enough_samples():
+    tracker = LatencyTracker()
+    for i in range(9):
+        tracker.record('m', 1000, i + 1)
+    assert tracker.quantile('m', 1000) is None
+    tracker.record('m', 1000, 10)
+    assert tracker.quantile('m', 1000, 0.9) == 10
+    assert tracker.quantile('m', 1000, 0.5) == 6
+    assert tracker.quantile('m', 100000) is None
+
+
+def test_hedge_budget_limits_ratio():
+    budget = HedgeBudget(ratio=0.25, burst=1)
+    assert budget.try_spend()
+    assert not budget.try_spend()
+    for _ in range(3):
+        budget.on_request()
+    assert not budget.try_spend()
+    budget.on_request()
+    assert budget.try_spend()
+
+
+class DelayedClient:
+    """按顺序给出 (延迟秒数, 回复)，记录被取消的请求"""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.cancelled = []
+        self.chat = self
+        self.completions = self
+
+    async def create(self, **kwargs):
+        delay, text = self.replies.pop(0)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(text)
+            raise
+        message = types.SimpleNamespace(content=text)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=None)
+
+
+def gateway(*replies, budget=None, samples=10):
+    client = DelayedClient(*replies)
+    pool = EndpointPool(None, endpoints=[Endpoint('a', 'https://a', None, None, client=client)])
+    gateway = LLMGateway(pool=pool)
+    gateway.hedge_budget = budget or HedgeBudget(ratio=1, burst=1)
+    for _ in range(samples):
+        gateway.latency.record(MODEL, estimate_request_tokens(MESSAGES), 0.05)
+    return gateway, client
+
+
+@pytest.fixture
+def context():
+    context = TaskContext()
+    context.set_stage('测试')
+    return context
+
+
+def complete(gateway, context, **kwargs):
+    return asyncio.run(gateway.acomplete(MESSAGES, MODEL, context=context, hedge=True, **kwargs))
+
+
+def test_slow_request_is_hedged_and_loser_cancelled(context):
+    gw, client = gateway((5, '慢'), (0, '快'))
+    assert complete(gw, context) == '快'
+    assert client.cancelled == ['慢']
+    assert context.get('llm_hedges') == 1
+    assert context.get('llm_hedge_wins') == 1
+
+
+def test_no_hedge_without_budget(context):
+    gw, client = gateway((0.2, '慢'), (0, '快'), budget=HedgeBudget(ratio=0, burst=0))
+    assert complete(gw, context) == '慢'
+    assert context.get('llm_hedges_denied') == 1
+    assert client.replies == [(0, '快')]
+
+
+def test_no_hedge_without_latency_samples(context):
+    gw, client = gateway((0.1, '慢'), (0, '快'), samples=5)
+    assert complete(gw, context) == '慢'
+    assert context.get('llm_hedges') == 0
+
+
+def test_rejected_reply_does_not_win(context):
+    gw, client = gateway((0.1, '不合格'), (0.3, '合格'))
+    assert complete(gw, context, accept=lambda reply: reply == '合格') == '合格'
+    assert context.get('llm_hedge_wins') == 1
+
+
+def test_rejected_replies_fall_back_to_first(context):
+    gw, client = gateway((0.1, '第一个'), (0.2, '第二个'))
+    assert complete(gw, context, accept=lambda reply: False) == '第一个'
@@ -0,0 +1,96 @@
+import asyncio
+import pytest
+from tools.llm_limiter import LLMRateLimiter, TokenBucket
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(60)
+    now = bucket.updated
+    bucket.take(60, now)
+    assert bucket.wait_time(1, now) == pytest.approx(1.0)
+    assert bucket.wait_time(1, now + 1) == 0.0
+    assert bucket.wait_time(10, now + 1) == pytest.approx(9.0)
+
+
+def test_token_bucket_caps_oversize_requests_and_settles():
+    bucket = TokenBucket(60)
+    now = bucket.updated
+    assert bucket.wait_time(1000, now) == 0.0
+    bucket.take(1000, now)
+    assert bucket.tokens == 0
+    bucket.adjust(-30)
+    assert bucket.tokens == 30
+    bucket.adjust(50)
+    assert bucket.tokens == -20
+
+
+def test_unlimited_model_does_not_queue():
+    limiter = LLMRateLimiter(limits={})
+    assert asyncio.run(limiter.acquire('any-model', 10 ** 6)) == 0.0
+
+
+def test_waiters_are_released_by_priority():
+    # 每秒补充 1000 个 token：耗尽后每个 50 token 的请求约 0.05 秒放行一个
+    limiter = LLMRateLimiter(limits={'m': {'tpm': 60000}})
+    order = []
+
+    async def request(name, priority):
+        await limiter.acquire('m', 50, priority)
+        order.append(name)
+
+    async def main():
+        await limiter.acquire('m', 60000)
+        tasks = [asyncio.ensure_future(request(f'bulk{i}', (2, 0))) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.ensure_future(request('interactive', (0, 0))))
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == ['interactive', 'bulk0', 'bulk1', 'bulk2']
+
+
+def test_only_one_wakeup_timer_is_pending():
+    limiter = LLMRateLimiter(limits={'m': {'rpm': 60}})
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        timers = []
+        call_later = loop.call_later
+        loop.call_later = lambda *args: timers.append(call_later(*args)) or timers[-1]
+        await limiter.acquire('m', 1)
+        queue = limiter.queues['m']
+        queue.requests.tokens = 0
+        tasks = [asyncio.ensure_future(limiter.acquire('m', 1)) for _ in range(5)]
+        await asyncio.sleep(0)
+        assert len(timers) == 5
+        assert sum(not timer.cancelled() for timer in timers) == 1
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        queue.timer.cancel()
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_is_skipped():
+    limiter = LLMRateLimiter(limits={'m': {'tpm': 60000}})
+
+    async def main():
+        await limiter.acquire('m', 60000)
+        first = asyncio.ensure_future(limiter.acquire('m', 50))
+        second = asyncio.ensure_future(limiter.acquire('m', 50))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await asyncio.wait_for(second, 1)
+
+    assert asyncio.run(main()) < 0.5
+
+
+def test_penalize_pauses_the_model():
+    limiter = LLMRateLimiter(limits={'m': {'rpm': 6000}})
+
+    async def main():
+        limiter.penalize('m', 0.2)
+        return await limiter.acquire('m', 1)
+
+    assert asyncio.run(main()) >= 0.19
@@ -0,0 +1,56 @@
+from tools.llm_router import LLMRouter, RouteStats
+from tools.task_context import TaskContext, bind_context, unbind_context
+
+SHORT = [{'role': 'user', 'content': '短'}]
+LONG = [{'role': 'user', 'content': '长' * 20000}]
+
+
+def test_select_by_prompt_size():
+    router = LLMRouter(routes={})
+    assert router.select('video_tree_chunk', SHORT) == 'qwen-turbo'
+    assert router.select('video_tree_chunk', LONG) == 'qwen-plus'
+    assert router.select('video_tree_merge', LONG) == 'qwen-max'
+
+
+def test_unknown_route_uses_default():
+    router = LLMRouter(routes={'default': [{'model': 'm-default'}]})
+    assert router.select('不存在的路由', SHORT) == 'm-default'
+
+
+def test_routes_override_from_config(monkeypatch):
+    monkeypatch.setenv('llm_routes', '{"report": [{"max_tokens": 10, "model": "small"}, {"model": "large"}]}')
+    router = LLMRouter()
+    assert router.select('report', SHORT) == 'small'
+    assert router.select('report', LONG) == 'large'
+    # 未覆盖的路由保持默认
+    assert router.select('doc_tree', SHORT) == 'qwen-max'
+
+
+def test_falls_back_to_last_rule_when_none_match():
+    router = LLMRouter(routes={'r': [{'max_tokens': 10, 'model': 'small'}, {'max_tokens': 100, 'model': 'mid'}]})
+    assert router.select('r', LONG) == 'mid'
+
+
+def test_selection_recorded_in_task_metrics():
+    context = TaskContext()
+    context.set_stage('报告')
+    bind_context(context)
+    try:
+        LLMRouter(routes={}).select('report', SHORT)
+    finally:
+        unbind_context()
+    assert context.get('llm_route.report.qwen-plus') == 1
+
+
+def test_route_stats():
+    stats = RouteStats()
+    for seconds in range(1, 11):
+        stats.record_request('report', 'qwen-plus', seconds)
+    stats.record_request('report', 'qwen-plus', 99, ok=False)
+    stats.record_quality('report', 'qwen-plus', 'repaired')
+    stats.record_quality('report', 'qwen-plus', 'valid')
+    stats.record_quality('report', 'qwen-plus', 'valid')
+    [entry] = stats.stats()
+    assert entry['requests'] == 11 and entry['errors'] == 1
+    assert (entry['latency_p50'], entry['latency_p90']) == (6, 10)
+    assert (entry['valid'], entry['repaired'], entry['reprompted'], entry['failed']) == (2, 1, 0, 0)
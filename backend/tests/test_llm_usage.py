@@ -0,0 +1,95 @@
+import asyncio
+import pytest
+from tools import llm_usage
+from tools.llm_endpoints import Endpoint, EndpointPool
+from tools.llm_gateway import LLMGateway, estimate_request_tokens, expected_output_tokens
+from tools.llm_usage import merge_usage, record_usage, request_cost, usage_from_metrics
+from tools.task_context import TaskContext
+
+
+@pytest.fixture(autouse=True)
+def reset_prices(monkeypatch):
+    monkeypatch.setattr(llm_usage, '_prices', None)
+
+
+def test_request_cost_uses_price_table():
+    # qwen-plus：提示词 0.8 元、输出 2 元每百万 token
+    assert request_cost('qwen-plus', 1000000, 500000) == pytest.approx(1.8)
+
+
+def test_cached_prompt_tokens_are_discounted(monkeypatch):
+    monkeypatch.setenv('llm_cached_price_ratio', '0.5')
+    assert request_cost('qwen-plus', 1000000, 0, cached_tokens=1000000) == pytest.approx(0.4)
+
+
+def test_unknown_model_costs_nothing_and_prices_can_be_overridden(monkeypatch):
+    assert request_cost('local-model', 1000, 1000) == 0.0
+    monkeypatch.setenv('llm_prices', '{"local-model": {"prompt": 1, "completion": 1}}')
+    monkeypatch.setattr(llm_usage, '_prices', None)
+    assert request_cost('local-model', 1000000, 1000000) == pytest.approx(2.0)
+
+
+def test_record_usage_accumulates_per_stage():
+    context = TaskContext()
+    context.set_stage('报告')
+    record_usage(context, None, 'qwen-plus', 1000, 200, 400)
+    record_usage(context, None, 'qwen-plus', 1000, 300)
+    metrics = context.snapshot()['报告']
+    assert (metrics['llm_prompt_tokens'], metrics['llm_cached_tokens'], metrics['llm_completion_tokens']) == (2000, 400, 500)
+    assert metrics['llm_cost'] > 0
+
+
+def test_usage_from_metrics_skips_stages_without_usage():
+    summary = usage_from_metrics({
+        '字幕转录': {'wall_seconds': 12.0},
+        '视频图谱': {'llm_requests': 2, 'llm_prompt_tokens': 100, 'llm_completion_tokens': 50, 'llm_cost': 0.1},
+        '报告': {'llm_requests': 1, 'llm_prompt_tokens': 10, 'llm_completion_tokens': 5, 'llm_cost': 0.01},
+    })
+    assert set(summary['stages']) == {'视频图谱', '报告'}
+    assert summary['stages']['视频图谱']['total_tokens'] == 150
+    assert summary['total']['requests'] == 3
+    assert summary['total']['cost'] == pytest.approx(0.11)
+
+
+def test_usage_from_metrics_of_old_task_is_empty():
+    assert usage_from_metrics(None)['total']['total_tokens'] == 0
+
+
+def test_merge_usage_averages_over_tasks_with_usage():
+    first = usage_from_metrics({'报告': {'llm_requests': 2, 'llm_prompt_tokens': 100, 'llm_cost': 0.2}})
+    second = usage_from_metrics({'报告': {'llm_requests': 4, 'llm_prompt_tokens': 300, 'llm_cost': 0.4}})
+    merged = merge_usage([first, second, usage_from_metrics({}), None])
+    assert merged['tasks'] == 2
+    assert merged['stages']['报告']['prompt_tokens'] == 400
+    assert merged['average_per_task']['requests'] == 3
+    assert merged['average_per_task']['cost'] == pytest.approx(0.3)
+
+
+class HangingClient:
+    def __init__(self):
+        self.chat = self
+        self.completions = self
+
+    async def create(self, **kwargs):
+        await asyncio.sleep(3600)
+
+
+def test_cancelled_request_records_estimated_usage():
+    pool = EndpointPool(None, endpoints=[Endpoint('a', 'https://a', None, None, client=HangingClient())])
+    gateway = LLMGateway(pool=pool)
+    context = TaskContext()
+    context.set_stage('报告')
+    messages = [{'role': 'user', 'content': '生成知识图谱'}]
+
+    async def cancel():
+        task = asyncio.ensure_future(gateway.acomplete(messages, 'usage-test-model', context=context))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel())
+    metrics = context.snapshot()['报告']
+    assert metrics['llm_prompt_tokens'] == estimate_request_tokens(messages) - expected_output_tokens()
+    assert metrics['llm_completion_tokens'] == 0
+    assert metrics['llm_usage_estimated'] == 1
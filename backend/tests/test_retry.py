@@ -0,0 +1,167 @@
+import time
+import pytest
+from tools.retry import (RetryPolicy, StageRequeuedError, is_retryable, retry, retry_call, run_requeueable)
+from tools.task_context import TaskContext, bind_context, unbind_context
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = type('Response', (), {'status_code': status_code, 'headers': headers or {}})()
+
+
+class APIConnectionError(Exception):
+    """与 openai 的网络异常同名，按类名识别"""
+
+
+class ServiceUnavailable(Exception):
+    requeue_stage = True
+
+    def __init__(self, retry_at):
+        super().__init__("所有模型服务均已熔断")
+        self.retry_at = retry_at
+
+
+def raising(exc):
+    def func():
+        raise exc
+    return func
+
+
+@pytest.fixture
+def context():
+    context = TaskContext()
+    context.set_stage('步骤')
+    bind_context(context)
+    yield context
+    unbind_context()
+
+
+@pytest.mark.parametrize('exc, expected', [
+    (StatusError(429), True),
+    (StatusError(503), True),
+    (StatusError(520), True),
+    (StatusError(400), False),
+    (StatusError(401), False),
+    (APIConnectionError(), True),
+    (TimeoutError(), True),
+    (ConnectionResetError(), True),
+    (RuntimeError(), True),
+    (ValueError(), False),
+    (KeyError('x'), False),
+    (FileNotFoundError(), False),
+    (NotADirectoryError(), False),
+])
+def test_is_retryable(exc, expected):
+    assert is_retryable(exc) is expected
+
+
+def test_exhausted_and_requeued_errors_are_not_retried_again():
+    exc = StatusError(503)
+    exc.retry_exhausted = True
+    assert not is_retryable(exc)
+    assert not is_retryable(ServiceUnavailable(0))
+
+
+def test_policy_delay_grows_and_is_capped():
+    policy = RetryPolicy(max_attempts=5, base_delay=1, max_delay=5, jitter=0)
+    assert [policy.delay(n) for n in range(1, 5)] == [1, 2, 4, 5]
+
+
+def test_policy_delay_jitter_only_shortens():
+    policy = RetryPolicy(base_delay=4, max_delay=30, jitter=0.5)
+    assert all(2 <= policy.delay(1) <= 4 for _ in range(50))
+
+
+def test_policy_honours_retry_after():
+    policy = RetryPolicy(base_delay=1, max_delay=30)
+    assert policy.delay(1, StatusError(429, {'retry-after': '7'})) == 7
+    assert policy.delay(1, StatusError(429, {'retry-after': '90'})) == 30
+
+
+def test_retry_call_retries_until_success(context):
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise StatusError(503)
+        return 'ok'
+
+    assert retry_call(flaky, policy=RetryPolicy(max_attempts=3, base_delay=0)) == 'ok'
+    assert context.get('retries') == 2
+
+
+def test_retry_call_does_not_retry_fatal_errors(context):
+    calls = []
+
+    def broken():
+        calls.append(1)
+        raise ValueError('参数错误')
+
+    with pytest.raises(ValueError):
+        retry_call(broken, policy=RetryPolicy(max_attempts=3, base_delay=0))
+    assert len(calls) == 1
+    assert context.get('retry_fatal') == 1
+
+
+def test_retry_call_marks_exhausted(context):
+    with pytest.raises(StatusError) as info:
+        retry_call(raising(StatusError(503)), policy=RetryPolicy(max_attempts=2, base_delay=0))
+    assert info.value.retry_exhausted
+    assert context.get('retry_exhausted') == 1
+
+
+def test_retry_budget_stops_retries(context, monkeypatch):
+    monkeypatch.setenv('retry_budget_stage', '1')
+    calls = []
+
+    def failing():
+        calls.append(1)
+        raise StatusError(503)
+
+    with pytest.raises(StatusError):
+        retry_call(failing, policy=RetryPolicy(max_attempts=5, base_delay=0))
+    assert len(calls) == 2
+    assert context.get('retries_denied') == 1
+
+
+def test_retry_decorator_default_does_not_swallow_requeue():
+    @retry(max_attempts=1, default=None)
+    def fails_fatally():
+        raise ValueError()
+
+    @retry(max_attempts=1, default=None)
+    def service_down():
+        raise ServiceUnavailable(0)
+
+    assert fails_fatally() is None
+    with pytest.raises(ServiceUnavailable):
+        service_down()
+
+
+def test_run_requeueable_hands_stage_back(context):
+    retry_at = time.time() + 60
+
+    def stage():
+        raise ServiceUnavailable(retry_at)
+
+    with pytest.raises(StageRequeuedError) as info:
+        run_requeueable(stage, max_requeues=1)
+    assert info.value.task_requeued and info.value.retry_at == retry_at
+    assert context.get('stage_requeues') == 1
+    # 交还次数用尽后抛出原异常
+    with pytest.raises(ServiceUnavailable):
+        run_requeueable(stage, max_requeues=1)
+
+
+def test_run_requeueable_without_context_raises_original():
+    with pytest.raises(ServiceUnavailable):
+        run_requeueable(raising(ServiceUnavailable(0)))
+
+
+def test_run_requeueable_passes_other_errors_and_results(context):
+    assert run_requeueable(lambda: 'ok') == 'ok'
+    with pytest.raises(ValueError):
+        run_requeueable(raising(ValueError()))
@@ -0,0 +1,69 @@
+import pytest
+from tools.subtitles import SubtitleTrack, format_srt_time, parse_srt_time
+
+DICTS = [
+    {'id': '1', 'start': '00:00:01,200', 'end': '00:00:03,050', 'content': '同学们好', 'speaker': '1'},
+    {'id': '2', 'start': '00:59:59,999', 'end': '01:00:02,000', 'content': '今天讲图', 'speaker': ''},
+    {'id': '3', 'start': '01:00:03,000', 'end': '01:00:04,500', 'content': '先看定义', 'speaker': '1'},
+]
+
+
+@pytest.mark.parametrize('ms', [0, 1, 999, 1000, 59999, 3599999, 3600000, 36000123])
+def test_srt_time_round_trip(ms):
+    assert parse_srt_time(format_srt_time(ms)) == ms
+
+
+def test_format_srt_time():
+    assert format_srt_time(3723004) == '01:02:03,004'
+
+
+def test_parse_srt_time_without_millis():
+    assert parse_srt_time(' 00:01:02 ') == 62000
+
+
+def test_dicts_round_trip():
+    track = SubtitleTrack.from_dicts(DICTS)
+    assert track.to_dicts() == DICTS
+    assert str(track) == str(DICTS)
+
+
+def test_speakers_are_deduplicated():
+    track = SubtitleTrack.from_dicts(DICTS)
+    assert track.speakers == ['', '1']
+    assert track.speaker(2) == '1'
+
+
+def test_indexing_and_slicing():
+    track = SubtitleTrack.from_dicts(DICTS)
+    assert track[-1] == DICTS[-1]
+    assert track[1:].to_dicts()[0]['content'] == '今天讲图'
+    assert track.start_seconds(0) == 1.2
+    with pytest.raises(IndexError):
+        track[3]
+
+
+def test_extend_remaps_speakers():
+    first = SubtitleTrack()
+    first.append(0, 1000, 'a', 'teacher')
+    second = SubtitleTrack()
+    second.append(1000, 2000, 'b', 'student')
+    second.append(2000, 3000, 'c', 'teacher')
+    first.extend(second)
+    assert [first.speaker(i) for i in range(len(first))] == ['teacher', 'student', 'teacher']
+
+
+def test_to_srt():
+    track = SubtitleTrack.from_dicts(DICTS[:2])
+    assert track.to_srt() == ("1\n00:00:01,200 --> 00:00:03,050\n同学们好\n\n"
+                              "2\n00:59:59,999 --> 01:00:02,000\n今天讲图\n")
+
+
+def test_from_order_result_joins_words_and_applies_offset():
+    data = {'lattice2': [{
+        'begin': '100', 'end': '900',
+        'json_1best': {'st': {'rl': '0', 'rt': [{'ws': [{'cw': [{'w': '你'}]}, {'cw': [{'w': '好'}]}]}]}},
+    }]}
+    track = SubtitleTrack.from_order_result(data, offset_ms=60000)
+    assert track[0]['content'] == '你好'
+    assert (track.starts[0], track.ends[0]) == (60100, 60900)
+    assert track.speaker(0) == ''
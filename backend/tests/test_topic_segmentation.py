@@ -0,0 +1,67 @@
+import random
+from tools.subtitles import SubtitleTrack
+from tools.topic_segmentation import pack_segments, segment_topics, topic_digest
+from tools.transcript import estimate_tokens
+
+TOPIC_A = ['矩阵', '特征值', '特征向量', '线性变换', '行列式', '对角化', '秩']
+TOPIC_B = ['细胞', '染色体', '有丝分裂', '基因', '遗传', '蛋白质', '减数分裂']
+
+
+def make_track(topics, lines_per_topic=120, seconds_per_line=5, seed=0):
+    rng = random.Random(seed)
+    track = SubtitleTrack()
+    for vocabulary in topics:
+        for _ in range(lines_per_topic):
+            start = len(track) * seconds_per_line * 1000
+            text = '我们来看' + ''.join(rng.choice(vocabulary) for _ in range(6)) + '。'
+            track.append(start, start + seconds_per_line * 1000 - 100, text)
+    return track
+
+
+def covered_indices(chunks):
+    return [text for chunk in chunks for text in chunk.texts]
+
+
+def test_boundary_found_at_topic_change():
+    track = make_track([TOPIC_A, TOPIC_B])
+    segments = segment_topics(track)
+    assert any(abs(segment['start_index'] - 120) <= 10 for segment in segments[1:])
+    assert segments[0]['start_index'] == 0 and segments[-1]['end_index'] == len(track)
+
+
+def test_segments_are_contiguous():
+    segments = segment_topics(make_track([TOPIC_A, TOPIC_B, TOPIC_A]))
+    for previous, current in zip(segments, segments[1:]):
+        assert previous['end_index'] == current['start_index']
+
+
+def test_empty_track_has_no_segments():
+    assert segment_topics(SubtitleTrack()) == []
+
+
+def test_pack_segments_respects_max_tokens_and_keeps_all_lines():
+    track = make_track([TOPIC_A, TOPIC_B])
+    segments = segment_topics(track)
+    total = estimate_tokens(''.join(track.texts))
+    chunks = pack_segments(track, segments, max_tokens=total)
+    assert len(chunks) == 1
+    assert covered_indices(chunks) == track.texts
+
+
+def test_pack_segments_splits_oversize_segment_by_time():
+    track = make_track([TOPIC_A])
+    segments = segment_topics(track, min_segment_seconds=10 ** 6)
+    assert len(segments) == 1
+    total = estimate_tokens(''.join(track.texts))
+    chunks = pack_segments(track, segments, max_tokens=total // 3 + 1)
+    assert len(chunks) >= 3
+    assert covered_indices(chunks) == track.texts
+    assert all(estimate_tokens(''.join(chunk.texts)) <= total // 3 + 20 for chunk in chunks)
+
+
+def test_topic_digest_lists_time_ranges():
+    track = make_track([TOPIC_A, TOPIC_B])
+    lines = topic_digest(track, head_chars=10).splitlines()
+    assert len(lines) == len(segment_topics(track))
+    assert lines[0].startswith('[00:00:00-')
+    assert lines[0].endswith('……')
@@ -0,0 +1,35 @@
+from tools.subtitles import SubtitleTrack
+from tools.transcript import encode_transcript, estimate_raw_tokens, estimate_tokens, merge_blocks
+
+
+def make_track(count=50, speakers=('', '1')):
+    track = SubtitleTrack()
+    for i in range(count):
+        track.append(i * 2000, i * 2000 + 1800, f'第{i}句讲解内容。', speakers[i % len(speakers)])
+    return track
+
+
+def test_estimate_raw_tokens_close_to_full_string():
+    track = make_track()
+    actual = estimate_tokens(str(track))
+    assert abs(estimate_raw_tokens(track) - actual) <= 0.05 * actual
+
+
+def test_estimate_raw_tokens_empty_track():
+    assert estimate_raw_tokens(SubtitleTrack()) == 0
+
+
+def test_merge_blocks_breaks_on_speaker_change():
+    blocks = merge_blocks(make_track(4))
+    assert [block[2] for block in blocks] == ['', '1', '', '1']
+
+
+def test_encode_transcript_is_shorter_than_raw():
+    track = make_track(speakers=('',))
+    encoded = encode_transcript(track)
+    assert encoded.startswith('[00:00:00-')
+    assert estimate_tokens(encoded) < estimate_raw_tokens(track) / 2
+
+
+def test_encode_transcript_passes_strings_through():
+    assert encode_transcript('已编码') == '已编码'
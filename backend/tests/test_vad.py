@@ -0,0 +1,51 @@
+import numpy as np
+
+from tools import vad
+
+
+def energies(*spans):
+    """按 (毫秒, dBFS) 依次拼出每帧的能量"""
+    return np.concatenate([np.full(ms // vad.FRAME_MS, level, dtype=float) for ms, level in spans])
+
+
+def test_offset_map_maps_trimmed_time_back():
+    offset_map = vad.OffsetMap([(1000, 3000), (5000, 6000)])
+    assert offset_map.trimmed_duration == 3000
+    assert offset_map.to_original(0) == 1000
+    assert offset_map.to_original(1500) == 2500
+    assert offset_map.to_original(2500) == 5500
+
+
+def test_offset_map_boundary_belongs_to_previous_interval_for_end_times():
+    offset_map = vad.OffsetMap([(1000, 3000), (5000, 6000)])
+    assert offset_map.to_original(2000) == 5000
+    assert offset_map.to_original(2000, is_end=True) == 3000
+
+
+def test_offset_map_round_trips_through_dict():
+    offset_map = vad.OffsetMap([(0, 10), (20, 30)])
+    assert vad.OffsetMap.from_dict(offset_map.to_dict()).intervals == offset_map.intervals
+
+
+def test_empty_offset_map_is_identity():
+    assert vad.OffsetMap([]).to_original(1234) == 1234
+
+
+def test_detect_speech_drops_long_silence_and_pads_regions():
+    regions = vad.detect_speech(energies((3000, -70), (3000, -20), (3000, -70), (3000, -20), (3000, -70)))
+    assert regions == [(2800, 6200), (8800, 12200)]
+
+
+def test_detect_speech_merges_short_pauses():
+    regions = vad.detect_speech(energies((3000, -70), (2000, -20), (600, -70), (2000, -20), (3000, -70)))
+    assert len(regions) == 1
+
+
+def test_detect_speech_keeps_everything_without_dynamic_range():
+    frames = energies((6000, -30))
+    assert vad.detect_speech(frames) == [(0, len(frames) * vad.FRAME_MS)]
+
+
+def test_build_offset_map_keeps_short_pause_after_speech():
+    offset_map = vad.build_offset_map([(1000, 2000), (2100, 3000)], total_ms=10000, keep_silence_ms=300)
+    assert offset_map.intervals == [(1000, 2100), (2100, 3300)]
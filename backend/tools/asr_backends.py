@@ -0,0 +1,125 @@
+import os
+import abc
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from .background_loop import run_coroutine
+
+# 已注册的转录服务，名称 -> 类
+ASR_BACKENDS = {}
+
+
+def register_asr_backend(name):
+    """注册转录服务实现的类装饰器"""
+    def decorator(cls):
+        cls.name = name
+        ASR_BACKENDS[name] = cls
+        return cls
+    return decorator
+
+
+class AsrBackend(abc.ABC):
+    """
+    转录服务接口。
+    submit() 提交一段音频，返回带 wait()/polls/elapsed 的订单对象，
+    wait() 返回讯飞 orderResult 格式（含 lattice2）的 dict，供 convert_to_srt 解析。
+    """
+    name = None
+
+    @abc.abstractmethod
+    def submit(self, audio_path, duration=None):
+        """提交音频 audio_path（时长 duration 秒，可缺省），返回订单对象"""
+
+    def transcribe(self, audio_path, duration=None):
+        """提交并阻塞等待转录结果"""
+        return self.submit(audio_path, duration).wait()
+
+
+class ReplayOrder:
+    """回放服务的订单，结果在模拟延迟到期后由后台事件循环给出"""
+
+    def __init__(self, future):
+        self.future = future
+        self.submitted = time.time()
+        self.polls = 0
+
+    def wait(self, timeout=None):
+        return self.future.result(timeout)
+
+    @property
+    def elapsed(self):
+        return time.time() - self.submitted
+
+
+@register_asr_backend('replay')
+class ReplayBackend(AsrBackend):
+    """
+    离线回放服务：从 asr_replay_dir 读取录制好的 orderResult，在可配置的延迟后返回，
+    用于在没有讯飞服务的环境中复现地压测和对比调度策略。
+
+    录制文件可以是 getResult 的完整响应，也可以是解析后的 orderResult；
+    录制文件名为 "{音频文件名}-{订单号}.json"（见 asr_record_dir），优先在同名音频的录制中选择，
+    没有时在全部录制中选择；各任务的音频文件名相同，因此按音频所在任务文件夹和文件名的哈希分散选择，
+    保证多次运行结果一致。
+    延迟 = asr_replay_latency + asr_replay_latency_ratio × 音频时长，再乘以 ±asr_replay_jitter 的随机扰动。
+    """
+
+    def __init__(self, replay_dir=None, latency=None, latency_ratio=None, jitter=None, seed=None):
+        self.replay_dir = replay_dir or os.getenv('asr_replay_dir', '')
+        if not self.replay_dir or not os.path.isdir(self.replay_dir):
+            raise ValueError(f"回放目录不存在：{self.replay_dir!r}，请配置 asr_replay_dir")
+        self.recordings = sorted(f for f in os.listdir(self.replay_dir) if f.endswith('.json'))
+        if not self.recordings:
+            raise ValueError(f"回放目录中没有录制文件：{self.replay_dir}")
+        self.latency = latency if latency is not None else float(os.getenv('asr_replay_latency', '1'))
+        self.latency_ratio = latency_ratio if latency_ratio is not None else float(os.getenv('asr_replay_latency_ratio', '0'))
+        self.jitter = jitter if jitter is not None else float(os.getenv('asr_replay_jitter', '0'))
+        self._random = random.Random(seed if seed is not None else os.getenv('asr_replay_seed', '0'))
+        self._lock = threading.Lock()
+
+    def choose_recording(self, audio_path):
+        filename = os.path.basename(audio_path)
+        stem = os.path.splitext(filename)[0]
+        candidates = [f for f in self.recordings
+                      if f.startswith(stem + '-') or os.path.splitext(f)[0] == stem] or self.recordings
+        task_folder = os.path.basename(os.path.dirname(os.path.abspath(audio_path)))
+        digest = hashlib.md5(f"{task_folder}/{filename}".encode('utf-8')).hexdigest()
+        return candidates[int(digest, 16) % len(candidates)]
+
+    def load_recording(self, filename):
+        with open(os.path.join(self.replay_dir, filename), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        # 兼容 getResult 完整响应
+        if 'content' in data and 'orderResult' in data.get('content', {}):
+            data = data['content']['orderResult']
+        if isinstance(data, str):
+            data = json.loads(data)
+        return data
+
+    def latency_for(self, duration):
+        delay = self.latency + self.latency_ratio * (duration or 0)
+        if self.jitter:
+            with self._lock:
+                delay *= 1 + self._random.uniform(-self.jitter, self.jitter)
+        return max(0.0, delay)
+
+    def submit(self, audio_path, duration=None):
+        result = self.load_recording(self.choose_recording(audio_path))
+        delay = self.latency_for(duration)
+
+        async def deliver():
+            await asyncio.sleep(delay)
+            return result
+
+        return ReplayOrder(run_coroutine(deliver()))
+
+
+def get_asr_backend(name=None):
+    """按名称（默认读取配置 asr_backend）创建转录服务"""
+    name = name or os.getenv('asr_backend', 'xfyun')
+    if name not in ASR_BACKENDS:
+        raise ValueError(f"未知的转录服务 {name}，可选：{', '.join(ASR_BACKENDS)}")
+    return ASR_BACKENDS[name]()
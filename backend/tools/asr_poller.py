@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import asyncio
+import threading
+import concurrent.futures
+import httpx
+from .background_loop import run_coroutine, call_soon
+
+# 讯飞订单状态：0 已创建，3 处理中，4 已完成，-1 失败
+STATUS_DONE = 4
+STATUS_FAILED = -1
+
+# 轮询间隔上下限（秒）
+MIN_POLL_INTERVAL = 5
+MAX_POLL_INTERVAL = 120
+# 使用回调时仍保留低频轮询，防止回调丢失；间隔按预计完成时间安排，不超过该值
+CALLBACK_FALLBACK_INTERVAL = 300
+# 订单最长等待时间至少为音频时长的倍数
+ORDER_TIMEOUT_RATIO = 3
+# 连续查询出错的次数上限
+MAX_QUERY_ERRORS = 5
+
+
+class AsrOrder:
+    """一个已提交的转录订单，wait() 阻塞直到出结果"""
+
+    def __init__(self, order_id, params_factory, audio_seconds, timeout):
+        self.order_id = order_id
+        self.params_factory = params_factory  # 每次查询前重新生成签名参数
+        self.audio_seconds = audio_seconds or 0
+        self.timeout = timeout  # 从提交起的最长等待秒数，超时后订单失败
+        self.submitted = time.time()
+        self.polls = 0
+        self.future = concurrent.futures.Future()
+        self.event = asyncio.Event()  # 回调到达时唤醒轮询
+
+    def wait(self, timeout=None):
+        """未指定 timeout 时最多等待到订单超时（另留一次查询的余量），超时抛出 TimeoutError"""
+        if timeout is None:
+            timeout = max(0, self.timeout - self.elapsed) + MAX_POLL_INTERVAL
+        return self.future.result(timeout)
+
+    @property
+    def elapsed(self):
+        return time.time() - self.submitted
+
+
+class AsrPoller:
+    """
+    在进程共用的后台事件循环中统一跟踪所有未完成的转录订单：
+    - 共用一个 httpx.AsyncClient 连接池；
+    - 首次查询安排在按音频时长和历史处理速度估计的完成时间附近，之后逐步缩短/拉长间隔；
+    - 全局限制查询频率，避免触发查询接口的频率限制；
+    - 配置了回调地址时，收到回调立即查询，轮询仅作兜底。
+    """
+
+    def __init__(self, result_url, max_qps=None, use_callback=False):
+        self.result_url = result_url  # 查询结果接口地址
+        self.max_qps = max_qps or float(os.getenv('asr_poll_qps', '5'))
+        self.use_callback = use_callback
+        # 处理耗时与音频时长之比的滑动平均，用于估计订单完成时间
+        self.speed_ratio = float(os.getenv('asr_expected_ratio', '0.2'))
+        self._orders = {}
+        self._lock = threading.Lock()
+        self._client = None
+        self._next_query_at = 0.0
+
+    def _get_client(self):
+        """在后台事件循环中首次查询时创建共享连接池"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(30, connect=10),
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=10))
+        return self._client
+
+    def expected_seconds(self, audio_seconds):
+        """按历史处理速度估计订单从提交到完成的耗时"""
+        return max(MIN_POLL_INTERVAL, audio_seconds * self.speed_ratio)
+
+    @staticmethod
+    def order_timeout(audio_seconds):
+        """订单最长等待秒数：asr_order_timeout（默认 1800），且不少于音频时长的 ORDER_TIMEOUT_RATIO 倍"""
+        return max(float(os.getenv('asr_order_timeout', '1800')), (audio_seconds or 0) * ORDER_TIMEOUT_RATIO)
+
+    def _first_wait(self, order):
+        expected = self.expected_seconds(order.audio_seconds)
+        if self.use_callback:
+            # 回调通常先到；预计完成后仍未收到回调时查询一次，防止回调丢失时长时间等待
+            return min(CALLBACK_FALLBACK_INTERVAL, expected * 1.2)
+        return min(MAX_POLL_INTERVAL, expected * 0.8)
+
+    def _next_interval(self, order):
+        remaining = self.expected_seconds(order.audio_seconds) - order.elapsed
+        # 预计快完成时间隔变短；超出预期后按已等待时长的比例逐渐拉长
+        interval = remaining / 2 if remaining > 0 else order.elapsed * 0.1
+        max_interval = CALLBACK_FALLBACK_INTERVAL if self.use_callback else MAX_POLL_INTERVAL
+        return min(max_interval, max(MIN_POLL_INTERVAL, interval))
+
+    def submit(self, order_id, params_factory, audio_seconds=None):
+        """登记一个订单并开始跟踪，返回 AsrOrder"""
+        order = AsrOrder(order_id, params_factory, audio_seconds, self.order_timeout(audio_seconds))
+        with self._lock:
+            self._orders[order_id] = order
+        run_coroutine(self._track(order))
+        return order
+
+    def notify(self, order_id):
+        """回调到达时唤醒对应订单立即查询，未知订单返回 False"""
+        with self._lock:
+            order = self._orders.get(order_id)
+        if order is None:
+            return False
+        call_soon(order.event.set)
+        return True
+
+    async def _throttle(self):
+        """所有订单共享查询频率上限"""
+        now = time.monotonic()
+        wait = self._next_query_at - now
+        self._next_query_at = max(now, self._next_query_at) + 1 / self.max_qps
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def _query(self, order):
+        """
+        查询一次订单状态，返回 (orderInfo, 完整结果)。
+        网络异常、非 json 响应和错误码（如查询频率超限）返回 (None, 错误说明)，由调用方稍后重新查询。
+        """
+        await self._throttle()
+        order.polls += 1
+        try:
+            response = await self._get_client().post(self.result_url, params=order.params_factory(),
+                                                     headers={"Content-type": "application/json"})
+            result = json.loads(response.text)
+        except (httpx.HTTPError, ValueError) as e:
+            return None, f"{type(e).__name__} {e}"
+        order_info = (result.get('content') or {}).get('orderInfo')
+        if result.get('code', '000000') != '000000' or not order_info:
+            return None, f"{result.get('code')} {result.get('descInfo')}"
+        return order_info, result
+
+    async def _track(self, order):
+        try:
+            await self._sleep_or_notified(order, self._first_wait(order))
+            errors = 0
+            while True:
+                if order.elapsed > order.timeout:
+                    raise TimeoutError(f"转录订单超时：{order.order_id}，已等待 {order.elapsed:.0f} 秒")
+                order_info, result = await self._query(order)
+                if order_info is None:
+                    # 临时错误稍后重新查询；连续出错过多时订单失败
+                    errors += 1
+                    if errors > MAX_QUERY_ERRORS:
+                        raise RuntimeError(f"转录结果查询失败：{order.order_id}，{result}")
+                    await self._sleep_or_notified(order, self._next_interval(order))
+                    continue
+                errors = 0
+                status = order_info['status']
+                if status == STATUS_DONE:
+                    self._learn(order)
+                    order.future.set_result(result)
+                    return
+                if status == STATUS_FAILED:
+                    raise RuntimeError(f"转录订单失败：{order.order_id}，{order_info.get('failType')}")
+                await self._sleep_or_notified(order, self._next_interval(order))
+        except Exception as e:
+            if not order.future.done():
+                order.future.set_exception(e)
+        finally:
+            with self._lock:
+                self._orders.pop(order.order_id, None)
+
+    async def _sleep_or_notified(self, order, seconds):
+        try:
+            await asyncio.wait_for(order.event.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+        order.event.clear()
+
+    def _learn(self, order):
+        """用已完成订单的实际耗时更新处理速度估计"""
+        if order.audio_seconds > 0:
+            ratio = order.elapsed / order.audio_seconds
+            self.speed_ratio = 0.8 * self.speed_ratio + 0.2 * ratio
+
+
+_poller = None
+_poller_lock = threading.Lock()
+
+
+def get_asr_poller(result_url):
+    """获取进程内唯一的转录订单轮询器"""
+    global _poller
+    with _poller_lock:
+        if _poller is None:
+            _poller = AsrPoller(result_url, use_callback=bool(os.getenv('asr_callback_url')))
+        return _poller
+
+
+def notify_asr_order(order_id):
+    """供回调接口使用：订单状态变化时唤醒轮询器"""
+    return _poller is not None and _poller.notify(order_id)
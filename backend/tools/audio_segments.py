@@ -0,0 +1,146 @@
+import os
+import re
+import json
+import time
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from .media_info import find_source_video, probe_media, output_is_current, record_output
+from .task_context import record_metric, run_in_context
+from .retry import retry
+from .video_transformer import get_asr_audio_profile, build_audio_command
+
+SEGMENT_DIR = 'segments'
+SEGMENT_MANIFEST = 'manifest.json'
+
+_SILENCE_START = re.compile(r'silence_start:\s*(-?[\d.]+)')
+_SILENCE_END = re.compile(r'silence_end:\s*(-?[\d.]+)')
+
+
+def get_segment_seconds():
+    """分段转录的目标分段时长（秒），为 0 时不分段"""
+    return float(os.getenv('asr_segment_seconds', '0'))
+
+
+def use_segmented_asr(duration):
+    """视频时长超过两个目标分段时才值得分段并发转录"""
+    segment_seconds = get_segment_seconds()
+    return segment_seconds > 0 and duration > 2 * segment_seconds
+
+
+def detect_silences(media_path, noise_db=-35, min_silence=0.5):
+    """
+    使用 ffmpeg 的 silencedetect 滤镜查找静音区间。
+
+    返回:
+        [(开始秒, 结束秒), ...]
+    """
+    command = [
+        'ffmpeg', '-i', media_path, '-vn',
+        '-af', f'silencedetect=noise={noise_db}dB:d={min_silence}',
+        '-f', 'null', '-'
+    ]
+    output = subprocess.run(command, check=True, capture_output=True, text=True, errors='ignore').stderr
+
+    silences = []
+    start = None
+    for line in output.splitlines():
+        match = _SILENCE_START.search(line)
+        if match:
+            start = max(0.0, float(match.group(1)))
+            continue
+        match = _SILENCE_END.search(line)
+        if match and start is not None:
+            silences.append((start, float(match.group(1))))
+            start = None
+    return silences
+
+
+def plan_segments(duration, silences, target_seconds, search_window=None):
+    """
+    按目标时长规划分段：在每个理想切点附近 search_window 秒内选择最近的静音中点切分，
+    附近没有静音时在理想切点处直接切分。
+
+    返回:
+        [(开始秒, 结束秒), ...]
+    """
+    search_window = search_window if search_window is not None else target_seconds * 0.2
+    midpoints = [(start + end) / 2 for start, end in silences]
+
+    cuts = []
+    last_cut = 0.0
+    while duration - last_cut > target_seconds * 1.5:
+        ideal = last_cut + target_seconds
+        candidates = [m for m in midpoints if abs(m - ideal) <= search_window and m > last_cut]
+        cut = min(candidates, key=lambda m: abs(m - ideal)) if candidates else ideal
+        cuts.append(cut)
+        last_cut = cut
+
+    bounds = [0.0] + cuts + [duration]
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+
+
+def _encode_segment(video_path, segment, profile):
+    command = build_audio_command(video_path, segment['path'], profile,
+                                  start=segment['start'], duration=segment['end'] - segment['start'])
+    subprocess.run(command, check=True)
+    return segment
+
+
+@retry()
+def generate_audio_segments(path, target_seconds=None, max_workers=None):
+    """
+    在静音处将源视频的音轨切成若干段，并行编码后保存在任务文件夹的 segments 目录下。
+    分段清单登记在 media_info.json 中，源视频和配置不变时直接复用。
+
+    返回:
+        [{'path': 分段音频路径, 'start': 原视频中的开始秒, 'end': 结束秒}, ...]
+    """
+    video_path = find_source_video(path)
+    if video_path is None:
+        raise FileNotFoundError(f"未在 {path} 中找到视频文件")
+    media_info = probe_media(video_path)
+
+    target_seconds = target_seconds or get_segment_seconds()
+    profile = get_asr_audio_profile()
+    params = {k: profile[k] for k in ('acodec', 'ab', 'ar', 'ac') if profile.get(k)}
+    params['segment_seconds'] = target_seconds
+
+    segment_dir = os.path.join(path, SEGMENT_DIR)
+    manifest_path = os.path.join(segment_dir, SEGMENT_MANIFEST)
+    if output_is_current(path, manifest_path, 'segments', params):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            segments = json.load(f)
+        if all(os.path.isfile(s['path']) for s in segments):
+            record_metric('audio_mode', 'cached')
+            record_metric('audio_segments', len(segments))
+            return segments
+
+    os.makedirs(segment_dir, exist_ok=True)
+    start_time = time.time()
+    silences = detect_silences(video_path)
+    bounds = plan_segments(media_info['duration'], silences, target_seconds)
+    segments = [{
+        'path': os.path.join(segment_dir, f"seg_{i:03d}.{profile['ext']}"),
+        'start': round(start, 3),
+        'end': round(end, 3)
+    } for i, (start, end) in enumerate(bounds)]
+    record_metric('silence_detect_seconds', round(time.time() - start_time, 3))
+
+    # 每个分段由独立的 ffmpeg 进程编码，按 CPU 核数并行
+    max_workers = max_workers or os.cpu_count() or 1
+    start_time = time.time()
+    worker = run_in_context(lambda segment: _encode_segment(video_path, segment, profile))
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(segments))) as executor:
+        list(executor.map(worker, segments))
+    encode_seconds = time.time() - start_time
+
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(segments, f, ensure_ascii=False, indent=2)
+    record_output(path, manifest_path, 'segments', params, encode_seconds=round(encode_seconds, 3))
+
+    record_metric('audio_mode', 'segmented')
+    record_metric('audio_segments', len(segments))
+    record_metric('encode_seconds', round(encode_seconds, 3))
+    record_metric('audio_bytes', sum(os.path.getsize(s['path']) for s in segments))
+    print(f"分段转换完成：共 {len(segments)} 段")
+    return segments
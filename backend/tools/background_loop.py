@@ -0,0 +1,41 @@
+import asyncio
+import threading
+
+# 进程内共用的后台事件循环，供转录轮询、模拟延迟等异步任务使用
+_loop = None
+_lock = threading.Lock()
+
+
+def get_background_loop():
+    """获取（必要时启动）后台事件循环，循环运行在一个守护线程中"""
+    global _loop
+    with _lock:
+        if _loop is None:
+            ready = threading.Event()
+            loop = asyncio.new_event_loop()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                ready.set()
+                loop.run_forever()
+
+            threading.Thread(target=run, name='background-loop', daemon=True).start()
+            ready.wait()
+            _loop = loop
+        return _loop
+
+
+def run_coroutine(coro):
+    """在后台事件循环中执行协程，返回 concurrent.futures.Future"""
+    return asyncio.run_coroutine_threadsafe(coro, get_background_loop())
+
+
+def call_soon(callback, *args):
+    """在后台事件循环线程中调用回调（线程安全）"""
+    get_background_loop().call_soon_threadsafe(callback, *args)
+
+
+def call_later(delay, callback, *args):
+    """在后台事件循环中 delay 秒后调用回调（线程安全），等待期间不占用任何线程"""
+    loop = get_background_loop()
+    loop.call_soon_threadsafe(lambda: loop.call_later(delay, callback, *args))
@@ -4,18 +4,9 @@ from docx import Document
 from pptx import Presentation
 from lxml import etree
 import fitz
-from openai import OpenAI
 from .util import *
-
-## 设置API
-
-api_key =  os.environ["OPENAI_API_KEY"]
-base_url = "https://dashscope.aliyuncs.com/compatible-mode/v1"
-
-client = OpenAI(
-  api_key= api_key,
-  base_url= base_url
-)
+from .retry import retry
+from .json_repair import compile_schema
 
 def extract_text_docx(file_path):
     doc = Document(file_path)
@@ -118,8 +109,30 @@ def read_text_file(file_path):
     with open(file_path, 'r', encoding='utf-8') as f:
         return f.read()
 
+# 树状图谱的节点结构，child 递归引用根结构
+DOC_TREE_SCHEMA = compile_schema({
+    "type": "object",
+    "required": ["id", "name", "content", "child"],
+    "properties": {
+        "id": {"type": ["string", "integer"]},
+        "name": {"type": "string"},
+        "content": {"type": "string"},
+        "child": {"type": "array", "items": {"$ref": "#"}},
+    },
+})
+
+# 网状图谱：节点列表和关系列表
+DOC_GRAPH_SCHEMA = compile_schema({
+    "type": "object",
+    "required": ["nodes", "edges"],
+    "properties": {
+        "nodes": {"type": "array", "items": {"type": "object", "required": ["id", "name"]}},
+        "edges": {"type": "array", "items": {"type": "object", "required": ["source", "relation", "target"]}},
+    },
+})
+
 # 使用 OpenAI 模型提取知识点和关联关系
-def extract_knowledge(path, text, style="tree"):
+def extract_knowledge(text, style="tree"):
     """
     将文本传递给大语言模型，提取知识点和关联关系，要求返回格式如下：
     {
@@ -181,31 +194,36 @@ def extract_knowledge(path, text, style="tree"):
 
                         请根据下面的文本内容生成知识图谱：{text}""")
     
-    response = client.chat.completions.create(
-        model="qwen-max",  # 或其他你有权限使用的模型
-        messages=[
+    return chat_json(
+        [
             {"role": "system", "content": "你是一个知识图谱构建专家。"},
             {"role": "user", "content": prompt}
         ],
+        DOC_TREE_SCHEMA if style == "tree" else DOC_GRAPH_SCHEMA,
         temperature=0.2,
-        #max_tokens=1024
+        route='doc_tree',  # 默认使用 qwen-max，可通过配置 llm_routes 调整
     )
-    #print(response)
-    result = response.choices[0].message.content.strip()
-    with open(os.path.join(path, 'tree1.json'), 'w', encoding = "utf-8") as f:
-        json.dump(result, f, ensure_ascii=False, indent=4)
 
-@retry_on_failure(max_retries=2)
+@retry(default=None)
 def generate_document_tree(path):
+    """
+    path: 教案文件路径（上传的教案保存在任务文件夹中），也可以是包含教案文件的文件夹；
+    提取的文本保存为同一文件夹下的 output.txt，返回教案图谱
+    """
     if path == None:
         return {}
     # 打开文件并按行读取内容
     supported_ext = ('.docx', '.pptx', '.pdf')
     all_text = []
+    if os.path.isdir(path):
+        folder, filenames = path, sorted(os.listdir(path))
+    else:
+        folder, filename = os.path.split(path)
+        filenames = [filename]
     
-    for filename in os.listdir(path):
+    for filename in filenames:
         if filename.lower().endswith(supported_ext):
-            file_path = os.path.join(path, filename)
+            file_path = os.path.join(folder, filename)
             try:
                 text = extract_text_from_file(file_path)
                 all_text.append(f"=== 文件: {filename} ===\n{text}\n\n")
@@ -214,16 +232,15 @@ def generate_document_tree(path):
     
     output_file = "output.txt"
     if all_text:
-        with open(os.path.join(path, output_file), 'w', encoding='utf-8') as f:
-            f.write("\n".join(all_text))
+        text = "\n".join(all_text)
+        with open(os.path.join(folder, output_file), 'w', encoding='utf-8') as f:
+            f.write(text)
         print(f"所有文本已提取并保存到 {output_file}")
     else:
         print("未找到支持的文档文件")
-        with open(os.path.join(path, 'tree2.json'), 'w', encoding = "utf-8") as f:
+        with open(os.path.join(folder, 'tree2.json'), 'w', encoding = "utf-8") as f:
             json.dump({}, f, ensure_ascii=False, indent=4)
             return {}
-    file_path = os.path.join(path, 'outline.txt')
-    text = read_text_file(file_path)
 
-    response = extract_knowledge(text,"tree")
+    response = extract_knowledge(text, "tree")
     return response
\ No newline at end of file
@@ -1,5 +1,11 @@
 from .util import *
-from openai import OpenAI
+from .retry import retry
+from .json_repair import compile_schema
+from .prompt_layout import context_messages, TREE_HEADER
+from .llm_batch import DeferredBatch
+from .transcript import transcript_for_prompt, estimate_tokens
+from .topic_segmentation import topic_digest
+from .task_context import add_metric, current_context
 import os
 import json
 import re
@@ -7,7 +13,7 @@ import numpy as np
 from typing import Union, Dict
 
 prompt1 = """
-你是一名教育专家，以下是一段教学视频提取出来的字幕以及知识图谱，其中包含了教师讲述的知识点之间的从属关系、知识点的名称和具体内容、知识点的难度（level）以及知识点讲解的时间范围。
+你是一名教育专家，以上是一段教学视频提取出来的字幕以及知识图谱，其中包含了教师讲述的知识点之间的从属关系、知识点的名称和具体内容、知识点的难度（level）以及知识点讲解的时间范围。
 请根据你对该门课程的教学经验，分析知识点教学时长分布的合理性，并对每个知识点生成一段评价和建议，指标如下：
 1. 知识点的讲解时长是否与知识点的内容量以及难度相匹配？
 2. 知识点的整体难度分布是否比较合理？
@@ -46,7 +52,7 @@ prompt1 = """
 """
 
 prompt2 = """
-你是一名教育专家，以下是一段教学视频提取出来的字幕以及知识图谱，其中包含了教师讲述的知识点之间的从属关系、知识点的名称和具体内容、知识点的难度（level）以及知识点讲解的时间范围。
+你是一名教育专家，以上是一段教学视频提取出来的字幕以及知识图谱，其中包含了教师讲述的知识点之间的从属关系、知识点的名称和具体内容、知识点的难度（level）以及知识点讲解的时间范围。
 请根据你对该门课程的教学经验，分析其中知识点的逻辑关系。给出以下逻辑关系选项：
 1. 层级关系：其中一个知识点是另一个知识点的子集或扩展
 2. 序列关系：知识点按时间或逻辑顺序排列，通常表示一个过程或步骤的先后顺序
@@ -101,7 +107,7 @@ type的可选范围为(knowledge, example)，knoeledge指的是知识点，对
 """
 
 prompt3 = """
-你是一位教育专家，以下是根据一段教学视频提取的知识图谱以及知识点关系。
+你是一位教育专家，以上是根据一段教学视频提取的字幕和知识图谱，知识点关系列表附在本段说明之后。
 请根据你的教学经验，对该门课程视频的每个知识点的讲解逻辑生成一段评价和建议。评价内容可以参考以下指标指标如下：
 
 请对知识点之间的逻辑性做出评价，并整理成一段详细的评价和建议，分别列举出结构性和逻辑性较好的部分，以及逻辑性较差的部分，
@@ -171,28 +177,40 @@ prompt5 = """
     注意：该分析结果用于教师自评和改善教学效果，请使用委婉的语气，尽量避免对教师的授课内容进行直接的点评，而是生成具有普适性的建议，
     避免使用教师实际讲述的内容举例。
     """
-class model:
-    def __init__(self):
-        self.conversation_history =  [{"role": "system", "content": "你是一个教育专家"}]
-        self.prompt = "你生成的结果格式有错，请严格按照给出的示例格式生成结果。"
-        self.result = None
-
-    def chat(self, sample=None):
-        if sample == None:
-            prompt = self.prompt
-        else:
-            prompt = sample
-        self.conversation_history.append({"role": "user", "content": prompt})
-    
-        response = client.chat.completions.create(
-            messages=self.conversation_history,
-            model="qwen-plus",
-        )
-    
-        assistant_reply = response.choices[0].message.content
-        self.conversation_history.append({"role": "assistant", "content": assistant_reply})
-    
-        self.result = assistant_reply
+# 各项分析结果的结构，对应 prompt1/prompt2/prompt3/prompt5 中的示例格式
+EVALUATION_SCHEMA = compile_schema({
+    "type": "object",
+    "required": ["评价", "建议", "知识点"],
+    "properties": {
+        "知识点": {"type": "array", "items": {"type": "object", "required": ["name"]}},
+    },
+})
+
+RELATION_SCHEMA = compile_schema({
+    "type": "object",
+    "required": ["node", "edge"],
+    "properties": {
+        "node": {"type": "array", "items": {"type": "object", "required": ["id", "name"]}},
+        "example": {"type": "array", "items": {"type": "object", "required": ["id", "name"]}},
+        "edge": {"type": "array", "items": {"type": "object", "required": ["from", "to", "relation"]}},
+    },
+})
+
+LOGIC_SCHEMA = compile_schema({
+    "type": "object",
+    "required": ["评价", "建议"],
+    "properties": {"建议": {"type": ["string", "array"]}},
+})
+
+COVERAGE_ITEM = {"type": "object", "required": ["name", "覆盖情况"]}
+COVERAGE_ITEM_SCHEMA = compile_schema(COVERAGE_ITEM)
+COVERAGE_SCHEMA = compile_schema({
+    "type": "object",
+    "required": ["覆盖情况总结", "分析"],
+    "properties": {
+        "分析": {"type": "array", "items": COVERAGE_ITEM},
+    },
+})
 
 def traverse(node, num_node, indent, Beginner, Intermediate, Advanced, depth):
     # 如果有子节点，递归遍历子节点
@@ -212,72 +230,64 @@ def traverse(node, num_node, indent, Beginner, Intermediate, Advanced, depth):
     return num_node, Beginner, Intermediate, Advanced, depth
 
 # 提取视频图谱的基本信息
-@retry_on_failure(max_retries=2)
+@retry(default=None)
 def extract_baseinf(tree1):
-    total_time = tree1['time'][17:]
+    total_time = tree1['time'].split('-->')[-1].strip()
     title = tree1['name']
     num_node, Beginner, Intermediate, Advanced, depth = traverse(tree1, 0, 0, 0, 0, 0, 0)
     response0 = f"本课程主要讲解{title}，视频时长{total_time}，共包含{num_node}个知识点，其中包含初级知识点（难度在1~3之间）{Beginner}个，中级知识点（难度在4~6之间）{Intermediate}个，高级知识点（难度在7~10之间）{Advanced}个。"
     return response0
 
-@retry_on_failure(max_retries=2)
-def analysis(srt, tree1, sample):
-    # 构建prompt
-    prompt = [
-            sample,
-      "\n教学内容如下：\n",
-      str(srt),
-      "\n图谱内容如下：\n",
-      str(tree1)
-    ] 
-    prompt = "\n".join(prompt)
-    chat_model = model()
-    print("第一轮对话")
-    chat_model.chat(prompt)
-    while True:
-        try:
-            response = extract_json_from_string(chat_model.result)
-            if response:
-                return response
-            print("未找到目标格式，再次进行一轮对话")
-            chat_model.chat()
-        except:
-            print("json对象提取异常，再次进行一轮对话")
-            chat_model.chat()
-
-@retry_on_failure(max_retries=2)
+@retry(default=None)
+def analysis(srt, tree1, sample, schema=None):
+    # 字幕和图谱在前、任务说明在后，各项分析的请求开头相同，可以复用模型服务的前缀缓存
+    messages = context_messages(srt, [(TREE_HEADER, str(tree1))], sample)
+    return chat_json(messages, schema, route='report')
+
+@retry(default=None)
 def comparison_for_graph(srt, tree2, sample):
-    # 构建prompt
-    prompt = [
-            sample,
-      "\n结构化知识信息如下：\n",
-      str(tree2),
-      "\n视频转录文字内容如下：\n",
-      str(srt)
-    ]
-    prompt = "\n".join(prompt)
-    chat_model = model()
-    chat_model.chat(prompt)
-    while True:
-        try:
-            response = extract_json_from_string(chat_model.result)
-            if response:
-                return response
-            print("未找到目标格式，再次进行一轮对话")
-            chat_model.chat()
-        except:
-            print("json对象提取异常，再次进行一轮对话")
-            chat_model.chat()
+    # 与各项分析共用字幕前缀，教案图谱放在字幕之后
+    messages = context_messages(srt, [("结构化知识信息如下：", str(tree2))], sample)
+    # 流式生成：每分析完一个知识点即发布到进度中
+    on_element = element_handler('coverage', ('分析',), COVERAGE_ITEM_SCHEMA,
+                                 summarize=lambda item: {'name': item.get('name'), '覆盖情况': item.get('覆盖情况')})
+    return chat_json(messages, COVERAGE_SCHEMA, on_element=on_element, route='report')
+
+def report_transcript(srt):
+    """
+    报告各次调用共用的字幕文本，默认为完整的编码字幕，与视频图谱、新教案的请求开头相同。
+    配置 report_digest_tokens 大于 0 且字幕编码后估计 token 数超过该值时，改为按主题段概括
+    （每段时间范围和开头文字）。概括会丢失大部分讲解内容，也不再与其他步骤共用前缀缓存，默认不开启。
+    """
+    if isinstance(srt, str):
+        return srt
+    encoded = transcript_for_prompt(srt)
+    threshold = int(os.getenv('report_digest_tokens', '0'))
+    if threshold > 0 and estimate_tokens(encoded) > threshold:
+        digest = topic_digest(srt)
+        add_metric('transcript_tokens_digest', estimate_tokens(digest))
+        return digest
+    return encoded
+
+def _publish_section(key, value):
+    """报告各部分生成后立即发布到进度中，不必等待整份报告完成"""
+    context = current_context()
+    if context is not None and value is not None:
+        context.set_partial('report', key, {key: value})
+    return value
 
 def generate_report(srt, tree1, tree2):
-    response0 = extract_baseinf(tree1)
-    response1 = analysis(srt, tree1, prompt1)
+    srt = report_transcript(srt)
+    response0 = _publish_section('response0', extract_baseinf(tree1))
+    # 批量模式下互不依赖的几项分析进入同一个批次，依赖知识点关系的逻辑分析在下一轮执行
+    with DeferredBatch() as batch:
+        response1 = _publish_section('response1', batch.run(analysis, srt, tree1, prompt1, EVALUATION_SCHEMA))
 
-    response2 = analysis(srt, tree1, prompt2)
+        response2 = _publish_section('response2', batch.run(analysis, srt, tree1, prompt2, RELATION_SCHEMA))
 
-    response3 = analysis(srt, tree1, prompt3 + "知识点关系列表如下：\n" + str(response2))
+        response5 = _publish_section('response5', batch.run(comparison_for_graph, srt, tree2, prompt5))
 
-    response5 = comparison_for_graph(srt, tree2, prompt5)
+    response3 = _publish_section('response3', analysis(srt, tree1, prompt3 + "知识点关系列表如下：\n" + str(response2), LOGIC_SCHEMA))
 
     response = {
         'response0':response0,
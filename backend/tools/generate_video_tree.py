@@ -1,18 +1,23 @@
 from .util import *
+from .retry import retry_call, RetryPolicy
+from .json_repair import compile_schema
+from .prompt_layout import context_messages
+from .subtitles import parse_srt_time
+from .transcript import transcript_for_prompt, estimate_tokens, encode_transcript, format_clock, as_track
+from .task_context import add_metric, run_in_context
+from .topic_segmentation import segment_topics, pack_segments
+from concurrent.futures import ThreadPoolExecutor
 # 生成教学视频图谱
 
-@retry_on_failure(max_retries=2)
-def video_tree(subtitles):
-    # 打开文件并按行读取内容
-    sample = """
-你是一名经验丰富的教育专家，以下是一段教学视频内音频转录得到的文字，请根据其中的教学内容提取重要概念、定义、模型、算法、例子等作为知识点，以及各个知识点讲述的时间顺序以及包含关系，归纳出一段详尽的JSON格式的四的树状知识图谱。
+VIDEO_TREE_PROMPT = """
+你是一名经验丰富的教育专家，以上是一段教学视频内音频转录得到的文字，请根据其中的教学内容提取重要概念、定义、模型、算法、例子等作为知识点，以及各个知识点讲述的时间顺序以及包含关系，归纳出一段详尽的JSON格式的四的树状知识图谱。
 要求生成的知识图谱尽可能详细，每十分钟的讲解需要生成10~15个知识节点
 对于每个节点（node），要求生成以下属性：
 id: 对每个节点生成唯一性编号。
 name: 每个知识点的具体名称。
 type: 知识点的类型，按知识概念的粒度由粗到细分为"知识模块"，"知识单元"，"知识点"，"子知识点"。
 level: 评价知识点的难度，范围为1~10。
-time: 根据字幕分析得到的知识点讲述的时间范围，如"00:03:28,170 --> 00:08:48,910"
+time: 根据字幕分析得到的知识点讲述的时间范围，如"00:03:28 --> 00:08:48"
 content: 知识点的简单概括。
 child: 节点的子节点，为一个以JSON对象为元素的列表。其中的JSON对象也应具有节点的各个属性。若该节点没有子节点，则该属性值为空列表。
 
@@ -50,39 +55,225 @@ child: 节点的子节点，为一个以JSON对象为元素的列表。其中的
 
 注意：请严格按照给出的json格式进行生成，确保每个节点都有"id","name","type","level","time","content","child"七个属性。
 """
-    # 构建prompt
-    prompt = [
-        sample,
-      "\n教学内容如下：\n",
-      str(subtitles)
-    ]
-    prompt = "".join(prompt)
-    response = get_response(prompt)
-    response = extract_json_from_string(response)
-    return response
+
+# 分块生成时附加的说明：每个时间段只生成一棵以“知识单元”为根的子树
+CHUNK_PROMPT = """
+注意：以上字幕只是整节课程中 {start} 到 {end} 的一部分（第{index}/{total}段）。请只根据这一段内容生成一棵子树，
+根节点的 type 为"知识单元"，概括这一段的主题，time 为这一段的时间范围；其子节点的 type 为"知识点"或"子知识点"。
+"""
+
+MERGE_PROMPT = """
+你是一名经验丰富的教育专家，以下是一节教学视频按时间顺序划分的各段主题及其概括。
+请根据这些内容给出整节课程的名称和一段简短的课程概括，返回如下json格式：
+```json
+{{
+    "name": "",
+    "content": ""
+}}
+```
+各段主题如下：
+{topics}
+"""
+
+# 图谱节点结构，child 递归引用根结构
+VIDEO_TREE_SCHEMA = compile_schema({
+    "type": "object",
+    "required": ["id", "name", "type", "level", "time", "content", "child"],
+    "properties": {
+        "id": {"type": ["string", "integer"]},
+        "name": {"type": "string"},
+        "level": {"type": ["string", "integer"]},
+        "time": {"type": "string"},
+        "content": {"type": "string"},
+        "child": {"type": "array", "items": {"$ref": "#"}},
+    },
+})
+
+SUMMARY_SCHEMA = compile_schema({
+    "type": "object",
+    "required": ["name"],
+    "properties": {"name": {"type": "string"}, "content": {"type": "string"}},
+})
+
+def video_tree(subtitles, instruction=None):
+    """instruction: 分块生成时附加在提示词后的说明"""
+    # 字幕在前、任务说明在后，与报告、新教案的请求共用开头，可以复用模型服务的前缀缓存
+    messages = context_messages(subtitles, instruction=VIDEO_TREE_PROMPT + (instruction or ""))
+    # 流式生成：每个子节点生成完毕即校验并发布到进度中，结构错误时提前中止
+    on_element = element_handler('video_tree', ('child',), VIDEO_TREE_SCHEMA,
+                                 summarize=lambda node: {'name': node.get('name'), 'time': node.get('time')},
+                                 key=lambda index, node: (str(node.get('time', '')), index))
+    # 后续步骤都依赖视频图谱，开启请求对冲以减少偶发的慢请求造成的等待
+    return chat_json(messages, VIDEO_TREE_SCHEMA, route='video_tree_chunk' if instruction else 'video_tree', hedge=os.getenv('video_tree_hedge', 'on') != 'off',
+                     on_element=on_element)
 
 def validate_video_tree(tree):
-    required_keys = {"id", "name", "type", "level", "time", "content", "child"}
+    """检查图谱各层节点是否都具有规定的七个属性"""
     if tree is None:
         return False
-    if set(tree.keys()) != required_keys:
-        return False
-    return True
+    return not VIDEO_TREE_SCHEMA(tree)
     
-def generate_video_tree(subtitles, max_retries=5):
-    for attempt in range(max_retries):
+def node_time_range(node):
+    """解析节点 time 字段（HH:MM:SS[,mmm] --> HH:MM:SS[,mmm]）为毫秒区间，无法解析时返回 None"""
+    try:
+        start, end = str(node.get('time', '')).split('-->')
+        return parse_srt_time(start), parse_srt_time(end)
+    except ValueError:
+        return None
+
+
+def select_subtree(tree, start_ms, end_ms):
+    """
+    只保留讲解时间与 [start_ms, end_ms] 有重叠的节点，用于分块提示词中缩小图谱。
+    无法解析时间的节点保留。
+    """
+    def keep(node):
+        time_range = node_time_range(node)
+        return time_range is None or (time_range[0] <= end_ms and time_range[1] >= start_ms)
+
+    def prune(node):
+        return dict(node, child=[prune(child) for child in node.get('child', []) if keep(child)])
+
+    return prune(tree) if tree else tree
+
+
+def _generate_valid_tree(subtitles, max_retries=None, instruction=None):
+    """
+    生成结构正确的图谱，失败时返回 None。
+    格式问题由 chat_json 在本地修复或有限次重新生成，这里只重试网络、限流等可恢复的错误。
+    """
+    try:
+        return retry_call(video_tree, subtitles, instruction, policy=RetryPolicy(max_attempts=max_retries))
+    except Exception as e:
+        if getattr(e, 'requeue_stage', False):
+            raise
+        print(f"视频图谱生成失败: {e}")
+        return None
+
+
+def split_time_windows(subtitles, window_seconds):
+    """按时间窗口切分字幕，切分点落在字幕之间，返回若干 SubtitleTrack"""
+    track = as_track(subtitles)
+    chunks = []
+    chunk_start = 0
+    for i in range(1, len(track)):
+        if track.starts[i] - track.starts[chunk_start] >= window_seconds * 1000:
+            chunks.append(track[chunk_start:i])
+            chunk_start = i
+    if len(track):
+        chunks.append(track[chunk_start:])
+    return chunks
+
+
+def _renumber(node, counter):
+    """深度优先重新编号，保证合并后各节点 id 唯一"""
+    counter[0] += 1
+    node['id'] = str(counter[0])
+    for child in node.get('child', []):
+        _renumber(child, counter)
+    return node
+
+
+def _merge_summary(subtrees):
+    """用一次小的模型调用生成整节课程的名称和概括，只发送各子树根节点"""
+    topics = "\n".join(f"- [{tree['time']}] {tree['name']}：{tree['content']}" for tree in subtrees)
+    return chat_json(MERGE_PROMPT.format(topics=topics), SUMMARY_SCHEMA, max_reprompts=0, route='video_tree_merge')
+
+
+def merge_subtrees(subtrees, chunks, use_llm=True):
+    """
+    将各时间段的子树合并为一棵以“知识模块”为根的完整图谱。
+    根节点名称和概括优先由一次小的模型调用生成，失败时在本地由子树拼接。
+    """
+    summary = None
+    if use_llm:
         try:
-            result = video_tree(subtitles)
-            if result is None:
-                print(f"Attempt {attempt + 1} failed. Result is None. Retrying...")
-                continue
-            if validate_video_tree(result):
-                return result
-            else:
-                print(f"Attempt {attempt + 1} failed. Result does not meet the requirements. Retrying...")
+            summary = _merge_summary(subtrees)
         except Exception as e:
-            print(f"Attempt {attempt + 1} failed with an error: {e}. Retrying...")
-    print(f"Failed to generate a valid video tree after {max_retries} retries.")
+            if getattr(e, 'requeue_stage', False):
+                raise
+            print(f"课程概括生成失败，使用本地合并: {e}")
+    if summary is None:
+        summary = {
+            'name': subtrees[0]['name'] if len(subtrees) == 1 else "、".join(tree['name'] for tree in subtrees[:3]),
+            'content': "；".join(tree['content'] for tree in subtrees if tree.get('content')),
+        }
+
+    levels = [int(tree['level']) for tree in subtrees if str(tree.get('level', '')).isdigit()]
+    for tree in subtrees:
+        tree['type'] = "知识单元"
+    root = {
+        'id': "",
+        'name': summary['name'],
+        'type': "知识模块",
+        'level': str(round(sum(levels) / len(levels))) if levels else "",
+        'time': f"{format_clock(chunks[0].starts[0])} --> {format_clock(chunks[-1].ends[-1])}",
+        'content': summary.get('content', ""),
+        'child': subtrees,
+    }
+    return _renumber(root, [0])
+
+
+def split_video_tree_chunks(subtitles):
+    """
+    按配置 video_tree_chunk_mode 切分字幕：topic（默认）在主题边界处切分并合并为不超过
+    video_tree_chunk_tokens 一半的块，避免把一个知识点切成两半；time 按固定时间窗口切分。
+    """
+    if os.getenv('video_tree_chunk_mode', 'topic') == 'time':
+        return split_time_windows(subtitles, float(os.getenv('video_tree_chunk_seconds', '900')))
+    max_tokens = int(os.getenv('video_tree_chunk_tokens', '12000')) // 2
+    return pack_segments(subtitles, segment_topics(subtitles), max_tokens)
+
+
+def generate_video_tree_chunked(subtitles, max_retries=None, max_workers=None):
+    """
+    分块生成视频图谱：在主题边界（或时间窗口）处切分字幕，各块并发生成子树后合并。
+    单个块生成失败只重试该块，总耗时取决于最慢的块而不是课程总长度；
+    重试后仍有块失败时整个步骤失败，不生成缺少部分时间段的图谱。
+    """
+    max_workers = max_workers or int(os.getenv('llm_max_concurrency', '4'))
+    chunks = split_video_tree_chunks(subtitles)
+
+    def build(indexed_chunk):
+        index, chunk = indexed_chunk
+        instruction = CHUNK_PROMPT.format(start=format_clock(chunk.starts[0]), end=format_clock(chunk.ends[-1]),
+                                          index=index + 1, total=len(chunks))
+        return _generate_valid_tree(chunk, max_retries, instruction)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as executor:
+        subtrees = list(executor.map(run_in_context(build), enumerate(chunks)))
+
+    add_metric('video_tree_chunks', len(chunks))
+    failed = [i + 1 for i, tree in enumerate(subtrees) if tree is None]
+    if failed:
+        add_metric('video_tree_chunks_failed', len(failed))
+        raise RuntimeError(f"视频图谱第 {failed} 段（共 {len(chunks)} 段）子树生成失败")
+    use_llm = os.getenv('video_tree_merge', 'llm') == 'llm'
+    return merge_subtrees(subtrees, chunks, use_llm)
+
+
+def use_chunked_video_tree(subtitles):
+    """字幕编码后估计的 token 数超过 video_tree_chunk_tokens 时分块生成"""
+    if isinstance(subtitles, str) or not len(subtitles):
+        return False
+    threshold = int(os.getenv('video_tree_chunk_tokens', '12000'))
+    return threshold > 0 and estimate_tokens(encode_transcript(subtitles)) > threshold
+
+
+def generate_video_tree(subtitles, max_retries=None, chunked=None):
+    """
+    chunked: 是否分块生成，默认按字幕长度自动选择
+    max_retries: 最多调用次数，默认读取配置 retry_max_attempts
+    """
+    if chunked is None:
+        chunked = use_chunked_video_tree(subtitles)
+    if chunked:
+        return generate_video_tree_chunked(subtitles, max_retries)
+
+    result = _generate_valid_tree(subtitles, max_retries)
+    if result is not None:
+        return result
+    print("Failed to generate a valid video tree.")
     return {}
 
 # 测试用
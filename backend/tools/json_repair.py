@@ -0,0 +1,299 @@
+import re
+import json
+
+# 代码块中的 json（语言标记可省略）
+_FENCE = re.compile(r"```(?:json|JSON)?[ \t]*\n?(.*?)(?:```|$)", re.DOTALL)
+_NUMBER = re.compile(r"-?\d+(\.\d+)?([eE][+-]?\d+)?$")
+# 模型常用的 Python 写法 -> JSON 字面量
+_LITERALS = {'true': 'true', 'false': 'false', 'null': 'null',
+             'True': 'true', 'False': 'false', 'None': 'null'}
+_STRUCTURAL = set('{}[],:"\'')
+# 字符串中合法的转义字符（\u 还需跟 4 位十六进制数）
+_ESCAPES = set('"\\/bfnrt')
+_HEX4 = re.compile(r'[0-9a-fA-F]{4}')
+
+
+class JsonFormatError(ValueError):
+    """模型输出无法解析或不符合预期结构"""
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+def _candidates(text):
+    """按可能性依次给出待解析的片段：代码块内容，其次是从第一个 { 或 [ 开始的正文"""
+    for match in _FENCE.finditer(text):
+        body = match.group(1).strip()
+        if body:
+            yield body
+    starts = [i for i in (text.find('{'), text.find('[')) if i >= 0]
+    if starts:
+        yield text[min(starts):].strip()
+
+
+def _last_significant(out):
+    for piece in reversed(out):
+        stripped = piece.strip()
+        if stripped:
+            return stripped[-1]
+    return ''
+
+
+def _drop_trailing_comma(out):
+    while out and not out[-1].strip():
+        out.pop()
+    if out and out[-1] == ',':
+        out.pop()
+
+
+def _escape(text, i):
+    """
+    处理字符串中反斜杠后的字符 text[i]：合法的 JSON 转义原样保留，
+    \\' 还原为单引号，其余（如 LaTeX 的 \\alpha、Windows 路径 C:\\data）把反斜杠转义为字面量
+    """
+    ch = text[i]
+    if ch == "'":
+        return "'"
+    if ch == 'u':
+        return '\\u' if _HEX4.match(text, i + 1) else '\\\\u'
+    if ch in _ESCAPES:
+        return '\\' + ch
+    return '\\\\' + ch
+
+
+def repair_json(text):
+    """
+    逐字符修复常见的格式问题，返回修复后的 JSON 文本：
+    单引号字符串、字符串中的未转义换行、尾随逗号、对象/数组元素之间缺少的逗号、
+    未加引号的键或值、True/False/None、// 注释，以及输出被截断时未闭合的字符串和括号。
+    遇到最外层结构闭合后即停止，忽略其后的说明文字。
+    """
+    out = []
+    stack = []
+    i, n = 0, len(text)
+    quote = None  # 当前字符串的引号，None 表示不在字符串内
+
+    def begin_value():
+        # 新的值紧跟在上一个值之后时补上逗号
+        if stack and _last_significant(out) in '"}]' + 'el0123456789':
+            out.append(',')
+
+    while i < n:
+        ch = text[i]
+        if quote:
+            if ch == '\\' and i + 1 < n:
+                out.append(_escape(text, i + 1))
+                i += 2
+                continue
+            if ch == quote:
+                out.append('"')
+                quote = None
+            elif ch == '"':
+                out.append('\\"')
+            elif ch == '\n':
+                out.append('\\n')
+            elif ch == '\r':
+                pass
+            elif ch == '\t':
+                out.append('\\t')
+            else:
+                out.append(ch)
+            i += 1
+            continue
+
+        if ch in '"\'':
+            begin_value()
+            quote = ch
+            out.append('"')
+        elif ch in '{[':
+            begin_value()
+            stack.append('}' if ch == '{' else ']')
+            out.append(ch)
+        elif ch in '}]':
+            _drop_trailing_comma(out)
+            if stack:
+                if _last_significant(out) == ':':
+                    out.append('null')
+                out.append(stack.pop())
+            if not stack:
+                break
+        elif ch == ',':
+            if _last_significant(out) not in ',{[':
+                out.append(',')
+        elif ch == ':':
+            out.append(':')
+        elif ch == '/' and text.startswith('//', i):
+            end = text.find('\n', i)
+            i = n if end < 0 else end
+            continue
+        elif ch.isspace():
+            out.append(ch)
+        else:
+            # 数字、字面量或未加引号的文本，读到下一个结构字符为止
+            j = i
+            while j < n and text[j] not in _STRUCTURAL and text[j] != '\n':
+                j += 1
+            token = text[i:j].strip()
+            begin_value()
+            if token in _LITERALS:
+                out.append(_LITERALS[token])
+            elif _NUMBER.match(token):
+                out.append(token)
+            else:
+                out.append(json.dumps(token, ensure_ascii=False))
+            i = j
+            continue
+        i += 1
+
+    # 输出被截断：闭合字符串，去掉悬空的逗号或键，再补齐括号
+    if quote:
+        out.append('"')
+    _drop_trailing_comma(out)
+    if _last_significant(out) == ':':
+        out.append('null')
+    while stack:
+        _drop_trailing_comma(out)
+        out.append(stack.pop())
+    return ''.join(out)
+
+
+def extract_json(text):
+    """
+    从模型输出中提取 JSON：优先直接解析，失败时在本地修复后再解析。
+
+    返回:
+        (数据, 是否经过修复)；找不到 JSON 时抛出 JsonFormatError
+    """
+    if not isinstance(text, str):
+        raise JsonFormatError("模型输出为空")
+    last_error = None
+    for candidate in _candidates(text):
+        try:
+            return json.loads(candidate), False
+        except json.JSONDecodeError:
+            pass
+        try:
+            return json.loads(repair_json(candidate)), True
+        except json.JSONDecodeError as e:
+            last_error = e
+    raise JsonFormatError(f"未找到可解析的 json：{last_error or '输出中没有 json 对象'}")
+
+
+_TYPES = {
+    'object': dict,
+    'array': list,
+    'string': str,
+    'number': (int, float),
+    'integer': int,
+    'boolean': bool,
+    'null': type(None),
+}
+
+
+def compile_schema(schema):
+    """
+    将 JSON Schema 的一个子集（type、required、properties、items、enum、minItems，
+    以及指向根的 "$ref": "#" 用于树状结构）预先编译为校验函数。
+
+    返回:
+        validate(data) -> 错误列表，每项为 "路径: 说明"，为空表示通过
+    """
+    root = []
+
+    def build(node):
+        if node.get('$ref') == '#':
+            return lambda value, path, errors: root[0](value, path, errors)
+
+        checks = []
+        types = node.get('type')
+        if types:
+            names = [types] if isinstance(types, str) else list(types)
+            expected = tuple(t for name in names for t in
+                             (_TYPES[name] if isinstance(_TYPES[name], tuple) else (_TYPES[name],)))
+            exclude_bool = 'boolean' not in names
+            label = '/'.join(names)
+
+            def check_type(value, path, errors):
+                if not isinstance(value, expected) or (exclude_bool and isinstance(value, bool)):
+                    errors.append(f"{path}: 应为 {label}")
+                    return False
+                return True
+            checks.append(check_type)
+
+        if 'enum' in node:
+            allowed = node['enum']
+
+            def check_enum(value, path, errors):
+                if value not in allowed:
+                    errors.append(f"{path}: 取值应为 {allowed} 之一")
+                    return False
+                return True
+            checks.append(check_enum)
+
+        required = node.get('required', [])
+        properties = {key: build(sub) for key, sub in node.get('properties', {}).items()}
+        if required or properties:
+            def check_object(value, path, errors):
+                if not isinstance(value, dict):
+                    return True
+                for key in required:
+                    if key not in value:
+                        errors.append(f"{path}: 缺少属性 {key}")
+                for key, validate in properties.items():
+                    if key in value:
+                        validate(value[key], f"{path}.{key}", errors)
+                return True
+            checks.append(check_object)
+
+        items = build(node['items']) if 'items' in node else None
+        min_items = node.get('minItems')
+        if items is not None or min_items is not None:
+            def check_array(value, path, errors):
+                if not isinstance(value, list):
+                    return True
+                if min_items is not None and len(value) < min_items:
+                    errors.append(f"{path}: 至少应有 {min_items} 项")
+                if items is not None:
+                    for index, item in enumerate(value):
+                        items(item, f"{path}[{index}]", errors)
+                return True
+            checks.append(check_array)
+
+        def validate(value, path, errors):
+            for check in checks:
+                if not check(value, path, errors):
+                    break
+        return validate
+
+    root.append(build(schema))
+
+    def validator(data):
+        errors = []
+        root[0](data, '$', errors)
+        return errors
+    return validator
+
+
+def parse_json_output(text, validator=None):
+    """
+    解析并校验模型输出。
+
+    返回:
+        (数据, 是否经过修复)；无法解析或校验不通过时抛出 JsonFormatError（errors 为校验错误）
+    """
+    data, repaired = extract_json(text)
+    if validator is not None:
+        errors = validator(data)
+        if errors:
+            raise JsonFormatError(f"json 结构不符合要求：{'；'.join(errors[:5])}", errors)
+    return data, repaired
+
+
+def is_valid_json_output(text, validator=None):
+    """模型输出能否解析（必要时修复）并通过校验"""
+    try:
+        parse_json_output(text, validator)
+        return True
+    except JsonFormatError:
+        return False
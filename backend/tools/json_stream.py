@@ -0,0 +1,119 @@
+import json
+from .json_repair import JsonFormatError, repair_json
+
+
+class _Container:
+    __slots__ = ('closer', 'start', 'key', 'index', 'expecting_key', 'last_key')
+
+    def __init__(self, closer, start, key):
+        self.closer = closer
+        self.start = start
+        self.key = key  # 在父容器中的键或下标
+        self.index = 0
+        self.expecting_key = closer == '}'
+        self.last_key = None
+
+
+class JsonStreamParser:
+    """
+    流式输出的增量 JSON 解析器：逐块 feed 模型输出，跟踪括号和字符串状态，
+    每当深度不超过 max_depth 的对象或数组闭合时，解析该片段并调用 on_element(路径, 值)。
+    路径为从根开始的键和下标组成的元组，根为 ()。
+
+    以下情况立即抛出 JsonFormatError，调用方可以中止生成，而不必等到整段输出结束：
+    输出开头 prefix_limit 个字符内没有出现 { 或 [、括号不匹配、on_element 判定片段不合格。
+    异常的 partial 属性为已收到的文本。
+    """
+
+    def __init__(self, on_element=None, max_depth=2, prefix_limit=2000):
+        self.on_element = on_element
+        self.max_depth = max_depth
+        self.prefix_limit = prefix_limit
+        self.text = ''
+        self.pos = 0
+        self.stack = []
+        self.quote = None
+        self.escape = False
+        self.key_chars = None  # 正在读取的键
+        self.started = False
+        self.done = False
+
+    def _fail(self, message):
+        error = JsonFormatError(message)
+        error.partial = self.text
+        raise error
+
+    def feed(self, chunk):
+        if not chunk or self.done:
+            self.text += chunk or ''
+            return
+        self.text += chunk
+        text = self.text
+        while self.pos < len(text) and not self.done:
+            ch = text[self.pos]
+            if not self.started:
+                if ch in '{[':
+                    self.started = True
+                    self.stack.append(_Container('}' if ch == '{' else ']', self.pos, None))
+                elif self.pos >= self.prefix_limit:
+                    self._fail("输出开头没有 json 内容")
+            elif self.quote:
+                self._string_char(ch)
+            else:
+                self._structural_char(ch)
+            self.pos += 1
+
+    def _string_char(self, ch):
+        if self.escape:
+            self.escape = False
+        elif ch == '\\':
+            self.escape = True
+            return
+        elif ch == self.quote:
+            self.quote = None
+            if self.key_chars is not None:
+                self.stack[-1].last_key = ''.join(self.key_chars)
+                self.key_chars = None
+            return
+        if self.key_chars is not None:
+            self.key_chars.append(ch)
+
+    def _structural_char(self, ch):
+        top = self.stack[-1]
+        if ch in '"\'':
+            self.quote = ch
+            if top.expecting_key:
+                self.key_chars = []
+        elif ch in '{[':
+            key = top.last_key if top.closer == '}' else top.index
+            self.stack.append(_Container('}' if ch == '{' else ']', self.pos, key))
+        elif ch == ':':
+            top.expecting_key = False
+        elif ch == ',':
+            if top.closer == '}':
+                top.expecting_key = True
+            else:
+                top.index += 1
+        elif ch in '}]':
+            if ch != top.closer:
+                self._fail(f"括号不匹配：第 {self.pos} 个字符处应为 {top.closer}")
+            path = tuple(container.key for container in self.stack[1:])
+            self.stack.pop()
+            if self.on_element is not None and len(path) <= self.max_depth:
+                self._emit(path, self.text[top.start:self.pos + 1])
+            if not self.stack:
+                self.done = True
+
+    def _emit(self, path, fragment):
+        try:
+            value = json.loads(fragment)
+        except json.JSONDecodeError:
+            try:
+                value = json.loads(repair_json(fragment))
+            except json.JSONDecodeError:
+                return  # 留给整体解析时再修复
+        try:
+            self.on_element(path, value)
+        except JsonFormatError as e:
+            e.partial = self.text
+            raise
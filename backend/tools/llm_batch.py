@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import threading
+from .llm_cache import cache_key, get_llm_cache, DEFAULT_CACHE_PATH
+from .llm_endpoints import load_endpoint_configs, DEFAULT_BASE_URL
+from .task_context import add_metric
+
+# 批次文件和批次状态保存在缓存目录下
+DEFAULT_BATCH_DIR = os.path.join(os.path.dirname(DEFAULT_CACHE_PATH), 'batches')
+BATCH_ENDPOINT = '/v1/chat/completions'
+# 批次的终止状态
+FINISHED = ('completed', 'failed', 'expired', 'cancelled')
+
+
+class BatchPendingError(RuntimeError):
+    """
+    批量模式下缓存中还没有这次调用的结果，请求已加入待提交的批次。
+    与服务不可用时一样整个步骤重新执行（requeue_stage，各层都不在调用处重试），
+    但 run_requeueable 不会原地等待，而是结束本次运行，由批量补跑在批次结果导入缓存后重新运行任务。
+    """
+    requeue_stage = True
+    batch_pending = True
+
+
+class BatchCollector:
+    """收集批量模式任务中未命中缓存的请求，按模型写成 OpenAI 批量接口格式的 jsonl 文件"""
+
+    def __init__(self, batch_dir=None):
+        self.batch_dir = batch_dir or os.getenv('llm_batch_dir') or DEFAULT_BATCH_DIR
+        self.pending = {}  # {缓存键: 请求行}
+        self._lock = threading.Lock()
+
+    def defer(self, model, messages, temperature=None):
+        """登记一个请求（相同请求只登记一次），返回应抛出的 BatchPendingError"""
+        if get_llm_cache() is None:
+            raise RuntimeError("批量模式需要开启模型响应缓存（llm_cache）")
+        body = {"model": model, "messages": messages}
+        if temperature is not None:
+            body["temperature"] = temperature
+        key = cache_key(model, messages, temperature)
+        with self._lock:
+            self.pending.setdefault(key, {"custom_id": key, "method": "POST", "url": BATCH_ENDPOINT, "body": body})
+        add_metric('llm_batch_deferred')
+        return BatchPendingError(f"请求已加入批量任务，等待批次结果（{model}）")
+
+    def flush(self, max_requests=None):
+        """
+        将已登记的请求写入批次文件并清空，每个文件只包含一个模型的请求，
+        最多 max_requests 行（llm_batch_max_requests，默认 50000）。返回 [(文件路径, 模型, 请求数)]
+        """
+        max_requests = max_requests or int(os.getenv('llm_batch_max_requests', '50000'))
+        with self._lock:
+            pending, self.pending = self.pending, {}
+        by_model = {}
+        for line in pending.values():
+            by_model.setdefault(line['body']['model'], []).append(line)
+
+        os.makedirs(self.batch_dir, exist_ok=True)
+        files = []
+        stamp = time.strftime('%Y%m%d%H%M%S')
+        for model, lines in by_model.items():
+            for part, start in enumerate(range(0, len(lines), max_requests)):
+                path = os.path.join(self.batch_dir, f"{stamp}_{model}_{part + 1}.jsonl")
+                with open(path, 'w', encoding='utf-8') as f:
+                    for line in lines[start:start + max_requests]:
+                        f.write(json.dumps(line, ensure_ascii=False) + "\n")
+                files.append((path, model, len(lines[start:start + max_requests])))
+        return files
+
+
+class BatchRunner:
+    """
+    通过 OpenAI 兼容的批量接口（/files、/batches）提交批次文件、查询状态，
+    并把完成的结果按 custom_id（即缓存键）写入模型响应缓存。
+    已提交批次的状态保存在 batches.json 中，补跑中断后可以继续等待。
+    服务地址默认为 llm_batch_base_url，未配置时使用第一个模型服务地址。
+    """
+
+    def __init__(self, batch_dir=None, base_url=None, api_key=None, client=None):
+        """client: 已创建的 OpenAI 兼容客户端，默认按 base_url、api_key 创建"""
+        self.batch_dir = batch_dir or os.getenv('llm_batch_dir') or DEFAULT_BATCH_DIR
+        if client is None:
+            from openai import OpenAI
+            endpoint = load_endpoint_configs()[0]
+            client = OpenAI(
+                api_key=api_key or os.getenv('llm_batch_api_key') or endpoint.get('api_key'),
+                base_url=base_url or os.getenv('llm_batch_base_url') or endpoint.get('base_url') or DEFAULT_BASE_URL,
+            )
+        self.client = client
+        self.state_path = os.path.join(self.batch_dir, 'batches.json')
+        self.batches = self._load_state()
+
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {}
+
+    def _save_state(self):
+        os.makedirs(self.batch_dir, exist_ok=True)
+        with open(self.state_path, 'w', encoding='utf-8') as f:
+            json.dump(self.batches, f, ensure_ascii=False, indent=2)
+
+    def submit(self, path, model, requests):
+        """上传批次文件并创建批次，返回批次 id"""
+        with open(path, 'rb') as f:
+            uploaded = self.client.files.create(file=f, purpose='batch')
+        batch = self.client.batches.create(input_file_id=uploaded.id, endpoint=BATCH_ENDPOINT,
+                                           completion_window=os.getenv('llm_batch_window', '24h'))
+        self.batches[batch.id] = {'file': os.path.basename(path), 'model': model, 'requests': requests,
+                                  'status': batch.status, 'submitted': time.time()}
+        self._save_state()
+        print(f"已提交批次 {batch.id}：{model}，{requests} 个请求")
+        return batch.id
+
+    def unfinished(self):
+        return [batch_id for batch_id, info in self.batches.items() if info['status'] not in FINISHED]
+
+    def poll(self):
+        """
+        查询未完成的批次，将新完成批次的结果导入缓存。
+        返回仍未完成的批次数。
+        """
+        for batch_id in self.unfinished():
+            batch = self.client.batches.retrieve(batch_id)
+            info = self.batches[batch_id]
+            info['status'] = batch.status
+            if batch.status in FINISHED:
+                imported, failed = self._import(batch, info['model'])
+                info.update({'imported': imported, 'failed': failed, 'finished': time.time()})
+                print(f"批次 {batch_id} {batch.status}：导入 {imported} 个结果，失败 {failed} 个")
+        self._save_state()
+        return len(self.unfinished())
+
+    def wait(self, interval=None):
+        """等待所有已提交的批次结束"""
+        interval = interval if interval is not None else float(os.getenv('llm_batch_poll_interval', '60'))
+        while self.poll():
+            time.sleep(interval)
+
+    def _import(self, batch, model):
+        """结果连同用量写入缓存；失败的请求不写入缓存，任务重新运行时会再次进入下一个批次"""
+        store = get_llm_cache()
+        imported = 0
+        failed = 0
+        if getattr(batch, 'output_file_id', None):
+            content = self.client.files.content(batch.output_file_id).text
+            for line in content.splitlines():
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                response = result.get('response') or {}
+                try:
+                    text = response['body']['choices'][0]['message']['content']
+                except (KeyError, IndexError, TypeError):
+                    text = None
+                if response.get('status_code') == 200 and text:
+                    store.put(result['custom_id'], model, text, usage=batch_usage(response['body'].get('usage')))
+                    imported += 1
+                else:
+                    failed += 1
+        if getattr(batch, 'error_file_id', None):
+            failed += len([line for line in self.client.files.content(batch.error_file_id).text.splitlines()
+                           if line.strip()])
+        return imported, failed
+
+
+def batch_usage(usage):
+    """批次结果中一个请求的用量，保存在缓存中，任务取用结果时计入任务的用量"""
+    if not usage:
+        return None
+    return {
+        'prompt_tokens': usage.get('prompt_tokens') or 0,
+        'completion_tokens': usage.get('completion_tokens') or 0,
+        'cached_tokens': (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0,
+    }
+
+
+_collector = None
+_collector_lock = threading.Lock()
+
+
+def get_batch_collector():
+    global _collector
+    with _collector_lock:
+        if _collector is None:
+            _collector = BatchCollector()
+        return _collector
+
+
+class DeferredBatch:
+    """
+    依次执行一个步骤中互不依赖的调用：某个调用进入批次时继续执行其余调用，
+    使它们进入同一个批次，退出 with 块时再抛出 BatchPendingError。非批量模式下没有影响。
+    """
+
+    def __init__(self):
+        self.pending = None
+
+    def run(self, func, *args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except BatchPendingError as e:
+            self.pending = self.pending or e
+            return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None and self.pending is not None:
+            raise self.pending
+        return False
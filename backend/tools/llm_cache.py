@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from .task_context import add_metric, current_context
+from .llm_usage import record_usage
+
+# 默认缓存位置：项目根目录下的 cache 目录
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                  'cache', 'llm_cache.sqlite3')
+
+
+def cache_key(model, messages, temperature=None, prompt_version=None):
+    """
+    以 (模型, 消息列表, 温度, 提示词版本) 的 sha256 作为缓存键。
+    修改提示词模板后调整配置 llm_prompt_version 即可让旧结果全部失效。
+    """
+    if prompt_version is None:
+        prompt_version = os.getenv('llm_prompt_version', '1')
+    payload = json.dumps({'model': model, 'messages': messages, 'temperature': temperature,
+                          'prompt_version': prompt_version}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """
+    按内容寻址的模型响应缓存，保存在 SQLite 文件中，多个线程共用一个连接。
+    总大小超过 max_bytes 时按最近访问时间淘汰（LRU），淘汰到上限的 90%。
+    批量接口返回的结果带有用量（usage，json），在第一次被任务取用时计入该任务后清除。
+    """
+
+    def __init__(self, path=None, max_bytes=None):
+        self.path = path or os.getenv('llm_cache_path') or DEFAULT_CACHE_PATH
+        self.max_bytes = max_bytes if max_bytes is not None else int(float(os.getenv('llm_cache_max_mb', '200')) * 1024 * 1024)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT,
+                size INTEGER,
+                latency REAL,
+                created REAL,
+                accessed REAL,
+                usage TEXT
+            )""")
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(responses)")]
+        if 'usage' not in columns:
+            self._conn.execute("ALTER TABLE responses ADD COLUMN usage TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses(accessed)")
+        self._conn.commit()
+
+    def get(self, key):
+        """返回 (响应文本, 原始调用耗时)，未命中时返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT response, latency FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+                self._conn.commit()
+        return row
+
+    def put(self, key, model, response, latency=0.0, usage=None):
+        size = len(response.encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               (key, model, response, size, latency, now, now,
+                                json.dumps(usage) if usage else None))
+            self._evict()
+            self._conn.commit()
+
+    def take_usage(self, key):
+        """取出并清除一条结果尚未计入任务的用量，没有时返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT usage FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or not row[0]:
+                return None
+            self._conn.execute("UPDATE responses SET usage = NULL WHERE key = ?", (key,))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def discard(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            if total <= target:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        add_metric('llm_cache_evictions', evicted)
+
+    def stats(self):
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {'entries': count, 'bytes': total, 'max_bytes': self.max_bytes}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def cache_enabled():
+    return os.getenv('llm_cache', 'on') != 'off'
+
+
+def get_llm_cache():
+    """进程内共用的缓存实例，配置 llm_cache=off 时返回 None"""
+    global _cache
+    if not cache_enabled():
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache()
+        return _cache
+
+
+def cached_completion(model, messages, call, temperature=None, cache=True):
+    """
+    先查缓存，未命中时调用 call() 得到响应文本并写入缓存。
+    cache=False 时跳过读取，但仍以新结果刷新缓存。
+    命中、未命中次数以及命中节省的调用耗时记录在当前步骤的指标中；
+    命中批量接口导入的结果时，该请求的用量只计入第一个取用它的任务。
+    """
+    store = get_llm_cache()
+    if store is None:
+        return call()
+    key = cache_key(model, messages, temperature)
+    if cache:
+        row = store.get(key)
+        if row is not None:
+            add_metric('llm_cache_hits')
+            add_metric('llm_cache_saved_seconds', round(row[1] or 0, 3))
+            usage = store.take_usage(key)
+            context = current_context()
+            if usage and context is not None:
+                context.add('llm_requests')
+                record_usage(context, None, model, usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0),
+                             usage.get('cached_tokens', 0))
+            return row[0]
+        add_metric('llm_cache_misses')
+    start_time = time.time()
+    response = call()
+    if response:
+        store.put(key, model, response, time.time() - start_time)
+    return response
+
+
+def discard_completion(model, messages, temperature=None):
+    """删除一条缓存（如缓存的输出格式不合格），下次调用重新请求模型"""
+    store = get_llm_cache()
+    if store is not None:
+        store.discard(cache_key(model, messages, temperature))
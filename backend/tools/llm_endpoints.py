@@ -0,0 +1,227 @@
+import os
+import json
+import asyncio
+import time
+from collections import deque
+from .retry import is_retryable
+
+DEFAULT_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+
+# 断路器状态
+CLOSED = 'closed'        # 正常
+OPEN = 'open'            # 熔断中，不发送请求
+HALF_OPEN = 'half_open'  # 冷却结束，放行一个探测请求
+
+
+class LLMUnavailableError(RuntimeError):
+    """
+    所有模型服务地址都处于熔断状态。不在调用处重试，而是由 run_requeueable
+    等到 retry_at（最早恢复探测的时间）后重新执行整个步骤。
+    """
+    requeue_stage = True
+
+    def __init__(self, message, retry_at):
+        super().__init__(message)
+        self.retry_at = retry_at
+
+
+class Endpoint:
+    """
+    一个 OpenAI 兼容的服务地址，记录延迟和错误情况，并带有断路器：
+    连续失败 failure_threshold 次，或最近 window 次请求的错误率超过 error_rate 时熔断 cooldown 秒，
+    冷却结束后放行一个探测请求，成功则恢复，失败则重新熔断。
+    """
+
+    def __init__(self, name, base_url, api_key, http_client, models=None,
+                 failure_threshold=3, error_rate=0.5, window=20, cooldown=30.0, client=None):
+        """client: 已创建的 chat.completions 客户端，默认用 api_key、http_client 创建 AsyncOpenAI"""
+        self.name = name
+        self.base_url = base_url
+        self.models = models or {}  # 模型名映射，不同服务商的模型名称可能不同
+        if client is None:
+            from openai import AsyncOpenAI
+            client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+        self.client = client
+        self.failure_threshold = failure_threshold
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.outcomes = deque(maxlen=window)  # 最近请求是否成功
+        self.consecutive_failures = 0
+        self.latency = None  # 成功请求耗时的指数加权平均（秒）
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.requests = 0
+        self.failures = 0
+
+    def available(self, now):
+        if self.state == OPEN and now - self.opened_at >= self.cooldown:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            return not self.probing
+        return self.state == CLOSED
+
+    def retry_at(self):
+        return self.opened_at + self.cooldown if self.state == OPEN else time.time()
+
+    def record_success(self, seconds):
+        self.requests += 1
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+        self.latency = seconds if self.latency is None else 0.8 * self.latency + 0.2 * seconds
+        if self.state != CLOSED:
+            print(f"模型服务 {self.name} 已恢复")
+        self.state = CLOSED
+        self.probing = False
+
+    def release(self):
+        """请求没有结果（被取消、被限流或由调用方中止读取）时放行下一个探测请求"""
+        self.probing = False
+
+    def record_failure(self):
+        self.requests += 1
+        self.failures += 1
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        errors = self.outcomes.count(False)
+        tripped = (self.consecutive_failures >= self.failure_threshold
+                   or (len(self.outcomes) >= self.outcomes.maxlen // 2 and errors / len(self.outcomes) > self.error_rate))
+        if self.state == HALF_OPEN or tripped:
+            if self.state != OPEN:
+                print(f"模型服务 {self.name} 熔断 {self.cooldown:.0f} 秒")
+            self.state = OPEN
+            self.opened_at = time.time()
+        self.probing = False
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'base_url': self.base_url,
+            'state': self.state,
+            'latency': round(self.latency, 3) if self.latency is not None else None,
+            'recent_error_rate': round(self.outcomes.count(False) / len(self.outcomes), 3) if self.outcomes else 0.0,
+            'requests': self.requests,
+            'failures': self.failures,
+        }
+
+
+def load_endpoint_configs():
+    """
+    读取配置 llm_endpoints（json 列表），每项包含 base_url、api_key，可选 name、models；
+    未配置时使用 base_url / api_key 组成单个地址。
+    """
+    configs = json.loads(os.getenv('llm_endpoints', '[]'))
+    if not configs:
+        configs = [{'name': 'default', 'base_url': os.getenv('base_url') or DEFAULT_BASE_URL,
+                    'api_key': os.getenv('api_key')}]
+    return configs
+
+
+class TrackedStream:
+    """
+    流式响应的包装：收到响应头只说明连接成功，读完整个流后才记录成功和总耗时，
+    读取中途出错（断线、读取超时）计为该地址的失败；被取消或由调用方 close 中止时不计结果。
+    """
+
+    def __init__(self, response, endpoint, start_time):
+        self.response = response
+        self.endpoint = endpoint
+        self.start_time = start_time
+        self.finished = False
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self.response:
+                yield chunk
+        except asyncio.CancelledError:
+            self._finish()
+            raise
+        except Exception:
+            self._finish(self.endpoint.record_failure)
+            raise
+        self._finish(lambda: self.endpoint.record_success(time.time() - self.start_time))
+
+    def _finish(self, record=None):
+        if self.finished:
+            return
+        self.finished = True
+        (record or self.endpoint.release)()
+
+    async def close(self):
+        self._finish()
+        await self.response.close()
+
+
+class EndpointPool:
+    """
+    多个模型服务地址组成的池：优先选择未熔断且平均延迟最低的地址，
+    请求遇到可重试的错误（网络、超时、限流、5xx、鉴权失败）时立即换下一个地址，其中限流不计入断路器；
+    请求本身有误（400、422 等）时直接抛出。所有地址都熔断时抛出 LLMUnavailableError。
+    只在后台事件循环中使用，无需加锁。
+    """
+
+    def __init__(self, http_client, configs=None, endpoints=None):
+        """endpoints: 已创建的 Endpoint 列表，指定时忽略 configs"""
+        if endpoints is not None:
+            self.endpoints = list(endpoints)
+            return
+        configs = configs or load_endpoint_configs()
+        breaker = {
+            'failure_threshold': int(os.getenv('llm_breaker_failures', '3')),
+            'error_rate': float(os.getenv('llm_breaker_error_rate', '0.5')),
+            'cooldown': float(os.getenv('llm_breaker_cooldown', '30')),
+        }
+        self.endpoints = [Endpoint(config.get('name') or f"endpoint{i + 1}", config['base_url'], config.get('api_key'),
+                                   http_client, config.get('models'), **breaker)
+                          for i, config in enumerate(configs)]
+
+    def candidates(self):
+        now = time.time()
+        available = [endpoint for endpoint in self.endpoints if endpoint.available(now)]
+        # 最近连续失败的地址靠后；未测得延迟的地址排在前面，使其尽快得到测量
+        return sorted(available, key=lambda endpoint: (endpoint.state != CLOSED, endpoint.consecutive_failures,
+                                                       endpoint.latency or 0.0))
+
+    async def create(self, **kwargs):
+        """
+        发送 chat.completions 请求，按需切换地址，返回 (响应, 地址名称)。
+        流式请求返回 TrackedStream，读完整个流才记录成功和耗时，读取中途出错计为该地址的失败。
+        """
+        last_error = None
+        for endpoint in self.candidates():
+            if endpoint.state == HALF_OPEN:
+                endpoint.probing = True
+            request = dict(kwargs, model=endpoint.models.get(kwargs['model'], kwargs['model']))
+            start_time = time.time()
+            try:
+                response = await endpoint.client.chat.completions.create(**request)
+            except asyncio.CancelledError:
+                # 被对冲请求取消时探测没有结果，放行下一个探测请求
+                endpoint.release()
+                raise
+            except Exception as e:
+                status = getattr(e, 'status_code', None)
+                if status == 429:
+                    # 限流说明服务本身正常，由限速器统一暂停该模型，不计入断路器的失败次数
+                    endpoint.release()
+                    last_error = e
+                    print(f"模型服务 {endpoint.name} 限流，切换地址: {e}")
+                    continue
+                if status in (401, 403) or is_retryable(e):
+                    endpoint.record_failure()
+                    last_error = e
+                    print(f"模型服务 {endpoint.name} 请求失败，切换地址: {e}")
+                    continue
+                endpoint.release()
+                raise
+            if kwargs.get('stream'):
+                return TrackedStream(response, endpoint, start_time), endpoint.name
+            endpoint.record_success(time.time() - start_time)
+            return response, endpoint.name
+        if last_error is not None:
+            raise last_error
+        retry_at = min(endpoint.retry_at() for endpoint in self.endpoints)
+        raise LLMUnavailableError(f"所有模型服务均已熔断，预计 {max(0, retry_at - time.time()):.0f} 秒后恢复", retry_at)
+
+    def stats(self):
+        return [endpoint.stats() for endpoint in self.endpoints]
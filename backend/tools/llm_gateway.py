@@ -0,0 +1,212 @@
+import os
+import time
+import asyncio
+import threading
+from .background_loop import run_coroutine
+from .llm_endpoints import EndpointPool
+from .llm_hedging import LatencyTracker, HedgeBudget
+from .llm_limiter import get_llm_limiter
+from .llm_usage import record_usage
+from .retry import retry_after_seconds
+from .task_context import current_context
+from .transcript import estimate_tokens
+
+class LLMGateway:
+    """
+    进程内共用的模型调用入口：各服务地址的 AsyncOpenAI 客户端运行在后台事件循环上，
+    共用一个 httpx 连接池复用 TLS 连接，所有请求都有明确的连接/读取超时。
+    服务地址的选择、故障切换和熔断由 EndpointPool 负责。
+    等待模型响应时不占用线程，少量线程即可同时保持大量进行中的请求。
+    """
+
+    def __init__(self, endpoints=None, connect_timeout=None, read_timeout=None, max_connections=None, pool=None):
+        """
+        endpoints: 服务地址配置列表，默认读取配置 llm_endpoints
+        pool: 已创建的 EndpointPool，指定时不再创建连接池和客户端
+        """
+        self.http_client = None
+        if pool is None:
+            import httpx
+            connect_timeout = connect_timeout or float(os.getenv('llm_connect_timeout', '10'))
+            read_timeout = read_timeout or float(os.getenv('llm_read_timeout', '300'))
+            max_connections = max_connections or int(os.getenv('llm_max_connections', '100'))
+            self.http_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            )
+            pool = EndpointPool(self.http_client, endpoints)
+        self.pool = pool
+        self.latency = LatencyTracker()
+        self.hedge_budget = HedgeBudget()
+
+    async def _request(self, messages, model, temperature, context, stage, estimated, stream=None):
+        """
+        发送一次请求并返回回复文本。发送前在全局限速器中按任务优先级排队，
+        排队时间记录到 context（调用方的任务上下文）当前步骤的指标中。
+        stream: 创建流式消费者（带 feed 方法）的函数，指定时以流式方式接收输出
+        """
+        limiter = get_llm_limiter()
+        wait = await limiter.acquire(model, estimated, context.scheduling_key() if context is not None else (0,))
+        if context is not None:
+            context.add('llm_queue_wait_seconds', round(wait, 3), stage)
+            context.add('llm_requests', 1, stage)
+
+        kwargs = {"messages": messages, "model": model}
+        if temperature is not None:
+            kwargs["temperature"] = temperature
+        if stream is not None:
+            kwargs["stream"] = True
+            kwargs["stream_options"] = {"include_usage": True}
+        start_time = time.time()
+        response = None
+        try:
+            response, endpoint = await self.pool.create(**kwargs)
+            if stream is not None:
+                text, usage = await self._consume_stream(response, stream(), context, stage, start_time, model,
+                                                         estimated)
+            else:
+                text, usage = response.choices[0].message.content, getattr(response, 'usage', None)
+        except asyncio.CancelledError:
+            # 被对冲请求取消时只知道耗时的下限，不计入延迟分布，以免对冲阈值被逐步拉低。
+            # 请求可能已被服务处理，提示词按估计值计入用量（读取流的过程中取消时已由 _consume_stream 记录）
+            if context is not None and (stream is None or response is None):
+                record_usage(context, stage, model, estimated - expected_output_tokens(), 0)
+                context.add('llm_usage_estimated', 1, stage)
+            raise
+        except Exception as e:
+            if getattr(e, 'status_code', None) == 429:
+                # 超出配额时所有任务一起暂停该模型，而不是各自盲目重试
+                limiter.penalize(model, retry_after_seconds(e) or float(os.getenv('llm_rate_limit_pause', '10')))
+            raise
+        self.latency.record(model, estimated, time.time() - start_time)
+        if context is not None and len(self.pool.endpoints) > 1:
+            context.add(f'llm_requests.{endpoint}', 1, stage)
+        if usage is not None and getattr(usage, 'total_tokens', None):
+            limiter.settle(model, estimated, usage.total_tokens)
+        if context is not None:
+            if usage is not None:
+                details = getattr(usage, 'prompt_tokens_details', None)
+                record_usage(context, stage, model, usage.prompt_tokens or 0, usage.completion_tokens or 0,
+                             getattr(details, 'cached_tokens', None) or 0)
+            else:
+                # 服务未返回用量时按估计值记录
+                record_usage(context, stage, model, estimated - expected_output_tokens(), estimate_tokens(text or ''))
+                context.add('llm_usage_estimated', 1, stage)
+        return text
+
+    async def _consume_stream(self, response, consumer, context, stage, start_time, model, estimated):
+        """
+        逐块读取流式响应并交给 consumer.feed；consumer 抛出异常时关闭连接，中止生成。
+        中止时服务不会返回用量，已生成的部分按估计值计入用量。
+        """
+        parts = []
+        usage = None
+        try:
+            async for chunk in response:
+                if getattr(chunk, 'usage', None):
+                    usage = chunk.usage
+                for choice in chunk.choices:
+                    delta = choice.delta.content
+                    if not delta:
+                        continue
+                    if not parts and context is not None:
+                        context.add('llm_first_token_seconds', round(time.time() - start_time, 3), stage)
+                    parts.append(delta)
+                    consumer.feed(delta)
+        except BaseException:
+            await response.close()
+            if context is not None:
+                record_usage(context, stage, model, estimated - expected_output_tokens(), estimate_tokens(''.join(parts)))
+                context.add('llm_usage_estimated', 1, stage)
+            raise
+        return ''.join(parts), usage
+
+    async def acomplete(self, messages, model="qwen-plus", temperature=None, context=None, hedge=False, accept=None,
+                        stream=None):
+        """
+        异步调用，返回回复文本。
+
+        hedge: 对关键路径上的调用开启对冲：耗时超过该模型、该提示词规模下观测到的 p90 延迟
+               （llm_hedge_quantile）时，在对冲预算内再发送一个相同的请求，先得到合格结果的一方胜出，另一方取消。
+        accept: 判断回复是否合格的函数，对冲时不合格的回复不会胜出
+        stream: 创建流式消费者的函数，每个请求（包括对冲请求）各用一个消费者
+        """
+        stage = context.stage if context is not None else None
+        estimated = estimate_request_tokens(messages)
+        self.hedge_budget.on_request()
+        request = lambda: asyncio.ensure_future(self._request(messages, model, temperature, context, stage, estimated,
+                                                                   stream))
+
+        delay = None
+        if hedge:
+            delay = self.latency.quantile(model, estimated, float(os.getenv('llm_hedge_quantile', '0.9')))
+        if delay is None:
+            return await request()
+
+        pending = {request()}
+        hedge_task = None
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if not done:
+            if self.hedge_budget.try_spend():
+                hedge_task = request()
+                pending.add(hedge_task)
+                if context is not None:
+                    context.add('llm_hedges', 1, stage)
+            elif context is not None:
+                context.add('llm_hedges_denied', 1, stage)
+
+        fallback = None
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                        continue
+                    reply = task.result()
+                    if accept is None or accept(reply):
+                        if task is hedge_task and context is not None:
+                            context.add('llm_hedge_wins', 1, stage)
+                        return reply
+                    fallback = fallback if fallback is not None else reply
+        finally:
+            for task in pending:
+                task.cancel()
+        if fallback is not None:
+            return fallback
+        raise error
+
+    def submit(self, messages, model="qwen-plus", temperature=None, hedge=False, accept=None, stream=None):
+        """提交到后台事件循环，立即返回 concurrent.futures.Future，可一次提交多个请求再统一等待"""
+        return run_coroutine(self.acomplete(messages, model, temperature, current_context(), hedge, accept, stream))
+
+    def complete(self, messages, model="qwen-plus", temperature=None, hedge=False, accept=None, stream=None):
+        """同步调用，供现有的同步代码使用"""
+        return self.submit(messages, model, temperature, hedge, accept, stream).result()
+
+    def stats(self):
+        """各服务地址的状态、平均延迟和错误率"""
+        return self.pool.stats()
+
+
+def expected_output_tokens():
+    return int(os.getenv('llm_expected_output_tokens', '1500'))
+
+
+def estimate_request_tokens(messages):
+    """请求占用的 token 数估计：提示词估计值加上预计的输出长度 llm_expected_output_tokens"""
+    prompt_tokens = sum(estimate_tokens(str(message.get('content', ''))) for message in messages)
+    return prompt_tokens + expected_output_tokens()
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_llm_gateway():
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = LLMGateway()
+        return _gateway
@@ -0,0 +1,55 @@
+import os
+import math
+import threading
+from collections import deque
+
+
+def size_bucket(tokens):
+    """按提示词规模分桶（2 的幂），规模相近的请求共用延迟分布"""
+    return max(0, int(math.log2(max(tokens, 1))))
+
+
+class LatencyTracker:
+    """记录每个 (模型, 提示词规模) 最近的请求耗时，用于估计 p90 等分位数"""
+
+    def __init__(self, window=200):
+        self.window = window
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, tokens, seconds):
+        with self._lock:
+            key = (model, size_bucket(tokens))
+            self.samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def quantile(self, model, tokens, q=0.9, min_samples=10):
+        """样本不足 min_samples 时返回 None"""
+        with self._lock:
+            samples = sorted(self.samples.get((model, size_bucket(tokens)), ()))
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class HedgeBudget:
+    """
+    对冲预算：每个请求积累 ratio 个额度，每次发送对冲请求消耗 1 个，最多积累 burst 个，
+    对冲请求占全部请求的比例因此不超过 ratio。
+    """
+
+    def __init__(self, ratio=None, burst=None):
+        self.ratio = ratio if ratio is not None else float(os.getenv('llm_hedge_ratio', '0.05'))
+        self.burst = burst if burst is not None else float(os.getenv('llm_hedge_burst', '3'))
+        self.credit = self.burst
+        self._lock = threading.Lock()
+
+    def on_request(self):
+        with self._lock:
+            self.credit = min(self.burst, self.credit + self.ratio)
+
+    def try_spend(self):
+        with self._lock:
+            if self.credit >= 1:
+                self.credit -= 1
+                return True
+            return False
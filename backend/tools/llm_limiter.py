@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+
+# 各模型默认的每分钟请求数和每分钟 token 数，可用配置 llm_rate_limits（json）覆盖或补充，
+# 如 {"qwen-plus": {"rpm": 600, "tpm": 1000000}}；未配置的模型不限速
+DEFAULT_RATE_LIMITS = {
+    'qwen-plus': {'rpm': 600, 'tpm': 1000000},
+    'qwen-turbo': {'rpm': 600, 'tpm': 1000000},
+    'qwen-max': {'rpm': 60, 'tpm': 100000},
+}
+
+
+class TokenBucket:
+    """令牌桶：容量为每分钟的额度，按每秒 per_minute/60 的速度补充"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """取出 amount 个令牌还需等待的秒数，超过容量的请求按容量计算"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount, now):
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, amount):
+        """按实际用量修正（amount 为正表示多扣，为负表示退还），允许暂时透支"""
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class ModelQueue:
+    """单个模型的限速状态和按优先级排序的等待队列"""
+
+    def __init__(self, rpm=None, tpm=None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.paused_until = 0.0
+        self.waiters = []  # 堆：(优先级, 序号, token 数, future)
+        self.timer = None
+
+    def wait_time(self, tokens, now):
+        wait = max(0.0, self.paused_until - now)
+        if self.requests:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        return wait
+
+    def take(self, tokens, now):
+        if self.requests:
+            self.requests.take(1, now)
+        if self.tokens:
+            self.tokens.take(tokens, now)
+
+
+class LLMRateLimiter:
+    """
+    进程内所有任务共用的模型限速器，运行在后台事件循环中（只在该循环内调用，无需加锁）。
+    每个模型同时受每分钟请求数和每分钟 token 数两个令牌桶限制；额度不足时请求按优先级排队，
+    优先级相同时先到先得。收到限流错误时暂停该模型一段时间，所有任务一起退避。
+    """
+
+    def __init__(self, limits=None):
+        if limits is None:
+            limits = dict(DEFAULT_RATE_LIMITS)
+            limits.update(json.loads(os.getenv('llm_rate_limits', '{}')))
+        self.limits = limits
+        self.queues = {}
+        self._counter = itertools.count()
+
+    def _queue(self, model):
+        queue = self.queues.get(model)
+        if queue is None:
+            limit = self.limits.get(model, {})
+            queue = self.queues[model] = ModelQueue(limit.get('rpm'), limit.get('tpm'))
+        return queue
+
+    async def acquire(self, model, tokens, priority=(0,)):
+        """
+        等待额度，返回排队等待的秒数。
+        priority: 可比较的元组，越小越优先
+        """
+        queue = self._queue(model)
+        if queue.requests is None and queue.tokens is None:
+            return 0.0
+        start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(queue.waiters, (priority, next(self._counter), tokens, future))
+        self._dispatch(model)
+        await future
+        return time.monotonic() - start
+
+    def _dispatch(self, model):
+        queue = self._queue(model)
+        # 新请求到达时也会调用，先取消尚未触发的唤醒，队列中始终最多只有一个定时器
+        if queue.timer is not None:
+            queue.timer.cancel()
+            queue.timer = None
+        while queue.waiters:
+            priority, _, tokens, future = queue.waiters[0]
+            if future.done():  # 调用方已取消
+                heapq.heappop(queue.waiters)
+                continue
+            now = time.monotonic()
+            wait = queue.wait_time(tokens, now)
+            if wait > 0:
+                # 只放行队首，保证高优先级的大请求不会被后来的小请求一直插队
+                queue.timer = asyncio.get_running_loop().call_later(wait, self._dispatch, model)
+                return
+            heapq.heappop(queue.waiters)
+            queue.take(tokens, now)
+            future.set_result(None)
+
+    def settle(self, model, estimated, actual):
+        """请求完成后按实际 token 用量修正令牌桶"""
+        queue = self._queue(model)
+        if queue.tokens and actual:
+            queue.tokens.adjust(actual - estimated)
+
+    def penalize(self, model, seconds):
+        """收到限流错误后暂停该模型 seconds 秒"""
+        queue = self._queue(model)
+        queue.paused_until = max(queue.paused_until, time.monotonic() + seconds)
+        if queue.timer is not None:
+            queue.timer.cancel()
+        queue.timer = asyncio.get_running_loop().call_later(seconds, self._dispatch, model)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_llm_limiter():
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = LLMRateLimiter()
+        return _limiter
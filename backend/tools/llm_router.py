@@ -0,0 +1,107 @@
+import os
+import json
+import threading
+from collections import deque
+from .task_context import add_metric
+from .transcript import estimate_tokens
+
+# 路由表：{路由名称: [规则, ...]}，按顺序取第一条满足条件的规则。
+# 规则可以指定 max_tokens（提示词估计 token 数不超过该值时匹配），没有条件的规则总是匹配。
+# 可通过配置 llm_routes（json，格式相同）按路由覆盖。
+DEFAULT_ROUTES = {
+    'default': [{'model': 'qwen-plus'}],
+    # 整节课程的视频图谱
+    'video_tree': [{'model': 'qwen-plus'}],
+    # 分块生成时每一段的子树：规模小的段用更快的模型
+    'video_tree_chunk': [{'max_tokens': 6000, 'model': 'qwen-turbo'}, {'model': 'qwen-plus'}],
+    # 合并子树时生成整节课程的名称和概括，输入很短，用更强的模型
+    'video_tree_merge': [{'model': 'qwen-max'}],
+    'report': [{'model': 'qwen-plus'}],
+    'outline': [{'model': 'qwen-plus'}],
+    'outline_chunk': [{'max_tokens': 6000, 'model': 'qwen-turbo'}, {'model': 'qwen-plus'}],
+    'doc_tree': [{'model': 'qwen-max'}],
+    # 输出格式有误时的重新生成：对话不长时用更快的模型
+    'json_repair': [{'max_tokens': 8000, 'model': 'qwen-turbo'}, {'model': 'qwen-plus'}],
+}
+
+# 路由结果的格式质量
+QUALITY_OUTCOMES = ('valid', 'repaired', 'reprompted', 'failed')
+
+
+class RouteStats:
+    """按 (路由, 模型) 记录最近的请求耗时、错误数和 json 输出的格式质量，供调整路由表参考"""
+
+    def __init__(self, window=200):
+        self.window = window
+        self.routes = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, route, model):
+        key = (route, model)
+        if key not in self.routes:
+            self.routes[key] = {'latency': deque(maxlen=self.window), 'requests': 0, 'errors': 0,
+                                **{outcome: 0 for outcome in QUALITY_OUTCOMES}}
+        return self.routes[key]
+
+    def record_request(self, route, model, seconds, ok=True):
+        with self._lock:
+            entry = self._entry(route, model)
+            entry['requests'] += 1
+            if ok:
+                entry['latency'].append(seconds)
+            else:
+                entry['errors'] += 1
+
+    def record_quality(self, route, model, outcome):
+        with self._lock:
+            self._entry(route, model)[outcome] += 1
+
+    def stats(self):
+        result = []
+        with self._lock:
+            for (route, model), entry in sorted(self.routes.items()):
+                latency = sorted(entry['latency'])
+                quantile = lambda q: round(latency[min(len(latency) - 1, int(q * len(latency)))], 3) if latency else None
+                result.append({
+                    'route': route,
+                    'model': model,
+                    'requests': entry['requests'],
+                    'errors': entry['errors'],
+                    'latency_p50': quantile(0.5),
+                    'latency_p90': quantile(0.9),
+                    **{outcome: entry[outcome] for outcome in QUALITY_OUTCOMES},
+                })
+        return result
+
+
+class LLMRouter:
+    """根据路由名称（调用所在的步骤）和提示词规模选择模型"""
+
+    def __init__(self, routes=None):
+        self.routes = dict(DEFAULT_ROUTES)
+        self.routes.update(routes if routes is not None else json.loads(os.getenv('llm_routes', '{}')))
+        self.stats = RouteStats()
+
+    def select(self, route, messages):
+        rules = self.routes.get(route) or self.routes['default']
+        tokens = sum(estimate_tokens(str(message.get('content', ''))) for message in messages)
+        for rule in rules:
+            if rule.get('max_tokens') is None or tokens <= rule['max_tokens']:
+                model = rule['model']
+                break
+        else:
+            model = rules[-1]['model']
+        add_metric(f'llm_route.{route}.{model}')
+        return model
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_llm_router():
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = LLMRouter()
+        return _router
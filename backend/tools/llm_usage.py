@@ -0,0 +1,111 @@
+import os
+import json
+
+# 各模型每百万 token 的价格（元），可通过配置 llm_prices（json）覆盖或补充
+DEFAULT_PRICES = {
+    'qwen-plus': {'prompt': 0.8, 'completion': 2.0},
+    'qwen-turbo': {'prompt': 0.3, 'completion': 0.6},
+    'qwen-max': {'prompt': 2.4, 'completion': 9.6},
+}
+
+# 各步骤指标中与用量相关的字段 -> 汇总结果中的字段
+USAGE_METRICS = {
+    'llm_requests': 'requests',
+    'llm_prompt_tokens': 'prompt_tokens',
+    'llm_cached_tokens': 'cached_tokens',
+    'llm_completion_tokens': 'completion_tokens',
+    'llm_cost': 'cost',
+}
+
+_prices = None
+
+
+def model_prices():
+    global _prices
+    if _prices is None:
+        _prices = dict(DEFAULT_PRICES, **json.loads(os.getenv('llm_prices', '{}')))
+    return _prices
+
+
+def request_cost(model, prompt_tokens, completion_tokens, cached_tokens=0):
+    """
+    按价格表计算一次请求的费用（元）。命中前缀缓存的提示词 token 按
+    llm_cached_price_ratio（默认 0.4）折算；价格表中没有的模型费用记为 0。
+    """
+    price = model_prices().get(model)
+    if not price:
+        return 0.0
+    cached_ratio = float(os.getenv('llm_cached_price_ratio', '0.4'))
+    prompt = prompt_tokens - cached_tokens + cached_tokens * cached_ratio
+    return (prompt * price.get('prompt', 0) + completion_tokens * price.get('completion', 0)) / 1000000
+
+
+def record_usage(context, stage, model, prompt_tokens, completion_tokens, cached_tokens=0):
+    """
+    将一次请求的用量和费用累加到任务当前步骤的指标中。
+    cached_tokens: 提示词中命中模型服务前缀缓存的 token 数（prompt_tokens_details.cached_tokens）
+    """
+    context.add('llm_prompt_tokens', prompt_tokens, stage)
+    context.add('llm_cached_tokens', cached_tokens, stage)
+    context.add('llm_completion_tokens', completion_tokens, stage)
+    context.add('llm_cost', request_cost(model, prompt_tokens, completion_tokens, cached_tokens), stage, digits=6)
+
+
+def _empty():
+    return {name: 0 for name in USAGE_METRICS.values()}
+
+
+def _accumulate(total, usage):
+    for name in USAGE_METRICS.values():
+        total[name] += usage.get(name, 0)
+
+
+def _rounded(usage):
+    usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+    usage['cost'] = round(usage['cost'], 6)
+    return usage
+
+
+def usage_from_metrics(stage_metrics):
+    """
+    从任务的步骤指标（progress.json 中的 stage_metrics）汇总模型用量。
+
+    返回:
+        {"stages": {步骤名称: 用量}, "total": 用量}，
+        用量包含 requests、prompt_tokens、cached_tokens、completion_tokens、total_tokens、cost
+    """
+    stages = {}
+    total = _empty()
+    for stage, metrics in (stage_metrics or {}).items():
+        if not any(key in metrics for key in USAGE_METRICS):
+            continue
+        usage = {name: metrics.get(key, 0) for key, name in USAGE_METRICS.items()}
+        _accumulate(total, usage)
+        stages[stage] = _rounded(usage)
+    return {'stages': stages, 'total': _rounded(total)}
+
+
+def merge_usage(summaries):
+    """
+    合并多个任务的用量汇总（usage_from_metrics 的结果）。
+
+    返回:
+        {"tasks": 有用量记录的任务数, "stages": {...}, "total": {...}, "average_per_task": {...}}
+    """
+    stages = {}
+    total = _empty()
+    tasks = 0
+    for summary in summaries:
+        if not summary or not summary.get('stages'):
+            continue
+        tasks += 1
+        _accumulate(total, summary['total'])
+        for stage, usage in summary['stages'].items():
+            _accumulate(stages.setdefault(stage, _empty()), usage)
+    average = {name: round(value / tasks, 6 if name == 'cost' else 1) for name, value in total.items()} if tasks else _empty()
+    return {
+        'tasks': tasks,
+        'stages': {stage: _rounded(usage) for stage, usage in stages.items()},
+        'total': _rounded(total),
+        'average_per_task': _rounded(average),
+    }
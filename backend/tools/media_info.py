@@ -0,0 +1,157 @@
+import os
+import json
+
+# 任务文件夹内缓存媒体元数据的文件名
+MEDIA_INFO_FILE = 'media_info.json'
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv')
+
+# 语音识别用的音频编码配置，通过环境变量 asr_audio_profile 选择
+# legacy 为原先的双声道 128k MP3；speech/opus 按语音识别需要降为 16kHz 单声道
+ASR_AUDIO_PROFILES = {
+    'legacy': {'acodec': 'libmp3lame', 'ab': '128k', 'ext': 'mp3'},
+    'speech': {'acodec': 'libmp3lame', 'ab': '32k', 'ar': 16000, 'ac': 1, 'ext': 'mp3'},
+    'opus': {'acodec': 'libopus', 'ab': '24k', 'ar': 16000, 'ac': 1, 'ext': 'opus'},
+}
+
+
+def get_asr_audio_profile():
+    """读取语音识别音频配置"""
+    name = os.getenv('asr_audio_profile', 'speech')
+    if name not in ASR_AUDIO_PROFILES:
+        raise ValueError(f"未知的音频配置 {name}，可选：{', '.join(ASR_AUDIO_PROFILES)}")
+    profile = dict(ASR_AUDIO_PROFILES[name], name=name)
+    # 复制音频流可省去解码和编码，但上传体积取决于源音轨码率，默认关闭
+    profile['stream_copy'] = os.getenv('asr_stream_copy', 'false').lower() in ('1', 'true', 'yes')
+    profile['copy_max_bitrate'] = int(os.getenv('asr_copy_max_bitrate', '96000'))
+    return profile
+
+
+def audio_encode_args(profile):
+    """音频配置对应的 FFmpeg 编码参数"""
+    args = ['-acodec', profile['acodec'], '-ab', profile['ab']]
+    if profile.get('ar'):
+        args += ['-ar', str(profile['ar'])]  # 采样率
+    if profile.get('ac'):
+        args += ['-ac', str(profile['ac'])]  # 声道数
+    return args
+
+
+def find_source_video(folder):
+    """
+    查找任务文件夹内的源视频，优先使用上传时保存的 video.mp4，
+    否则按文件名顺序取第一个视频文件。找不到时返回 None。
+    """
+    default_path = os.path.join(folder, 'video.mp4')
+    if os.path.isfile(default_path):
+        return default_path
+    for filename in sorted(os.listdir(folder)):
+        if filename.lower().endswith(VIDEO_EXTENSIONS):
+            return os.path.join(folder, filename)
+    return None
+
+
+def file_signature(path):
+    """用文件大小和修改时间标识文件版本，用于判断缓存是否过期"""
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def read_media_info(folder):
+    """读取任务文件夹内缓存的媒体元数据，不存在或损坏时返回 None"""
+    info_file = os.path.join(folder, MEDIA_INFO_FILE)
+    if not os.path.exists(info_file):
+        return None
+    try:
+        with open(info_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_media_info(folder, info):
+    """将媒体元数据写入任务文件夹"""
+    info_file = os.path.join(folder, MEDIA_INFO_FILE)
+    with open(info_file, 'w', encoding='utf-8') as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+    return info_file
+
+
+def _parse_probe(probe):
+    """从 ffmpeg.probe 的结果中提取后续步骤需要的流信息"""
+    streams = probe.get('streams', [])
+    fmt = probe.get('format', {})
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+
+    # 部分容器的视频流没有 duration 字段，依次回退到音频流和容器时长
+    duration = 0.0
+    for source in (video, audio, fmt):
+        if source and source.get('duration'):
+            duration = float(source['duration'])
+            break
+
+    return {
+        'duration': duration,
+        'format_name': fmt.get('format_name'),
+        'bit_rate': int(fmt['bit_rate']) if fmt.get('bit_rate') else None,
+        'video_codec': video.get('codec_name') if video else None,
+        'audio_codec': audio.get('codec_name') if audio else None,
+        'audio_channels': audio.get('channels') if audio else None,
+        'audio_sample_rate': int(audio['sample_rate']) if audio and audio.get('sample_rate') else None,
+        'audio_bit_rate': int(audio['bit_rate']) if audio and audio.get('bit_rate') else None,
+    }
+
+
+def probe_media(video_path):
+    """
+    探测视频的流信息，结果缓存在视频所在文件夹的 media_info.json 中。
+    源文件未变化时直接返回缓存，整个任务期间只调用一次 ffmpeg.probe。
+    """
+    folder = os.path.dirname(video_path)
+    signature = file_signature(video_path)
+    cached = read_media_info(folder)
+    if (cached and cached.get('source') == os.path.basename(video_path)
+            and cached.get('source_signature') == signature):
+        return cached
+
+    import ffmpeg  # 只有探测时需要 ffmpeg-python，静音检测等只用到本模块其他函数的地方不必安装
+
+    info = {
+        'source': os.path.basename(video_path),
+        'source_signature': signature,
+        **_parse_probe(ffmpeg.probe(video_path)),
+    }
+    write_media_info(folder, info)
+    return info
+
+
+def output_is_current(folder, output_path, key='audio', params=None):
+    """
+    判断 media_info.json 中记录的派生文件（如音频）是否仍然有效：
+    文件存在、与记录的版本一致，且生成参数与本次相同。
+    """
+    info = read_media_info(folder)
+    if not info or not os.path.isfile(output_path):
+        return False
+    record = info.get('outputs', {}).get(key)
+    if not record:
+        return False
+    return (record.get('file') == os.path.basename(output_path)
+            and record.get('signature') == file_signature(output_path)
+            and record.get('source_signature') == info.get('source_signature')
+            and record.get('params') == params)
+
+
+def record_output(folder, output_path, key='audio', params=None, **extra):
+    """在 media_info.json 中登记派生文件，供下次运行时跳过重复处理"""
+    info = read_media_info(folder) or {}
+    info.setdefault('outputs', {})[key] = {
+        'file': os.path.basename(output_path),
+        'signature': file_signature(output_path),
+        'source_signature': info.get('source_signature'),
+        'params': params,
+        **extra,
+    }
+    write_media_info(folder, info)
+    return info
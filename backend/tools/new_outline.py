@@ -1,23 +1,40 @@
 from .util import *
+from .retry import retry
+from .json_repair import compile_schema
+from .prompt_layout import context_messages, TREE_HEADER
+from .transcript import transcript_for_prompt, encode_transcript, estimate_tokens
+from .topic_segmentation import segment_topics, pack_segments
+from .generate_video_tree import select_subtree
+from .task_context import add_metric, run_in_context
+from concurrent.futures import ThreadPoolExecutor
 
-def chat(prompt, conversation_history):
-    conversation_history.append({"role": "user", "content": prompt})
-    
-    response = client.chat.completions.create(
-        messages=conversation_history,
-        model="qwen-plus",
-    )
-    
-    assistant_reply = response.choices[0].message.content
-    conversation_history.append({"role": "assistant", "content": assistant_reply})
-    
-    return assistant_reply, conversation_history
+# 新教案结构，章节单独编译以便流式生成时逐章校验
+CHAPTER = {
+    "type": "object",
+    "required": ["章节名", "知识点"],
+    "properties": {
+        "章节名": {"type": "string"},
+        "知识点": {"type": "array", "items": {
+            "type": "object",
+            "required": ["名称", "内容"],
+            "properties": {"名称": {"type": "string"}, "内容": {"type": "string"}},
+        }},
+    },
+}
+CHAPTER_SCHEMA = compile_schema(CHAPTER)
+OUTLINE_SCHEMA = compile_schema({
+    "type": "object",
+    "required": ["课程名称", "章节"],
+    "properties": {
+        "课程名称": {"type": "string"},
+        "章节": {"type": "array", "items": CHAPTER},
+    },
+})
 
 def generate_prompt(srt, tree1):
-    prompt1 = f"""
-    你是一名教育专家，以下是通过教学视频提取出来的字幕以及知识图谱。其中根节点代表课程名称，第二层节点表示章节名称，第三层节点表示知识点。
-    图谱：{tree1}
-    字幕：{srt}
+    """字幕和图谱在前、任务说明在后，与报告各项分析共用请求开头，可以复用模型服务的前缀缓存"""
+    prompt1 = """
+    你是一名教育专家，以上是通过教学视频提取出来的字幕以及知识图谱。其中根节点代表课程名称，第二层节点表示章节名称，第三层节点表示知识点。
     """
     prompt2 =  """
     请根据知识图谱的结构，提取字幕中讲述的内容，将字幕中口语化的描述转换为书面语，注意去除字幕中出现的第一人称等口语化用词。
@@ -47,17 +64,58 @@ def generate_prompt(srt, tree1):
     知识点一等替换成具体的知识点名称。
     确保不改变知识图谱中的知识点名称和数量,并且生成的内容与原字幕的文本量差距不太大，尽可能生成更多的内容。
     """
-    return prompt1 + prompt2
+    return context_messages(srt, [(TREE_HEADER, str(tree1))], prompt1 + prompt2)
 
-@retry_on_failure(max_retries=2)
-def generate_outline(srt, tree1):
-    conversation_history = [
-        {"role": "system", "content": "你是一个教育专家"}
-    ]
+@retry(default=None)
+def outline(srt, tree1, route='outline'):
+    """route: 分块生成时为 outline_chunk，小块可以使用更快的模型"""
     prompt3 = f"""
     生成的内容并没有完全覆盖字幕中讲述的所有细节。请按照字幕内容和你对课程的理解进行扩展，要求覆盖字幕的所有教学细节，重新返回一个json格式的分析结果。
     """
-    response1, conversation_history = chat(generate_prompt(srt, tree1), conversation_history)
-    response2,_ = chat(prompt3, conversation_history)
-    response = extract_json_from_string(response2)
-    return response
\ No newline at end of file
+    conversation_history = generate_prompt(srt, tree1)
+    response1 = chat_completion(list(conversation_history), route=route)
+    conversation_history.append({"role": "assistant", "content": response1})
+    conversation_history.append({"role": "user", "content": prompt3})
+    # 分块生成时各块的章节按块的起始时间排列
+    chunk_start = srt.starts[0] if getattr(srt, 'starts', None) else 0
+    on_element = element_handler('new_outline', ('章节',), CHAPTER_SCHEMA,
+                                 summarize=lambda chapter: chapter.get('章节名'),
+                                 key=lambda index, chapter: (chunk_start, index))
+    return chat_json(conversation_history, OUTLINE_SCHEMA, on_element=on_element, route=route)
+
+def generate_outline_chunked(srt, tree1, max_tokens=None, max_workers=None):
+    """
+    分块生成新教案：在主题边界处切分字幕，每块只附带讲解时间与之重叠的图谱节点，
+    各块并发生成章节后按时间顺序拼接。有块在重试后仍失败时与不分块时一样返回 None，
+    不返回缺少部分章节的教案。
+    """
+    max_tokens = max_tokens or int(os.getenv('outline_chunk_tokens', '12000')) // 2
+    max_workers = max_workers or int(os.getenv('llm_max_concurrency', '4'))
+    chunks = pack_segments(srt, segment_topics(srt), max_tokens)
+
+    def build(chunk):
+        return outline(chunk, select_subtree(tree1, chunk.starts[0], chunk.ends[-1]), route='outline_chunk')
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as executor:
+        parts = list(executor.map(run_in_context(build), chunks))
+
+    add_metric('outline_chunks', len(chunks))
+    failed = [i + 1 for i, part in enumerate(parts) if not part]
+    if failed:
+        add_metric('outline_chunks_failed', len(failed))
+        print(f"新教案第 {failed} 段（共 {len(chunks)} 段）生成失败")
+        return None
+    return {
+        "课程名称": (tree1 or {}).get('name') or parts[0].get("课程名称", ""),
+        "章节": [chapter for part in parts for chapter in part.get("章节", [])]
+    }
+
+def generate_outline(srt, tree1, chunked=None):
+    """chunked: 是否分块生成，默认在字幕编码后估计 token 数超过 outline_chunk_tokens 时分块"""
+    if chunked is None:
+        threshold = int(os.getenv('outline_chunk_tokens', '12000'))
+        chunked = (not isinstance(srt, str) and threshold > 0
+                   and estimate_tokens(encode_transcript(srt)) > threshold)
+    if chunked:
+        return generate_outline_chunked(srt, tree1)
+    return outline(srt, tree1)
@@ -0,0 +1,28 @@
+from .transcript import transcript_for_prompt
+
+# 同一任务中各次调用共用的系统提示词和字幕标题，保证请求开头逐字相同
+SYSTEM_PROMPT = "你是一个教育专家"
+TRANSCRIPT_HEADER = "教学内容如下（每行为一段字幕，格式为[开始时间-结束时间] 文本）："
+TREE_HEADER = "图谱内容如下："
+
+
+def context_messages(transcript, sections=(), instruction=""):
+    """
+    按 [系统提示词, 字幕, 其他共享内容..., 任务说明] 的顺序组织请求。
+    同一任务的视频图谱、报告各项分析和新教案都先发送完全相同的系统提示词和字幕，
+    图谱等共享内容紧随其后，各次调用不同的任务说明放在最后，
+    这样模型服务可以复用相同前缀的缓存，减少首字延迟和输入 token 费用。
+
+    参数:
+        transcript: 字幕（字幕轨、字典列表或已编码的文本）
+        sections: [(标题, 内容), ...]，按共享程度从高到低排列
+        instruction: 本次调用的任务说明
+    """
+    text = transcript if isinstance(transcript, str) else transcript_for_prompt(transcript)
+    parts = [f"{TRANSCRIPT_HEADER}\n{text}"]
+    parts += [f"{title}\n{content}" for title, content in sections]
+    parts.append(instruction)
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": "\n\n".join(parts)},
+    ]
@@ -0,0 +1,169 @@
+import os
+import time
+import random
+import functools
+from .task_context import current_context, add_metric
+
+# 可以重试的 HTTP 状态码：超时、冲突、限流和服务端错误
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+# 这些异常说明输入或代码有误，重试也不会成功
+FATAL_ERRORS = (ValueError, TypeError, KeyError, IndexError, AttributeError,
+                NotImplementedError, FileNotFoundError, PermissionError, NotADirectoryError, IsADirectoryError)
+# 按类名识别 openai / httpx / requests 的网络异常，避免在这里引入这些依赖
+RETRYABLE_NAMES = {'APITimeoutError', 'APIConnectionError', 'RateLimitError', 'InternalServerError',
+                   'ConnectTimeout', 'ReadTimeout', 'ConnectError', 'RemoteProtocolError',
+                   'Timeout', 'ConnectionError', 'ChunkedEncodingError'}
+
+_RAISE = object()
+
+
+def _status_code(exc):
+    status = getattr(exc, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(exc, 'response', None), 'status_code', None)
+    return status if isinstance(status, int) else None
+
+
+def retry_after_seconds(exc):
+    """服务端通过 Retry-After 指定的等待秒数"""
+    headers = getattr(getattr(exc, 'response', None), 'headers', None)
+    try:
+        return float(headers.get('retry-after')) if headers else None
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(exc):
+    """
+    判断异常是否值得重试：网络异常、超时、限流和 5xx 可以重试；
+    参数、格式、鉴权等错误以及已由内层重试用尽的异常直接失败；
+    需要整个步骤重新排队的异常（requeue_stage）也不在调用处重试。
+    """
+    if getattr(exc, 'retry_exhausted', False) or getattr(exc, 'requeue_stage', False):
+        return False
+    status = _status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS or status >= 500
+    if any(cls.__name__ in RETRYABLE_NAMES for cls in type(exc).__mro__):
+        return True
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    return not isinstance(exc, FATAL_ERRORS)
+
+
+class RetryPolicy:
+    """
+    重试策略：最多 max_attempts 次调用，第 n 次重试前等待
+    min(max_delay, base_delay × multiplier^(n-1))，并按 jitter 比例随机缩短，避免并发任务同时重试。
+    未指定的参数读取配置 retry_max_attempts / retry_base_delay / retry_max_delay。
+    """
+
+    def __init__(self, max_attempts=None, base_delay=None, max_delay=None, multiplier=2.0, jitter=0.5):
+        self.max_attempts = max_attempts if max_attempts is not None else int(os.getenv('retry_max_attempts', '3'))
+        self.base_delay = base_delay if base_delay is not None else float(os.getenv('retry_base_delay', '1'))
+        self.max_delay = max_delay if max_delay is not None else float(os.getenv('retry_max_delay', '30'))
+        self.multiplier = multiplier
+        self.jitter = jitter
+
+    def delay(self, retry_index, exc=None):
+        """第 retry_index 次（从 1 开始）重试前的等待秒数，服务端给出 Retry-After 时以其为准"""
+        retry_after = retry_after_seconds(exc) if exc is not None else None
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** (retry_index - 1))
+        return delay * (1 - self.jitter * random.random())
+
+
+def consume_retry_budget():
+    """
+    在当前任务的重试预算内登记一次重试，预算用尽时返回 False。
+    每个任务最多 retry_budget_task 次、每个步骤最多 retry_budget_stage 次，小于 0 表示不限。
+    """
+    context = current_context()
+    if context is None:
+        return True
+    return context.consume_retry(int(os.getenv('retry_budget_task', '20')),
+                                 int(os.getenv('retry_budget_stage', '8')))
+
+
+def retry_call(func, *args, policy=None, **kwargs):
+    """
+    按重试策略调用 func，可重试的异常在退避后重试，直到成功、次数用尽、预算用尽或遇到不可重试的异常。
+    最终失败时抛出最后一次的异常，并标记为已重试用尽，外层的重试不会再重复调用。
+    """
+    policy = policy or RetryPolicy()
+    name = getattr(func, '__name__', 'call')
+    for attempt in range(1, policy.max_attempts + 1):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if not is_retryable(e):
+                if not (getattr(e, 'retry_exhausted', False) or getattr(e, 'requeue_stage', False)):
+                    add_metric('retry_fatal')
+                raise
+            if attempt == policy.max_attempts or not consume_retry_budget():
+                add_metric('retry_exhausted')
+                print(f"函数 {name} 最终失败: {e}")
+                e.retry_exhausted = True
+                raise
+            wait = policy.delay(attempt, e)
+            add_metric('retry_wait_seconds', round(wait, 3))
+            print(f"函数 {name} 第{attempt}次失败: {e}，{wait:.1f} 秒后重试...")
+            time.sleep(wait)
+
+
+def retry(max_attempts=None, policy=None, default=_RAISE):
+    """
+    重试装饰器。default: 指定时最终失败后返回该值而不抛出异常，用于结果可缺省的步骤；
+    需要整个步骤重新排队的异常总是抛出。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return retry_call(func, *args, policy=policy or RetryPolicy(max_attempts), **kwargs)
+            except Exception as e:
+                if default is _RAISE or getattr(e, 'requeue_stage', False):
+                    raise
+                return default
+        return wrapper
+    return decorator
+
+
+class StageRequeuedError(RuntimeError):
+    """
+    步骤因服务整体不可用而交还调度：任务结束本次运行（已完成步骤的结果保存在 checkpoint.json 中），
+    由调用方在 retry_at 之后重新运行任务，从该步骤继续，见 tools.background_loop.call_later。
+    """
+    requeue_stage = True
+    task_requeued = True
+
+    def __init__(self, message, retry_at):
+        super().__init__(message)
+        self.retry_at = retry_at
+
+
+def run_requeueable(func, *args, max_requeues=None, **kwargs):
+    """
+    执行一个步骤；步骤因服务整体不可用而快速失败（异常带 requeue_stage 和 retry_at）时，
+    不在任务线程中等待，而是抛出 StageRequeuedError 把步骤交还调度，服务预计恢复后重新运行。
+    每个步骤最多交还 llm_stage_requeues 次（默认 3），次数记录为当前步骤的 stage_requeues，
+    随进度日志在任务的各次运行之间累计；没有任务上下文时无法重新运行，直接抛出原异常。
+    批量模式下等待批次结果的步骤（batch_pending）同样直接抛出。
+    """
+    if max_requeues is None:
+        max_requeues = int(os.getenv('llm_stage_requeues', '3'))
+    try:
+        return func(*args, **kwargs)
+    except Exception as e:
+        if (not getattr(e, 'requeue_stage', False) or getattr(e, 'batch_pending', False)
+                or getattr(e, 'task_requeued', False)):
+            raise
+        context = current_context()
+        if context is None or context.get('stage_requeues') >= max_requeues:
+            raise
+        retry_at = max(getattr(e, 'retry_at', 0), time.time() + 1.0)
+        context.add('stage_requeues')
+        wait = retry_at - time.time()
+        print(f"{e}，步骤 {getattr(func, '__name__', '')} 交还调度，{wait:.0f} 秒后重新执行")
+        raise StageRequeuedError(f"{e}，任务将在 {wait:.0f} 秒后从当前步骤继续", retry_at) from e
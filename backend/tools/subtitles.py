@@ -0,0 +1,132 @@
+from array import array
+from collections.abc import Sequence
+
+
+def format_srt_time(ms):
+    """毫秒 -> SRT 时间字符串 HH:MM:SS,mmm"""
+    return f"{ms // 3600000:02d}:{(ms % 3600000) // 60000:02d}:{(ms % 60000) // 1000:02d},{ms % 1000:03d}"
+
+
+def parse_srt_time(time_str):
+    """SRT 时间字符串 HH:MM:SS,mmm -> 毫秒"""
+    hms, _, millis = time_str.strip().partition(',')
+    hours, minutes, seconds = hms.split(':')
+    return ((int(hours) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + int(millis or 0)
+
+
+class SubtitleTrack(Sequence):
+    """
+    紧凑的字幕容器：起止时间以毫秒整数存放在数组中，说话人去重后以编号存放，每条文本只存一份。
+    按下标访问时才生成原有的 {'id','start','end','content','speaker'} 字典，
+    str() 与原字典列表的输出一致，可直接替换原来的字幕列表。
+    """
+
+    __slots__ = ('starts', 'ends', 'speaker_ids', 'speakers', 'texts', '_speaker_index')
+
+    def __init__(self):
+        self.starts = array('q')
+        self.ends = array('q')
+        self.speaker_ids = array('i')
+        self.speakers = ['']  # 编号 0 表示未区分说话人
+        self.texts = []
+        self._speaker_index = {'': 0}
+
+    def _speaker_id(self, speaker):
+        speaker_id = self._speaker_index.get(speaker)
+        if speaker_id is None:
+            speaker_id = self._speaker_index[speaker] = len(self.speakers)
+            self.speakers.append(speaker)
+        return speaker_id
+
+    def append(self, start_ms, end_ms, text, speaker=''):
+        self.starts.append(start_ms)
+        self.ends.append(end_ms)
+        self.speaker_ids.append(self._speaker_id(speaker))
+        self.texts.append(text)
+
+    def extend(self, other):
+        """追加另一条字幕轨（如分段转录的下一段），说话人编号重新映射"""
+        remap = array('i', (self._speaker_id(speaker) for speaker in other.speakers))
+        self.starts.extend(other.starts)
+        self.ends.extend(other.ends)
+        self.speaker_ids.extend(remap[i] for i in other.speaker_ids)
+        self.texts.extend(other.texts)
+        return self
+
+    @classmethod
+    def from_order_result(cls, data, offset_ms=0, time_map=None):
+        """
+        一次遍历讯飞 orderResult 的 lattice2 构建字幕。
+        time_map: 去除静音后的时间映射（OffsetMap），先于 offset_ms 应用
+        """
+        track = cls()
+        for lattice in data.get('lattice2', []):
+            begin = int(lattice['begin'])
+            end = int(lattice['end'])
+            if time_map is not None:
+                begin, end = time_map.to_original(begin), time_map.to_original(end, is_end=True)
+            best = lattice['json_1best']['st']
+            text = ''.join(word['w']
+                           for segment in best['rt']
+                           for word_segment in segment['ws']
+                           for word in word_segment['cw'])
+            # 开启角色分离时 rl 为说话人编号，未开启时为 0
+            role = str(best.get('rl', ''))
+            track.append(begin + offset_ms, end + offset_ms, text, '' if role in ('', '0') else role)
+        return track
+
+    @classmethod
+    def from_dicts(cls, subtitles):
+        """从原有的字幕字典列表（如 result.json 中保存的字幕）构建"""
+        track = cls()
+        for item in subtitles:
+            track.append(parse_srt_time(item['start']), parse_srt_time(item['end']),
+                         item.get('content', ''), item.get('speaker', ''))
+        return track
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            track = SubtitleTrack()
+            for i in range(*index.indices(len(self))):
+                track.append(self.starts[i], self.ends[i], self.texts[i], self.speakers[self.speaker_ids[i]])
+            return track
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('字幕下标越界')
+        return {
+            'id': str(index + 1),
+            'start': format_srt_time(self.starts[index]),
+            'end': format_srt_time(self.ends[index]),
+            'content': self.texts[index],
+            'speaker': self.speakers[self.speaker_ids[index]],
+        }
+
+    def speaker(self, index):
+        return self.speakers[self.speaker_ids[index]]
+
+    def start_seconds(self, index):
+        return self.starts[index] / 1000
+
+    def end_seconds(self, index):
+        return self.ends[index] / 1000
+
+    def to_dicts(self):
+        """转换为原有的字幕字典列表，用于保存结果"""
+        return [self[i] for i in range(len(self))]
+
+    def to_srt(self):
+        """生成标准 SRT 文本"""
+        blocks = []
+        for i, text in enumerate(self.texts):
+            blocks.append(f"{i + 1}\n{format_srt_time(self.starts[i])} --> {format_srt_time(self.ends[i])}\n{text}\n")
+        return "\n".join(blocks)
+
+    def __str__(self):
+        return str(self.to_dicts())
+
+    def __repr__(self):
+        return f"<SubtitleTrack {len(self)} 条>"
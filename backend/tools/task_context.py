@@ -0,0 +1,138 @@
+import time
+import threading
+import functools
+
+# 每个分析线程绑定一个任务上下文，工具函数通过它把指标记录到当前任务的当前步骤下
+_local = threading.local()
+
+# 任务优先级，数值越小越优先：交互式分析任务优先于批量补跑任务
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+
+
+class TaskContext:
+    """单个分析任务的运行上下文：记录当前步骤，并按步骤汇总各项指标"""
+
+    def __init__(self, task_id=None, priority=PRIORITY_INTERACTIVE):
+        self.task_id = task_id
+        self.priority = priority
+        self.progress = 0.0  # 已完成步骤的比例，进度靠后的任务在排队时优先
+        self.stage = None  # 当前步骤名称
+        self.stage_started = None
+        self.stage_metrics = {}  # {步骤名称: {指标名: 值}}
+        self.retries = 0  # 整个任务已进行的重试次数
+        self.partial_results = {}  # 流式生成中已完成的部分结果 {名称: {键: 值}}
+        self.batch = False  # 批量模式：模型调用通过批量接口执行，见 tools.llm_batch
+        self._lock = threading.Lock()
+
+    def set_stage(self, stage):
+        """切换当前步骤，并记录上一步骤的实际耗时"""
+        now = time.time()
+        with self._lock:
+            if self.stage is not None and self.stage_started is not None:
+                metrics = self.stage_metrics.setdefault(self.stage, {})
+                metrics['wall_seconds'] = round(metrics.get('wall_seconds', 0) + now - self.stage_started, 3)
+            self.stage = stage
+            self.stage_started = now
+
+    def finish(self):
+        """任务结束时结算最后一个步骤的耗时"""
+        self.set_stage(None)
+
+    def set(self, key, value, stage=None):
+        """设置指标值（覆盖）"""
+        with self._lock:
+            self.stage_metrics.setdefault(stage or self.stage or '未知步骤', {})[key] = value
+
+    def add(self, key, value=1, stage=None, digits=3):
+        """累加指标值，小数保留 digits 位"""
+        with self._lock:
+            metrics = self.stage_metrics.setdefault(stage or self.stage or '未知步骤', {})
+            total = metrics.get(key, 0) + value
+            metrics[key] = round(total, digits) if isinstance(total, float) else total
+
+    def get(self, key, default=0, stage=None):
+        """读取当前步骤（或指定步骤）的指标值"""
+        with self._lock:
+            return self.stage_metrics.get(stage or self.stage or '未知步骤', {}).get(key, default)
+
+    def restore(self, stage_metrics):
+        """任务重新运行时恢复上次运行记录的指标，之后的指标在其基础上累加，重试次数也一并计入预算"""
+        with self._lock:
+            self.stage_metrics = {stage: dict(metrics) for stage, metrics in (stage_metrics or {}).items()}
+            self.retries = sum(metrics.get('retries', 0) for metrics in self.stage_metrics.values())
+
+    def consume_retry(self, task_budget, stage_budget, stage=None):
+        """在任务和步骤的重试预算内登记一次重试，预算用尽时返回 False；预算小于 0 表示不限"""
+        with self._lock:
+            metrics = self.stage_metrics.setdefault(stage or self.stage or '未知步骤', {})
+            stage_retries = metrics.get('retries', 0)
+            if (0 <= task_budget <= self.retries) or (0 <= stage_budget <= stage_retries):
+                metrics['retries_denied'] = metrics.get('retries_denied', 0) + 1
+                return False
+            self.retries += 1
+            metrics['retries'] = stage_retries + 1
+            return True
+
+    def scheduling_key(self):
+        """模型调用排队时的优先级：先按任务优先级，再让接近完成的任务先执行"""
+        return (self.priority, -round(self.progress, 2))
+
+    def set_partial(self, name, key, value):
+        """发布一项已完成的部分结果（如已生成的知识单元），同一键重复发布时覆盖"""
+        with self._lock:
+            self.partial_results.setdefault(name, {})[key] = value
+
+    def partial_snapshot(self):
+        """按键排序的部分结果，可直接写入 json"""
+        with self._lock:
+            return {name: [items[key] for key in sorted(items)] for name, items in self.partial_results.items()}
+
+    def snapshot(self):
+        """返回可直接写入 json 的指标副本"""
+        with self._lock:
+            return {stage: dict(metrics) for stage, metrics in self.stage_metrics.items()}
+
+
+def bind_context(context):
+    """将任务上下文绑定到当前线程"""
+    _local.context = context
+
+
+def unbind_context():
+    _local.context = None
+
+
+def current_context():
+    """获取当前线程绑定的任务上下文，未绑定时返回 None"""
+    return getattr(_local, 'context', None)
+
+
+def record_metric(key, value, stage=None):
+    """在当前任务的当前步骤下记录指标，没有任务上下文时忽略"""
+    context = current_context()
+    if context is not None:
+        context.set(key, value, stage)
+
+
+def add_metric(key, value=1, stage=None):
+    """在当前任务的当前步骤下累加指标，没有任务上下文时忽略"""
+    context = current_context()
+    if context is not None:
+        context.add(key, value, stage)
+
+
+def run_in_context(func):
+    """包装函数，使其在线程池的工作线程中也记录到调用方的任务上下文"""
+    context = current_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = current_context()
+        bind_context(context)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            bind_context(previous)
+    return wrapper
@@ -0,0 +1,173 @@
+import math
+import numpy as np
+from .transcript import as_track, estimate_tokens, format_clock
+
+# 字符 n-gram 哈希到的向量维度
+HASH_DIMS = 4096
+
+
+def _build_blocks(track, block_chars):
+    """将相邻字幕合并为字数约为 block_chars 的文本块，返回每块的 (起始字幕下标, 结束字幕下标)"""
+    blocks = []
+    start = 0
+    chars = 0
+    for i, text in enumerate(track.texts):
+        chars += len(text)
+        if chars >= block_chars:
+            blocks.append((start, i + 1))
+            start, chars = i + 1, 0
+    if start < len(track):
+        blocks.append((start, len(track)))
+    return blocks
+
+
+def _ngram_vectors(track, blocks, n=2, dims=HASH_DIMS):
+    """
+    每个文本块的字符 n-gram 词频向量（哈希到 dims 维），按 idf 加权后行归一化前的矩阵。
+    n-gram 由相邻字符的码点组合计算哈希，整个过程向量化，不逐个生成字符串。
+    """
+    matrix = np.zeros((len(blocks), dims), dtype=np.float32)
+    for row, (start, end) in enumerate(blocks):
+        text = ''.join(ch for ch in ''.join(track.texts[start:end]) if ch.isalnum())
+        codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+        if len(codes) < n:
+            continue
+        hashed = codes[:len(codes) - n + 1].copy()
+        for k in range(1, n):
+            hashed = hashed * np.uint64(1000003) + codes[k:len(codes) - n + 1 + k]
+        matrix[row] = np.bincount((hashed % np.uint64(dims)).astype(np.int64), minlength=dims)
+    # 在多数块中都出现的 n-gram（口头禅、虚词）区分度低，按 idf 降权
+    document_freq = (matrix > 0).sum(axis=0)
+    idf = np.log((len(blocks) + 1) / (document_freq + 1)).astype(np.float32)
+    return matrix * idf
+
+
+def _gap_similarity(vectors, window):
+    """第 g 个间隙两侧各 window 个块的词汇相似度（余弦），用前缀和向量化计算窗口和"""
+    prefix = np.vstack([np.zeros((1, vectors.shape[1]), dtype=np.float32), np.cumsum(vectors, axis=0)])
+    gaps = np.arange(1, len(vectors))
+    left_lo = np.maximum(gaps - window, 0)
+    right_hi = np.minimum(gaps + window, len(vectors))
+    left = prefix[gaps] - prefix[left_lo]
+    right = prefix[right_hi] - prefix[gaps]
+    norms = np.linalg.norm(left, axis=1) * np.linalg.norm(right, axis=1)
+    return np.einsum('ij,ij->i', left, right) / np.where(norms > 0, norms, 1)
+
+
+def _depth_scores(similarity):
+    """TextTiling 深度分数：间隙相似度与两侧最近峰值之差的和"""
+    depth = np.zeros_like(similarity)
+    for g in range(len(similarity)):
+        left = g
+        while left > 0 and similarity[left - 1] >= similarity[left]:
+            left -= 1
+        right = g
+        while right < len(similarity) - 1 and similarity[right + 1] >= similarity[right]:
+            right += 1
+        depth[g] = similarity[left] + similarity[right] - 2 * similarity[g]
+    return depth
+
+
+def segment_topics(subtitles, block_chars=120, window=4, min_segment_seconds=180):
+    """
+    基于词汇连贯性（TextTiling）的主题切分：相邻文本块的字符 n-gram 相似度出现明显低谷的位置视为主题边界。
+
+    返回:
+        [{'start_index', 'end_index', 'start_ms', 'end_ms', 'start', 'end'}, ...]
+        start_index/end_index 为字幕下标（左闭右开），start/end 为 HH:MM:SS
+    """
+    track = as_track(subtitles)
+    if not len(track):
+        return []
+    blocks = _build_blocks(track, block_chars)
+
+    boundaries = []
+    if len(blocks) > 2:
+        similarity = _gap_similarity(_ngram_vectors(track, blocks), window)
+        if len(similarity) >= 3:
+            similarity = np.convolve(similarity, np.ones(3) / 3, mode='same')  # 平滑
+        depth = _depth_scores(similarity)
+        cutoff = depth.mean() - depth.std() / 2
+        # 按深度从大到小选择边界，距已选边界过近（短于 min_segment_seconds）的跳过
+        for g in np.argsort(-depth):
+            if depth[g] <= cutoff or depth[g] <= 0:
+                break
+            index = blocks[g + 1][0]
+            position = track.starts[index]
+            edges = [0] + [track.starts[b] for b in boundaries] + [track.ends[-1]]
+            if all(abs(position - edge) >= min_segment_seconds * 1000 for edge in edges):
+                boundaries.append(index)
+        boundaries.sort()
+
+    bounds = [0] + boundaries + [len(track)]
+    return [{
+        'start_index': start,
+        'end_index': end,
+        'start_ms': track.starts[start],
+        'end_ms': track.ends[end - 1],
+        'start': format_clock(track.starts[start]),
+        'end': format_clock(track.ends[end - 1]),
+    } for start, end in zip(bounds, bounds[1:])]
+
+
+def _span_tokens(track, start, end):
+    return estimate_tokens(''.join(track.texts[start:end]))
+
+
+def _split_by_time(track, start, end, pieces):
+    """将字幕下标区间 [start, end) 按等长时间窗口切成最多 pieces 段，切分点落在字幕之间"""
+    window = (track.starts[end - 1] - track.starts[start]) / pieces
+    spans = []
+    span_start = start
+    for i in range(start + 1, end):
+        if len(spans) < pieces - 1 and window > 0 and track.starts[i] - track.starts[span_start] >= window:
+            spans.append((span_start, i))
+            span_start = i
+    spans.append((span_start, end))
+    return spans
+
+
+def pack_segments(subtitles, segments, max_tokens):
+    """
+    将相邻主题段合并为估计 token 数不超过 max_tokens 的块，供分块调用模型使用。
+    单个主题段超出上限时（如没有找到主题边界）按时间窗口切分后再合并。
+
+    返回:
+        若干 SubtitleTrack
+    """
+    track = as_track(subtitles)
+    spans = []
+    for segment in segments:
+        start, end = segment['start_index'], segment['end_index']
+        tokens = _span_tokens(track, start, end)
+        if tokens > max_tokens > 0:
+            spans.extend((s, e, _span_tokens(track, s, e))
+                         for s, e in _split_by_time(track, start, end, math.ceil(tokens / max_tokens)))
+        else:
+            spans.append((start, end, tokens))
+
+    chunks = []
+    chunk_start = None
+    chunk_tokens = 0
+    for start, end, tokens in spans:
+        if chunk_start is not None and chunk_tokens + tokens > max_tokens:
+            chunks.append(track[chunk_start:start])
+            chunk_start, chunk_tokens = None, 0
+        if chunk_start is None:
+            chunk_start = start
+        chunk_tokens += tokens
+    if chunk_start is not None:
+        chunks.append(track[chunk_start:len(track)])
+    return chunks
+
+
+def topic_digest(subtitles, segments=None, head_chars=120):
+    """用各主题段的时间范围和开头文字概括整段字幕，用于只需要整体结构的提示词"""
+    track = as_track(subtitles)
+    segments = segments if segments is not None else segment_topics(track)
+    lines = []
+    for segment in segments:
+        text = ''.join(track.texts[segment['start_index']:segment['end_index']])
+        suffix = '……' if len(text) > head_chars else ''
+        lines.append(f"[{segment['start']}-{segment['end']}] {text[:head_chars]}{suffix}")
+    return "\n".join(lines)
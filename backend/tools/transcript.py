@@ -0,0 +1,117 @@
+import re
+from .subtitles import SubtitleTrack, format_srt_time
+from .task_context import add_metric
+
+# 句末标点，合并字幕时优先在这些位置断开
+SENTENCE_END = '。！？!?；;…'
+
+_CJK = re.compile(r'[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]')
+_WORD = re.compile(r'[A-Za-z0-9]+|[^\sA-Za-z0-9\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+
+def estimate_tokens(text):
+    """
+    粗略估计文本的 token 数：中文字符及全角标点约 0.7 token/字，
+    英文单词和数字约 1.3 token/个，其余符号各 1 token。用于比较不同编码方式的提示词长度。
+    """
+    cjk = len(_CJK.findall(text))
+    tokens = 0.0
+    for match in _WORD.findall(text):
+        tokens += 1.3 if match[0].isalnum() else 1
+    return int(cjk * 0.7 + tokens)
+
+
+def format_clock(ms):
+    """毫秒 -> HH:MM:SS，提示词中只保留到秒"""
+    seconds = ms // 1000
+    return f"{seconds // 3600:02d}:{(seconds % 3600) // 60:02d}:{seconds % 60:02d}"
+
+
+def as_track(subtitles):
+    """兼容字幕字典列表和 SubtitleTrack"""
+    if isinstance(subtitles, SubtitleTrack):
+        return subtitles
+    return SubtitleTrack.from_dicts(subtitles)
+
+
+def merge_blocks(track, max_block_seconds=60, max_block_chars=300):
+    """
+    将相邻字幕合并为段落块：块时长或字数达到上限后，在下一个句末标点处断开；
+    超过上限两倍时强制断开；说话人变化时总是断开。
+
+    返回:
+        [(开始毫秒, 结束毫秒, 说话人, 文本), ...]
+    """
+    blocks = []
+    start = end = None
+    speaker = None
+    parts = []
+    chars = 0
+
+    def flush():
+        if parts:
+            blocks.append((start, end, speaker, ''.join(parts)))
+
+    for i in range(len(track)):
+        text = track.texts[i]
+        if not text:
+            continue
+        current_speaker = track.speaker(i)
+        if parts and current_speaker != speaker:
+            flush()
+            parts, chars = [], 0
+        if not parts:
+            start, speaker = track.starts[i], current_speaker
+        parts.append(text)
+        chars += len(text)
+        end = track.ends[i]
+
+        duration = (end - start) / 1000
+        over_limit = duration >= max_block_seconds or chars >= max_block_chars
+        hard_limit = duration >= 2 * max_block_seconds or chars >= 2 * max_block_chars
+        if (over_limit and text[-1] in SENTENCE_END) or hard_limit:
+            flush()
+            parts, chars = [], 0
+    flush()
+    return blocks
+
+
+def encode_transcript(subtitles, max_block_seconds=60, max_block_chars=300):
+    """
+    将字幕编码为紧凑的提示词文本，每行一个段落块：
+        [00:03:28-00:04:31] 文本
+    区分说话人时在时间后加上说话人编号。相比直接拼接字幕字典，
+    省去了每条字幕重复的键名和毫秒时间戳。
+    """
+    if isinstance(subtitles, str):
+        return subtitles
+    lines = []
+    for start, end, speaker, text in merge_blocks(as_track(subtitles), max_block_seconds, max_block_chars):
+        prefix = f"[{format_clock(start)}-{format_clock(end)}]"
+        if speaker:
+            prefix += f" 说话人{speaker}:"
+        lines.append(f"{prefix} {text}")
+    return "\n".join(lines)
+
+
+def estimate_raw_tokens(track):
+    """
+    估计直接拼接字幕字典列表（str(字幕)）的 token 数，不生成完整字符串：
+    每条字幕的键名、时间戳等固定部分按一条样例计算（含列表中的分隔符），再加上各条文本和说话人的 token 数。
+    """
+    if not len(track):
+        return 0
+    item = str({'id': '1', 'start': format_srt_time(0), 'end': format_srt_time(0), 'content': '', 'speaker': ''})
+    speaker_tokens = [estimate_tokens(speaker) for speaker in track.speakers]
+    return ((estimate_tokens(item) + 1) * len(track) + 1
+            + sum(estimate_tokens(text) for text in track.texts)
+            + sum(speaker_tokens[speaker_id] for speaker_id in track.speaker_ids))
+
+
+def transcript_for_prompt(subtitles, **kwargs):
+    """生成提示词用的字幕文本，并在当前步骤记录编码前后的估计 token 数"""
+    encoded = encode_transcript(subtitles, **kwargs)
+    if not isinstance(subtitles, str):
+        add_metric('transcript_tokens_raw', estimate_raw_tokens(as_track(subtitles)))
+        add_metric('transcript_tokens_encoded', estimate_tokens(encoded))
+    return encoded
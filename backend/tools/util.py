@@ -1,72 +1,168 @@
 import json
 import os
-from openai import OpenAI
 import re
 import time
-from functools import wraps
 from dotenv import load_dotenv
+from .subtitles import parse_srt_time
+from .json_repair import extract_json, parse_json_output, is_valid_json_output, compile_schema, JsonFormatError
+from .task_context import add_metric, current_context
+from .retry import retry, retry_call, RetryPolicy
+from .llm_cache import cached_completion, discard_completion
+from .llm_gateway import get_llm_gateway
+from .llm_router import get_llm_router
+from .llm_batch import get_batch_collector
+from .json_stream import JsonStreamParser
 
 load_dotenv()  # 加载.env文件
-api_key = os.getenv("api_key")  # 安全获取密钥
-base_url = "https://dashscope.aliyuncs.com/compatible-mode/v1"
 
-os.environ["OPENAI_API_KEY"]  =  api_key
+def chat_completion(messages, model=None, temperature=None, cache=True, hedge=False, accept=None, stream=None,
+                    route=None):
+    """
+    所有模型调用的统一入口（经 tools.llm_gateway 共用的连接池发送），返回回复文本。相同的 (模型, 消息, 温度, 提示词版本) 直接返回缓存结果。
+    cache=False 时跳过缓存读取，强制重新请求。
+    hedge/accept: 关键路径上的调用开启请求对冲，accept 判断回复是否合格，见 LLMGateway.acomplete
+    stream: 创建流式消费者的函数，指定时以流式方式接收输出并逐块交给消费者
+    route: 路由名称（见 tools.llm_router），未指定 model 时按路由表和提示词规模选择模型，耗时计入该路由的统计
+    批量模式的任务（TaskContext.batch）未命中缓存时不发送请求，而是加入待提交的批次并抛出 BatchPendingError。
+    """
+    router = get_llm_router()
+    route = route or 'default'
+    model = model or router.select(route, messages)
 
+    def call():
+        context = current_context()
+        if context is not None and context.batch:
+            raise get_batch_collector().defer(model, messages, temperature)
+        start_time = time.time()
+        try:
+            reply = get_llm_gateway().complete(messages, model, temperature, hedge, accept, stream)
+        except JsonFormatError:
+            raise  # 流式输出格式有误而中止，计入格式质量而不是请求错误
+        except Exception:
+            router.stats.record_request(route, model, time.time() - start_time, ok=False)
+            raise
+        router.stats.record_request(route, model, time.time() - start_time)
+        return reply
 
-client = OpenAI(
-  api_key= api_key,
-  base_url= base_url
-)
+    return cached_completion(model, messages, call, temperature, cache)
 
-def get_response(prompt):
-  response = client.chat.completions.create(
-    messages=[
+def get_response(prompt, cache=True):
+  return chat_completion([
             {"role": "system", "content": "You are a helpful assistant."},
             {"role": "user", "content": prompt}
-    ],
-    model="qwen-plus",
-)
-  return response.choices[0].message.content
+    ], cache=cache)
   
 def extract_json_from_string(input_string):
-    # 使用正则表达式匹配JSON部分
-    json_pattern = r"```json\n(.*?)```"
-    match = re.search(json_pattern, input_string, re.DOTALL)
-
-    if match:
-        json_str = match.group(1).strip()
-        # 转换为JSON对象
-        json_data = json.loads(json_str)
+    # 提取模型输出中的JSON部分，格式不规范时先在本地修复；仍无法解析时返回 None
+    try:
+        json_data, _ = extract_json(input_string)
         return json_data
-    else:
+    except JsonFormatError:
         return None
+
+def chat_json(messages, validator=None, model=None, max_reprompts=None, cache=True, hedge=False,
+              on_element=None, route=None, temperature=None):
+    """
+    调用模型并解析 json 结果：先在本地修复格式并按 validator 校验，
+    只有修复后仍不合格时才把错误说明发回模型重新生成，最多 llm_json_reprompts 次（默认 1）。
+    每次重新生成只携带原始对话、上一次的输出和错误说明，对话不会越来越长。
+    批量模式下不合格的输出先留在缓存中，使重新生成的对话在各轮之间保持不变、能取到批次结果，
+    全部次数用尽仍不合格时才删除。
+
+    参数:
+        messages: 提示词字符串或消息列表
+        validator: compile_schema 生成的校验函数
+        hedge: 是否对这次调用开启请求对冲（用于关键路径上的调用）
+        on_element: 指定时以流式方式接收输出（配置 llm_stream=off 时关闭），对象或数组每闭合一个
+                    （深度不超过 2）就调用 on_element(路径, 值)；它可以提前发布已完成的部分，
+                    也可以抛出 JsonFormatError 提前中止不合格的生成
+        route: 路由名称，见 chat_completion；重新生成时使用路由 json_repair 选择模型
+        temperature: 采样温度，未指定时使用模型服务的默认值
+    返回:
+        解析后的数据；超过次数仍不合格时抛出 JsonFormatError
+    """
+    if isinstance(messages, str):
+        messages = [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": messages}
+        ]
+    if max_reprompts is None:
+        max_reprompts = int(os.getenv('llm_json_reprompts', '1'))
+    stream = None
+    if on_element is not None and os.getenv('llm_stream', 'on') != 'off':
+        stream = lambda: JsonStreamParser(on_element)
+    router = get_llm_router()
+    route = route or 'default'
+    first_model = model or router.select(route, messages)
+    conversation = list(messages)
+    context = current_context()
+    batch = context is not None and context.batch
+    rejected = []  # 批量模式下暂留在缓存中的不合格输出 [(模型, 对话)]
+    for attempt in range(max_reprompts + 1):
+        attempt_route = route if attempt == 0 else 'json_repair'
+        attempt_model = first_model if attempt == 0 else model or router.select(attempt_route, conversation)
+        try:
+            reply = chat_completion(conversation, model=attempt_model, temperature=temperature, cache=cache, hedge=hedge,
+                                    accept=lambda text: is_valid_json_output(text, validator), stream=stream,
+                                    route=attempt_route)
+            data, repaired = parse_json_output(reply, validator)
+            if repaired:
+                add_metric('llm_json_repaired')
+            if attempt == 0:
+                router.stats.record_quality(route, first_model, 'repaired' if repaired else 'valid')
+            else:
+                router.stats.record_quality(route, first_model, 'reprompted')
+                router.stats.record_quality(attempt_route, attempt_model, 'repaired' if repaired else 'valid')
+            return data
+        except JsonFormatError as e:
+            error = e
+            if hasattr(e, 'partial'):
+                # 流式解析中途发现结构错误，生成已中止
+                add_metric('llm_stream_aborts')
+                reply = e.partial
+            print(f"模型输出格式有误（第{attempt + 1}次）：{e}")
+            if batch:
+                rejected.append((attempt_model, conversation))
+            else:
+                # 不合格的输出不保留在缓存中，避免重新运行任务时再次取到
+                discard_completion(attempt_model, conversation, temperature)
+            if attempt > 0:
+                router.stats.record_quality(attempt_route, attempt_model, 'failed')
+        if attempt < max_reprompts:
+            add_metric('llm_json_reprompts')
+            conversation = list(messages) + [
+                {"role": "assistant", "content": reply},
+                {"role": "user", "content": f"你生成的结果格式有错：{error}。请严格按照给出的示例格式重新生成完整的json结果。"}
+            ]
+    add_metric('llm_json_failures')
+    router.stats.record_quality(route, first_model, 'failed')
+    for rejected_model, rejected_conversation in rejected:
+        discard_completion(rejected_model, rejected_conversation, temperature)
+    raise error
     
-def time2seconds(time_str):
-    # 分割小时、分钟、秒和毫秒
-    time_parts = time_str.split(":")
-    hours = int(time_parts[0])
-    minutes = int(time_parts[1])
-    seconds_milliseconds = time_parts[2].split(",")  # 分割秒和毫秒
-    seconds = int(seconds_milliseconds[0])
-    milliseconds = int(seconds_milliseconds[1])
+def element_handler(name, item_path, validator=None, summarize=None, key=None):
+    """
+    生成 chat_json 的 on_element：只处理 item_path（如 ('child',)）下数组中闭合的元素，
+    先按 validator 校验，不合格时中止生成；再把 summarize(元素) 发布为当前任务的部分结果 name。
+    key(下标, 元素) 决定部分结果的排序，默认按下标。
+    """
+    context = current_context()  # on_element 在后台事件循环中调用，这里先取得调用方的任务上下文
+
+    def on_element(path, value):
+        if path[:-1] != tuple(item_path) or len(path) != len(item_path) + 1:
+            return
+        if validator is not None:
+            errors = validator(value)
+            if errors:
+                raise JsonFormatError(f"第{path[-1] + 1}项结构不符合要求：{'；'.join(errors[:3])}", errors)
+        if context is not None and summarize is not None:
+            context.set_partial(name, key(path[-1], value) if key else path[-1], summarize(value))
+    return on_element
 
-    # 计算总秒数
-    total_seconds = hours * 3600 + minutes * 60 + seconds + milliseconds / 1000.0
-    return total_seconds
+def time2seconds(time_str):
+    # SRT 时间字符串 HH:MM:SS,mmm 转换为秒；新代码可直接使用 SubtitleTrack 中的毫秒时间
+    return parse_srt_time(time_str) / 1000.0
 
 def retry_on_failure(max_retries=3, delay=1):
-    """装饰器：自动重试失败函数"""
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    if attempt == max_retries - 1:
-                        print(f"函数 {func.__name__} 最终失败: {str(e)}")
-                        return None
-                    print(f"函数 {func.__name__} 第{attempt+1}次重试...")
-                    time.sleep(delay)
-        return wrapper
-    return decorator
\ No newline at end of file
+    """装饰器：自动重试失败函数，最终失败时返回 None。新代码请使用 tools.retry 中的 retry"""
+    return retry(policy=RetryPolicy(max_attempts=max_retries, base_delay=delay), default=None)
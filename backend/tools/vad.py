@@ -0,0 +1,235 @@
+import os
+import json
+import time
+import bisect
+import subprocess
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from .media_info import file_signature, get_asr_audio_profile, audio_encode_args
+from .task_context import add_metric, run_in_context
+
+# 语音活动检测统一在 16kHz 单声道 16bit PCM 上进行
+SAMPLE_RATE = 16000
+FRAME_MS = 30
+# 每次从 ffmpeg 读取的帧数（约 30 秒），内存占用与音频总时长无关
+CHUNK_FRAMES = 1000
+
+
+def vad_enabled():
+    """是否在上传前去除静音"""
+    return os.getenv('asr_vad', 'false').lower() in ('1', 'true', 'yes')
+
+
+class OffsetMap:
+    """
+    去除静音后的音频时间（毫秒）到原音频时间（毫秒）的映射。
+    intervals 为按时间顺序保留下来的原音频区间 [(开始毫秒, 结束毫秒), ...]，
+    它们在去除静音后的音频中首尾相接。
+    """
+
+    def __init__(self, intervals):
+        self.intervals = [(int(start), int(end)) for start, end in intervals]
+        self.trimmed_starts = []
+        position = 0
+        for start, end in self.intervals:
+            self.trimmed_starts.append(position)
+            position += end - start
+        self.trimmed_duration = position
+
+    def to_original(self, ms, is_end=False):
+        """将去除静音后的时间换算为原音频时间；is_end 为 True 时，区间交界处归属前一个区间"""
+        if not self.intervals:
+            return ms
+        index = bisect.bisect_right(self.trimmed_starts, ms) - 1
+        if is_end and index > 0 and ms == self.trimmed_starts[index]:
+            index -= 1
+        index = max(index, 0)
+        start, end = self.intervals[index]
+        return min(start + ms - self.trimmed_starts[index], end)
+
+    def to_dict(self):
+        return {'intervals': self.intervals}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['intervals'])
+
+
+def _decode_command(media_path):
+    return [
+        'ffmpeg', '-i', media_path, '-vn',
+        '-ac', '1', '-ar', str(SAMPLE_RATE),
+        '-f', 's16le', '-loglevel', 'quiet', '-'
+    ]
+
+
+def _iter_pcm_chunks(media_path):
+    """以固定大小的块流式读取解码后的 PCM 采样"""
+    chunk_bytes = SAMPLE_RATE * FRAME_MS // 1000 * CHUNK_FRAMES * 2
+    process = subprocess.Popen(_decode_command(media_path), stdout=subprocess.PIPE)
+    try:
+        pending = b''
+        while True:
+            data = process.stdout.read(chunk_bytes)
+            if not data:
+                break
+            data = pending + data
+            usable = len(data) - len(data) % 2
+            pending = data[usable:]
+            yield np.frombuffer(data[:usable], dtype='<i2')
+    finally:
+        process.stdout.close()
+        if process.wait() != 0:
+            raise RuntimeError(f"音频解码失败：{media_path}")
+
+
+def frame_energies(media_path):
+    """计算每 FRAME_MS 毫秒一帧的能量（dBFS）"""
+    frame_len = SAMPLE_RATE * FRAME_MS // 1000
+    energies = []
+    pending = np.zeros(0, dtype=np.float32)
+    for chunk in _iter_pcm_chunks(media_path):
+        samples = np.concatenate([pending, chunk.astype(np.float32) / 32768.0])
+        n_frames = len(samples) // frame_len
+        frames = samples[:n_frames * frame_len].reshape(n_frames, frame_len)
+        rms = np.sqrt(np.mean(frames ** 2, axis=1))
+        energies.append(20 * np.log10(rms + 1e-10))
+        pending = samples[n_frames * frame_len:]
+    return np.concatenate(energies) if energies else np.zeros(0)
+
+
+def detect_speech(energies, margin_db=10.0, min_speech_ms=250, min_silence_ms=1500, pad_ms=200):
+    """
+    基于能量阈值检测语音区间：以第 10 百分位能量估计底噪，高于底噪 margin_db 的帧视为语音，
+    间隔短于 min_silence_ms 的语音区间合并，短于 min_speech_ms 的孤立区间丢弃，最后两端各扩展 pad_ms。
+
+    返回:
+        [(开始毫秒, 结束毫秒), ...]
+    """
+    if len(energies) == 0:
+        return []
+    total_ms = len(energies) * FRAME_MS
+    noise_floor = np.percentile(energies, 10)
+    speech_level = np.percentile(energies, 90)
+    # 几乎没有动态范围时（全程讲话或全程噪声）无法可靠区分静音，整段保留
+    if speech_level - noise_floor < margin_db:
+        return [(0, total_ms)]
+
+    speech = (energies > noise_floor + margin_db).astype(np.int8)
+    edges = np.diff(np.concatenate([[0], speech, [0]]))
+    starts = np.flatnonzero(edges == 1) * FRAME_MS
+    ends = np.flatnonzero(edges == -1) * FRAME_MS
+
+    regions = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        if regions and start - regions[-1][1] < min_silence_ms:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+
+    padded = []
+    for start, end in regions:
+        if end - start < min_speech_ms:
+            continue
+        start, end = max(0, start - pad_ms), min(total_ms, end + pad_ms)
+        if padded and start <= padded[-1][1]:
+            padded[-1][1] = end
+        else:
+            padded.append([start, end])
+    return [tuple(region) for region in padded]
+
+
+def build_offset_map(regions, total_ms, keep_silence_ms=300):
+    """语音区间后保留 keep_silence_ms 的原始静音作为句间停顿，其余静音删除"""
+    intervals = []
+    for i, (start, end) in enumerate(regions):
+        next_start = regions[i + 1][0] if i + 1 < len(regions) else total_ms
+        intervals.append((start, min(end + keep_silence_ms, next_start)))
+    return OffsetMap(intervals)
+
+
+def _write_trimmed(media_path, output_path, offset_map, profile):
+    """第二次流式解码，只把保留区间的采样写入编码器"""
+    command = [
+        'ffmpeg', '-f', 's16le', '-ar', str(SAMPLE_RATE), '-ac', '1', '-i', '-',
+        *audio_encode_args(profile),
+        '-loglevel', 'quiet', '-y', output_path
+    ]
+    ranges = [(start * SAMPLE_RATE // 1000, end * SAMPLE_RATE // 1000) for start, end in offset_map.intervals]
+    encoder = subprocess.Popen(command, stdin=subprocess.PIPE)
+    try:
+        position = 0
+        index = 0
+        for chunk in _iter_pcm_chunks(media_path):
+            chunk_end = position + len(chunk)
+            while index < len(ranges) and ranges[index][0] < chunk_end:
+                start, end = ranges[index]
+                lo, hi = max(start, position), min(end, chunk_end)
+                if hi > lo:
+                    encoder.stdin.write(chunk[lo - position:hi - position].tobytes())
+                if end > chunk_end:
+                    break
+                index += 1
+            position = chunk_end
+    finally:
+        encoder.stdin.close()
+        if encoder.wait() != 0:
+            raise RuntimeError(f"去除静音后的音频编码失败：{output_path}")
+
+
+def trim_silence(audio_path, keep_silence_ms=None, min_saving=0.05):
+    """
+    对待上传的音频做语音活动检测并删除静音。
+    时间映射保存在输出音频旁的 .vad.json 中，源音频和参数不变时直接复用。
+
+    返回:
+        (待上传的音频路径, OffsetMap)；节省比例低于 min_saving 时返回 (audio_path, None)
+    """
+    keep_silence_ms = keep_silence_ms if keep_silence_ms is not None else int(os.getenv('asr_vad_keep_silence_ms', '300'))
+    margin_db = float(os.getenv('asr_vad_margin_db', '10'))
+    profile = get_asr_audio_profile()
+    root = os.path.splitext(audio_path)[0]
+    output_path = f"{root}.vad.{profile['ext']}"
+    map_path = f"{root}.vad.json"
+    params = {'keep_silence_ms': keep_silence_ms, 'margin_db': margin_db, 'profile': profile['name']}
+    signature = file_signature(audio_path)
+
+    if os.path.isfile(map_path):
+        with open(map_path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached.get('source_signature') == signature and cached.get('params') == params:
+            if cached.get('skipped'):
+                return audio_path, None
+            if os.path.isfile(output_path):
+                return output_path, OffsetMap.from_dict(cached)
+
+    start_time = time.time()
+    energies = frame_energies(audio_path)
+    total_ms = len(energies) * FRAME_MS
+    regions = detect_speech(energies, margin_db=margin_db)
+    offset_map = build_offset_map(regions, total_ms, keep_silence_ms)
+    skipped = total_ms == 0 or offset_map.trimmed_duration > total_ms * (1 - min_saving)
+    if not skipped:
+        _write_trimmed(audio_path, output_path, offset_map, profile)
+
+    with open(map_path, 'w', encoding='utf-8') as f:
+        json.dump({'source_signature': signature, 'params': params, 'skipped': skipped,
+                   'original_ms': total_ms, **offset_map.to_dict()}, f, ensure_ascii=False)
+
+    add_metric('vad_seconds', round(time.time() - start_time, 3))
+    add_metric('vad_original_seconds', round(total_ms / 1000, 3))
+    add_metric('vad_kept_seconds', round((total_ms if skipped else offset_map.trimmed_duration) / 1000, 3))
+    if skipped:
+        return audio_path, None
+    return output_path, offset_map
+
+
+def trim_segments_silence(segments, max_workers=None):
+    """并行去除各音频分段中的静音，返回带 time_map 的新分段列表"""
+    def trim(segment):
+        path, offset_map = trim_silence(segment['path'])
+        return dict(segment, path=path, time_map=offset_map)
+
+    max_workers = max_workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(segments)))) as executor:
+        return list(executor.map(run_in_context(trim), segments))
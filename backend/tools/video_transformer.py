@@ -11,101 +11,142 @@ import urllib
 import subprocess
 import io
 import os
+import threading
+from requests.adapters import HTTPAdapter
 from .util import *
-lfasr_host = 'https://raasr.xfyun.cn/v2/api'
+from .retry import retry
+from .media_info import (find_source_video, probe_media, output_is_current, record_output,
+                         get_asr_audio_profile, audio_encode_args)
+from .task_context import record_metric, add_metric, run_in_context
+from .asr_poller import get_asr_poller
+from .asr_backends import AsrBackend, register_asr_backend, get_asr_backend
+from .subtitles import SubtitleTrack
+from concurrent.futures import ThreadPoolExecutor
+# 转写服务地址，可通过配置 asr_xfyun_host 指向本地替身服务（standin_server.py）
+lfasr_host = os.getenv('asr_xfyun_host', 'https://raasr.xfyun.cn/v2/api')
 
 # 请求的接口名
 
 api_upload = '/upload'
 api_get_result = '/getResult'
 
-@retry_on_failure(max_retries=2)
+# 上传和查询的超时时间（连接, 读取），单位秒
+UPLOAD_TIMEOUT = (10, 600)
+QUERY_TIMEOUT = (10, 30)
+
+_asr_session = None
+_asr_session_lock = threading.Lock()
+
+
+def get_asr_session():
+    """所有转录请求共用一个带连接池的 Session，避免每次请求重新建立 TLS 连接"""
+    global _asr_session
+    with _asr_session_lock:
+        if _asr_session is None:
+            pool_size = max(4, int(os.getenv('asr_max_concurrency', '4')) * 2)
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _asr_session = session
+        return _asr_session
+
+# 讯飞接口可以直接接收的音频编码及对应的文件后缀，源音轨属于这些编码时可直接复制音频流
+STREAM_COPY_CODECS = {'mp3': 'mp3', 'aac': 'm4a', 'opus': 'opus', 'flac': 'flac'}
+
+
+def _can_stream_copy(media_info, profile):
+    """源音轨编码可被接口接收，且码率不超过上限时才复制音频流"""
+    if not profile['stream_copy'] or media_info.get('audio_codec') not in STREAM_COPY_CODECS:
+        return False
+    bit_rate = media_info.get('audio_bit_rate')
+    return bit_rate is not None and bit_rate <= profile['copy_max_bitrate']
+
+
+def build_audio_command(video_path, audio_path, profile, copy=False, start=None, duration=None):
+    """根据音频配置构建 FFmpeg 命令，start/duration（秒）用于只截取其中一段"""
+    command = ['ffmpeg']
+    if start is not None:
+        command += ['-ss', f'{start:.3f}']  # 放在 -i 之前，按关键帧快速定位
+    if duration is not None:
+        command += ['-t', f'{duration:.3f}']
+    command += ['-i', video_path, '-vn']  # 不包括视频
+    if copy:
+        command += ['-acodec', 'copy']
+    else:
+        command += audio_encode_args(profile)
+    command += [
+        '-loglevel', 'quiet',  # 完全静默，不输出任何信息
+        '-stats',  # 在静默模式下仍显示进度统计
+        '-y',  # 覆盖输出文件（如果存在）
+        audio_path  # 输出文件路径
+    ]
+    return command
+
+
+@retry()
 def generate_audio(path):
     """
-    批量将视频文件转换为音频文件。
-    
+    预处理任务文件夹内的源视频：探测一次流信息并缓存到 media_info.json，
+    同时按语音识别音频配置提取音频。已有与源视频对应的最新音频时直接跳过转码。
+    转码耗时和音频体积记录在当前步骤的指标中。
+
     参数:
-        video_dir (str): 包含视频文件的目录。
-        output_dir (str): 输出音频文件的目录。
+        path (str): 任务文件夹，包含上传的视频文件。
+    返回:
+        生成（或复用）的音频文件路径。
     """
-    # 检查输出目录是否存在，如果不存在则创建
-    if not os.path.exists(path):
-        os.makedirs(path)
-
-    for filename in os.listdir(path):
-        if filename.endswith(('.mp4', '.avi', '.mov', '.mkv')):  # 支持的文件格式
-            video_path = os.path.join(path, filename)
-            audio_path = os.path.join(path, 'audio.mp3')
-
-            # 构建 FFmpeg 命令
-            command = [
-                'ffmpeg',
-                '-i', video_path,
-                '-vn',  # 不包括视频
-                '-acodec', 'libmp3lame',  # 使用 MP3 编解码器
-                '-ab', '128k',  # 设置音频比特率
-                '-loglevel', 'quiet',  # 完全静默，不输出任何信息
-                '-stats',  # 在静默模式下仍显示进度统计
-                '-y',  # 覆盖输出文件（如果存在）
-                audio_path  # 输出文件路径
-            ]
-
-            # 执行 FFmpeg 命令
-            try:
-                subprocess.run(command, check=True)
-                print(f"转换完成：{audio_path}")
-            except subprocess.CalledProcessError as e:
-                print(f"转换失败：{filename}，错误：{e}")
-    return
-
-def convert_to_srt(data):
-    srt_lines = []
-    index = 1
-
-    for lattice in data['lattice2']:
-        begin = int(lattice['begin'])
-        end = int(lattice['end'])
-        sentence = []
-        start_time = begin
-        end_time = end
-
-        for segment in lattice['json_1best']['st']['rt']:
-            for word_segment in segment['ws']:
-                sentence.append(''.join([word['w'] for word in word_segment['cw']]))
-
-        # Join the sentence and format the time
-        full_sentence = ''.join(sentence)
-        start_time_srt = f"{start_time // 3600000:02d}:{(start_time % 3600000) // 60000:02d}:{(start_time % 60000) // 1000:02d},{start_time % 1000:03d}"
-        end_time_srt = f"{end_time // 3600000:02d}:{(end_time % 3600000) // 60000:02d}:{(end_time % 60000) // 1000:02d},{end_time % 1000:03d}"
-
-        srt_lines.append(f"{index}\n")
-        srt_lines.append(f"--> speaker: \n")
-        srt_lines.append(f"{start_time_srt} --> {end_time_srt}\n")
-        srt_lines.append(f"{full_sentence}\n")
-        srt_lines.append(f"\n")
-        index += 1
-    
-    subtitles = []
-
-    for i in range(len(srt_lines)//5):
-        j = 5*i
-        id = srt_lines[j][:-1]
-        speaker = srt_lines[j+1][13:-1]
-        time = srt_lines[j+2][:-1]
-        content = srt_lines[j+3][:-1]
-        start = time[:12]
-        end = time[17:]
-        subtitles.append({'id':id,'start':start,'end':end,'content':content,'speaker':speaker})
-    
-    return subtitles
+    video_path = find_source_video(path)
+    if video_path is None:
+        raise FileNotFoundError(f"未在 {path} 中找到视频文件")
+
+    media_info = probe_media(video_path)
+    if not media_info.get('audio_codec'):
+        raise ValueError(f"视频文件不包含音轨：{video_path}")
+
+    profile = get_asr_audio_profile()
+    copy = _can_stream_copy(media_info, profile)
+    ext = STREAM_COPY_CODECS[media_info['audio_codec']] if copy else profile['ext']
+    audio_path = os.path.join(path, f'audio.{ext}')
+    params = {'copy': True} if copy else {k: profile[k] for k in ('acodec', 'ab', 'ar', 'ac') if profile.get(k)}
+
+    record_metric('audio_profile', profile['name'])
+    record_metric('source_bytes', os.path.getsize(video_path))
+    if output_is_current(path, audio_path, 'audio', params):
+        print(f"音频已是最新，跳过转换：{audio_path}")
+        record_metric('audio_mode', 'cached')
+        record_metric('audio_bytes', os.path.getsize(audio_path))
+        return audio_path
+
+    # 执行 FFmpeg 命令，失败时抛出异常交由重试装饰器处理
+    start_time = time.time()
+    subprocess.run(build_audio_command(video_path, audio_path, profile, copy), check=True)
+    encode_seconds = time.time() - start_time
+
+    record_output(path, audio_path, 'audio', params, encode_seconds=round(encode_seconds, 3))
+    record_metric('audio_mode', 'copy' if copy else 'encode')
+    record_metric('encode_seconds', round(encode_seconds, 3))
+    record_metric('audio_bytes', os.path.getsize(audio_path))
+    print(f"转换完成：{audio_path}")
+    return audio_path
+
+def convert_to_srt(data, offset_ms=0, time_map=None):
+    """
+    将讯飞 orderResult 转换为字幕字典列表（兼容原接口），新代码请直接使用 SubtitleTrack。
+    offset_ms: 分段转录时该段音频在原视频中的起始时间（毫秒）
+    time_map: 去除静音后的音频时间到原音频时间的映射（OffsetMap），先于 offset_ms 应用
+    """
+    return SubtitleTrack.from_order_result(data, offset_ms, time_map).to_dicts()
 
 
 class RequestApi(object):
-    def __init__(self, appid, secret_key, audio_path, silent=True):
+    def __init__(self, appid, secret_key, audio_path, silent=True, duration=None):
         self.appid = appid
         self.secret_key = secret_key
         self.upload_file_path = audio_path
         self.silent = silent  # 添加静默模式
+        self.duration = duration  # 音频时长（秒），未知时沿用默认值
+        self.session = get_asr_session()
         self.ts = str(int(time.time()))
         self.signa = self.get_signa()
 
@@ -133,53 +174,160 @@ class RequestApi(object):
         param_dict['ts'] = self.ts
         param_dict["fileSize"] = file_len
         param_dict["fileName"] = file_name
-        param_dict["duration"] = "200"
-        data = open(upload_file_path, 'rb').read(file_len)
+        param_dict["duration"] = str(int(self.duration)) if self.duration else "200"
+        if os.getenv('asr_callback_url'):
+            # 讯飞在订单完成或失败时以 GET 请求通知该地址，携带 orderId 和 status
+            param_dict["callbackUrl"] = os.getenv('asr_callback_url')
 
-        response = requests.post(url=lfasr_host + api_upload + "?" + urllib.parse.urlencode(param_dict),
-                                 headers={"Content-type": "application/json"}, data=data)
+        # 直接以文件对象作为请求体，按块读取发送，内存占用与音频长度无关
+        # 讯飞 v2 接口不提供分片上传，整个文件在一个请求中流式发送
+        start_time = time.time()
+        with open(upload_file_path, 'rb') as data:
+            response = self.session.post(url=lfasr_host + api_upload + "?" + urllib.parse.urlencode(param_dict),
+                                         headers={"Content-type": "application/json"}, data=data,
+                                         timeout=UPLOAD_TIMEOUT)
+        add_metric('upload_bytes', file_len)
+        add_metric('upload_seconds', round(time.time() - start_time, 3))
         result = json.loads(response.text)
         return result
 
-    def get_result(self):
-        uploadresp = self.upload()
-        orderId = uploadresp['content']['orderId']
+    def query_params(self, order_id):
+        """查询结果的请求参数，每次重新生成时间戳和签名，避免长时间等待后签名过期"""
+        self.ts = str(int(time.time()))
+        self.signa = self.get_signa()
         param_dict = {}
         param_dict['appId'] = self.appid
         param_dict['signa'] = self.signa
         param_dict['ts'] = self.ts
-        param_dict['orderId'] = orderId
+        param_dict['orderId'] = order_id
         param_dict['resultType'] = "transfer,predict"
-        status = 3
-        # 建议使用回调的方式查询结果，查询接口有请求频率限制
-        while status == 3:
-            response = requests.post(url=lfasr_host + api_get_result + "?" + urllib.parse.urlencode(param_dict),
-                                     headers={"Content-type": "application/json"})
-            result = json.loads(response.text)
-            status = result['content']['orderInfo']['status']
-
-            if not self.silent:
-                print(f"处理状态: {status}, 订单ID: {orderId}")
-
-            if status == 4:
-                break
-            time.sleep(5)
-        return result
+        return param_dict
+
+    def submit(self):
+        """上传音频并把订单交给全局轮询器跟踪，返回 AsrOrder"""
+        uploadresp = self.upload()
+        if not (uploadresp.get('content') or {}).get('orderId'):
+            # 签名过期、频率超限等情况下没有订单号，按可重试的错误处理
+            raise RuntimeError(f"转录订单提交失败：{uploadresp.get('code')} {uploadresp.get('descInfo')}")
+        orderId = uploadresp['content']['orderId']
+        if not self.silent:
+            print(f"已提交转录订单: {orderId}")
+        # 建议使用回调的方式查询结果，查询接口有请求频率限制，由轮询器统一控制频率
+        poller = get_asr_poller(lfasr_host + api_get_result)
+        return poller.submit(orderId, lambda: self.query_params(orderId), self.duration)
+
+class XfyunOrder:
+    """讯飞订单，wait() 返回解析后的 orderResult"""
+
+    def __init__(self, order, record_dir=None, audio_path=None):
+        self.order = order
+        self.record_dir = record_dir
+        self.audio_path = audio_path
+
+    @property
+    def polls(self):
+        return self.order.polls
+
+    @property
+    def elapsed(self):
+        return self.order.elapsed
+
+    def wait(self, timeout=None):
+        result = self.order.wait(timeout)
+        # 解析嵌套的 JSON 字符串
+        order_result = json.loads(result['content']['orderResult'])
+        if self.record_dir:
+            # 录制转录结果，供回放服务使用
+            os.makedirs(self.record_dir, exist_ok=True)
+            stem = os.path.splitext(os.path.basename(self.audio_path))[0]
+            record_path = os.path.join(self.record_dir, f"{stem}-{self.order.order_id}.json")
+            with open(record_path, 'w', encoding='utf-8') as f:
+                json.dump(order_result, f, ensure_ascii=False)
+        return order_result
+
+
+@register_asr_backend('xfyun')
+class XfyunBackend(AsrBackend):
+    """讯飞录音文件转写服务，配置 asr_record_dir 时同时录制结果"""
+
+    def __init__(self):
+        self.appid = os.getenv("appid")
+        self.secret_key = os.getenv("secret_key")
+        self.record_dir = os.getenv('asr_record_dir')
+
+    def submit(self, audio_path, duration=None):
+        api = RequestApi(appid=self.appid,
+                         secret_key=self.secret_key,
+                         audio_path=audio_path,
+                         silent=True,
+                         duration=duration
+                         )
+        return XfyunOrder(api.submit(), self.record_dir, audio_path)
+
+
+def _wait_order(order):
+    order_result = order.wait()
+    add_metric('asr_polls', order.polls)
+    add_metric('asr_wait_seconds', round(order.elapsed, 3))
+    return order_result
+
+
+@retry()
+def generate_subtitles(audio_path, time_map=None, duration=None, backend=None):
+    """backend: 转录服务，默认按配置 asr_backend 选择"""
+    backend = backend or get_asr_backend()
+    order_result = _wait_order(backend.submit(audio_path, duration))
+    return SubtitleTrack.from_order_result(order_result, time_map=time_map)
 
-@retry_on_failure(max_retries=2)
-def generate_subtitles(audio_path):
-    api = RequestApi(appid=os.getenv("appid"),
-                     secret_key=os.getenv("secret_key"),
-                     audio_path=audio_path,
-                     silent=True
-                     )
-    result = api.get_result()
-    # with open(f"middle_result.json", 'w', encoding="utf-8") as f:
-    #     json.dump(result, f, ensure_ascii=False, indent=4)
-
-    
-    # 解析嵌套的 JSON 字符串
-    order_result = json.loads(result['content']['orderResult'])
-    # print("Parsed orderResult:", order_result)
-    subtitles = convert_to_srt(order_result)
-    return subtitles
\ No newline at end of file
+
+def _segment_duration(segment):
+    time_map = segment.get('time_map')
+    return time_map.trimmed_duration / 1000 if time_map else segment['end'] - segment['start']
+
+
+def _segment_subtitles(segment, order_result):
+    return SubtitleTrack.from_order_result(order_result, offset_ms=int(round(segment['start'] * 1000)),
+                                           time_map=segment.get('time_map'))
+
+
+@retry()
+def transcribe_segment(segment, backend=None):
+    """转录单个音频分段，时间戳换算回原视频时间"""
+    backend = backend or get_asr_backend()
+    return _segment_subtitles(segment, _wait_order(backend.submit(segment['path'], _segment_duration(segment))))
+
+
+def generate_subtitles_segmented(segments, max_workers=None, backend=None):
+    """
+    将各音频分段作为独立订单并发提交转录，再按时间顺序拼接为一条字幕轨。
+    上传使用少量线程，提交后的订单由转录服务统一等待；
+    失败的分段单独重新转录，仍失败时整体失败，由上层决定是否重试。
+    """
+    backend = backend or get_asr_backend()
+    max_workers = max_workers or int(os.getenv('asr_max_concurrency', '4'))
+
+    def submit(segment):
+        try:
+            return backend.submit(segment['path'], _segment_duration(segment))
+        except Exception as e:
+            print(f"分段上传失败：{segment['path']}，{e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(segments)))) as executor:
+        orders = list(executor.map(run_in_context(submit), segments))
+
+    subtitles = SubtitleTrack()
+    for segment, order in zip(segments, orders):
+        part = None
+        if order is not None:
+            try:
+                part = _segment_subtitles(segment, _wait_order(order))
+            except Exception as e:
+                print(f"分段转录失败：{segment['path']}，{e}")
+        if part is None:
+            part = transcribe_segment(segment, backend)
+        if part is None:
+            raise RuntimeError(f"分段转录失败：{segment['path']}")
+        subtitles.extend(part)
+    add_metric('asr_orders', len(segments))
+    return subtitles
@@ -4,6 +4,7 @@ import random
 import string
 import re
 from datetime import datetime
+from tools.llm_usage import usage_from_metrics
 
 # 支持的文件格式
 ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv', 'flv', 'wmv'}
@@ -66,6 +67,10 @@ def get_task_status(folder_path):
     if 'completion' in progress_data:
         if progress_data['completion']['status'] == 'success':
             return "分析完成"
+        elif progress_data['completion']['status'] == 'batch_pending':
+            return "等待批量处理"
+        elif progress_data['completion']['status'] == 'requeued':
+            return "等待服务恢复"
         else:
             return "分析失败"
     
@@ -107,6 +112,13 @@ def get_task_progress(folder_path):
         "current_step_name": latest_entry.get('step_name', '进行中')
     }
 
+def get_task_usage(folder_path):
+    """获取任务的模型用量汇总，旧任务的日志中没有汇总时从步骤指标计算"""
+    progress_data = read_progress_log(folder_path)
+    if not progress_data:
+        return usage_from_metrics({})
+    return progress_data.get('llm_usage') or usage_from_metrics(progress_data.get('stage_metrics'))
+
 def scan_existing_tasks(data_dir):
     """扫描现有任务（包括已完成的任务）"""
     tasks = {}